@@ -71,7 +71,8 @@ class PreprocessedCorpus(object):
 
 def nosplit(path: str, extensions: Optional[str] = None, no_spaces: bool = False, no_unicode: bool = False,
             no_com: bool = False, no_str: bool = False, full_strings: bool = False, max_str_length: int = sys.maxsize,
-            output_path: Optional[str] = None, calc_vocab=False, suppress_caching=False) -> PreprocessedCorpus:
+            output_path: Optional[str] = None, calc_vocab=False, approx_vocab=False,
+            suppress_caching=False) -> PreprocessedCorpus:
     """
     Split corpus at `path` into tokens leaving compound identifiers as they are.
 
@@ -86,6 +87,9 @@ def nosplit(path: str, extensions: Optional[str] = None, no_spaces: bool = False
     :param full_strings: do not split string literals even on whitespace characters. Does not have effect if `no_str` is set to `True`
     :param max_str_length: replace string literal with `""` if its length including quotes exceeds `max_str_length`.
     Does not have effect if `no_str` is set to `True`
+    :param approx_vocab: set to True to calculate the vocabulary approximately in bounded memory:
+    only the most frequent words are kept and their counts, as well as the vocabulary size, are estimated.
+    Implies `calc_vocab`=`True`
 
     :return: `PreprocessedDataset` object which holds metadata of the preprocessed dataset
 
@@ -99,12 +103,14 @@ def nosplit(path: str, extensions: Optional[str] = None, no_spaces: bool = False
     prep_config= create_prep_config('nosplit', no_spaces=no_spaces, no_unicode=no_unicode, no_com=no_com, no_str=no_str,
                                     full_strings=full_strings, max_str_length=max_str_length)
     return preprocess_corpus(path, prep_config, extensions=extensions,
-                             output_path=output_path, calc_vocab=calc_vocab, suppress_caching=suppress_caching)
+                             output_path=output_path, calc_vocab=calc_vocab, approx_vocab=approx_vocab,
+                             suppress_caching=suppress_caching)
 
 
 def chars(path: str, extensions: Optional[str] = None, no_spaces: bool = False, no_unicode: bool = False,
           no_com: bool = False, no_str: bool = False, max_str_length=sys.maxsize,
-          output_path: Optional[str] = None, calc_vocab=False, suppress_caching=False) -> PreprocessedCorpus:
+          output_path: Optional[str] = None, calc_vocab=False, approx_vocab=False,
+          suppress_caching=False) -> PreprocessedCorpus:
     """
     Split corpus at `path` into characters (With the exception of operators that consist of 2 character: such operators will remain as a single token).
     So that the information about original word boundaries is not lost, special tokens are inserted to denote original words beginnings and ends,
@@ -120,6 +126,9 @@ def chars(path: str, extensions: Optional[str] = None, no_spaces: bool = False,
     :param no_str: set to True to replace each string literals with a special token, e.g <str_literal>.
     :param max_str_length: replace string literal with `""` if its length including quotes exceeds `max_str_length`.
     Does not have effect if `no_str` is set to `True`
+    :param approx_vocab: set to True to calculate the vocabulary approximately in bounded memory:
+    only the most frequent words are kept and their counts, as well as the vocabulary size, are estimated.
+    Implies `calc_vocab`=`True`
 
     :return: `PreprocessedDataset` object which holds metadata of the preprocessed dataset
 
@@ -133,13 +142,14 @@ def chars(path: str, extensions: Optional[str] = None, no_spaces: bool = False,
     prep_config= create_prep_config('chars', no_spaces=no_spaces, no_unicode=no_unicode, no_com=no_com,
                                     no_str=no_str, max_str_length=max_str_length)
     return preprocess_corpus(path, prep_config, '0', extensions=extensions, output_path=output_path,
-                             calc_vocab=calc_vocab, suppress_caching=suppress_caching)
+                             calc_vocab=calc_vocab, approx_vocab=approx_vocab,
+                             suppress_caching=suppress_caching)
 
 
 def basic(path: str, extensions: Optional[str] = None, split_numbers: bool = False, ronin = False, stem: bool = False,
           no_spaces: bool = False, no_unicode: bool = False, no_case: bool = False, no_com: bool = False,
           no_str: bool = False, max_str_length=sys.maxsize, output_path: Optional[str] = None,
-          calc_vocab=False, suppress_caching=False) -> PreprocessedCorpus:
+          calc_vocab=False, approx_vocab=False, suppress_caching=False) -> PreprocessedCorpus:
     """
     Split corpus at `path` into tokens converting identifiers that follow CamelCase or snake_case into multiple subwords.
     So that the information about original word boundaries is not lost, special tokens are inserted to denote original words beginnings and ends,
@@ -163,6 +173,9 @@ def basic(path: str, extensions: Optional[str] = None, split_numbers: bool = Fal
     :param no_str: set to True to replace each string literals with a special token, e.g <str_literal>.
     :param max_str_length: replace string literal with `""` if its length including quotes exceeds `max_str_length`.
     Does not have effect if `no_str` is set to `True`
+    :param approx_vocab: set to True to calculate the vocabulary approximately in bounded memory:
+    only the most frequent words are kept and their counts, as well as the vocabulary size, are estimated.
+    Implies `calc_vocab`=`True`
 
     :return: `PreprocessedDataset` object which holds metadata of the preprocessed dataset
 
@@ -177,13 +190,14 @@ def basic(path: str, extensions: Optional[str] = None, split_numbers: bool = Fal
                                      no_com=no_com, no_str=no_str, max_str_length=max_str_length,
                                      split_numbers=split_numbers or stem or ronin, ronin=ronin or stem, stem=stem)
     return preprocess_corpus(path, prep_config, extensions=extensions, output_path=output_path,
-                             calc_vocab=calc_vocab, suppress_caching=suppress_caching)
+                             calc_vocab=calc_vocab, approx_vocab=approx_vocab,
+                             suppress_caching=suppress_caching)
 
 
 def bpe(path: str, bpe_codes_id: str, extensions: Optional[str] = None, no_spaces: bool = False,
         no_unicode: bool = False, no_com: bool = False, no_str: bool = False,
         max_str_length=sys.maxsize, output_path: Optional[str] = None,
-        calc_vocab=False, suppress_caching=False) -> PreprocessedCorpus:
+        calc_vocab=False, approx_vocab=False, suppress_caching=False) -> PreprocessedCorpus:
     """
     Split corpus at `path` into tokens converting identifiers that follow CamelCase or snake_case into multiple subwords.
     On top of that Byte Pair Encoding (BPE) is applied with number of merges specified in `bpe_config`.
@@ -205,6 +219,9 @@ def bpe(path: str, bpe_codes_id: str, extensions: Optional[str] = None, no_space
     :param no_str: set to True to replace each string literals with a special token, e.g <str_literal>.
     :param max_str_length: replace string literal with `""` if its length including quotes exceeds `max_str_length`.
     Does not have effect if `no_str` is set to `True`
+    :param approx_vocab: set to True to calculate the vocabulary approximately in bounded memory:
+    only the most frequent words are kept and their counts, as well as the vocabulary size, are estimated.
+    Implies `calc_vocab`=`True`
 
     :return: `PreprocessedDataset` object which holds metadata of the preprocessed dataset
 
@@ -219,12 +236,14 @@ def bpe(path: str, bpe_codes_id: str, extensions: Optional[str] = None, no_space
                                     no_com=no_com, no_str=no_str, max_str_length=max_str_length)
     return preprocess_corpus(path, prep_config, bpe_codes_id,
                              extensions=extensions, output_path=output_path,
-                             calc_vocab=calc_vocab, suppress_caching=suppress_caching)
+                             calc_vocab=calc_vocab, approx_vocab=approx_vocab,
+                             suppress_caching=suppress_caching)
 
 
 def preprocess_corpus(path: str, prep_config: PrepConfig, bpe_codes_id: Optional[str]=None,
                       extensions: Optional[str]=None, output_path: Optional[str]=None,
-                      calc_vocab: Optional[bool]=False, suppress_caching: bool=False) -> PreprocessedCorpus:
+                      calc_vocab: Optional[bool]=False, approx_vocab: bool=False,
+                      suppress_caching: bool=False) -> PreprocessedCorpus:
     output_path = output_path or os.getcwd()
     custom_bpe_config = None
     if prep_config.is_bpe():
@@ -234,7 +253,10 @@ def preprocess_corpus(path: str, prep_config: PrepConfig, bpe_codes_id: Optional
 
     dataset = Dataset.create(str(path), prep_config, extensions, custom_bpe_config,
                              overriden_path_to_prep_dataset=output_path, suppress_caching=suppress_caching)
-    if calc_vocab:
+    if approx_vocab:
+        stages.run_until_vocab(dataset, custom_bpe_config, approximate=True)
+        path_to_vocab = dataset.path_to_approx_vocab_file
+    elif calc_vocab:
         stages.run_until_vocab(dataset, custom_bpe_config)
         path_to_vocab = dataset.path_to_vocab_file
     else:
@@ -4,24 +4,38 @@
 
 import logging
 import os
-import sys
+from heapq import heappush, heappop
 
 import argparse
-from typing import List, Dict
+from typing import List, Dict, Optional, Mapping
 
-from tqdm import tqdm
-
-from codeprep.bpepkg.merge import MergeList, read_merges
-from codeprep.config import DEFAULT_BPE_DIR
+from codeprep.bpepkg.cache import BpeCache, BpeCacheStats
+from codeprep.bpepkg.merge import MergeList, read_merges, Merge
+from codeprep.config import DEFAULT_BPE_DIR, BPE_CACHE_MAX_SIZE
 
 logger = logging.getLogger(__name__)
 
 
 class BpeData(object):
-    def __init__(self, merges_cache=None, merges: MergeList=None):
+    def __init__(self, merges_cache=None, merges: MergeList=None, cache_max_size: int=BPE_CACHE_MAX_SIZE):
+        self.cache_max_size = cache_max_size
         self.merges_cache = merges_cache
         self.merges = merges
 
+    @property
+    def merges_cache(self) -> Optional[Mapping[str, List[str]]]:
+        return self.cache.precomputed
+
+    @merges_cache.setter
+    def merges_cache(self, merges_cache: Optional[Mapping[str, List[str]]]) -> None:
+        """
+        Words from `merges_cache` are never evicted. Words encoded in this process are cached on top of them.
+        """
+        self.cache = BpeCache(merges_cache, self.cache_max_size)
+
+    def cache_stats(self) -> BpeCacheStats:
+        return self.cache.stats()
+
 
 ESCAPE_CHAR = '@'
 
@@ -37,10 +51,17 @@ def escape(word: str, merged: bool=False) -> str:
 
 
 def unescape(parts: List[str]):
+    """
+    >>> parts = ['a@@', 'b@']
+    >>> unescape(parts)
+    ['a@', 'b']
+    >>> parts
+    ['a@@', 'b@']
+    """
     if parts[-1][-1] != ESCAPE_CHAR:
         raise ValueError(f"There should be {ESCAPE_CHAR} at the end, however this is what was passed: {parts}")
 
-    parts[-1] = parts[-1][:-1]
+    parts = parts[:-1] + [parts[-1][:-1]]
     return list(map(lambda p: p.replace(ESCAPE_CHAR + '@', ESCAPE_CHAR), parts))
 
 
@@ -59,55 +80,84 @@ def to_char_list(word: str):
     return res
 
 
+def merge_subwords(subwords: List[str], merges: MergeList) -> List[str]:
+    """
+    Applies `merges` to `subwords` in priority order. Subwords are kept in a doubly-linked list of symbol ids
+    and candidate pairs in a heap keyed by (priority, position), so that each merge costs O(log n).
+    All candidates with the same priority are taken from the heap at once and applied left to right,
+    which gives exactly the same result as merging all the non-overlapping occurrences
+    of the best pair round by round.
+
+    >>> merges = MergeList().append(Merge(('a', 'a'))).append(Merge(('aa', 'a'))).append(Merge(('a', '@')))
+    >>> merge_subwords(['a', 'a', 'a', 'a', 'a', '@'], merges)
+    ['aa', 'aaa', '@']
+
+    >>> merge_subwords(['b', 'a', 'a', 'a'], merges)
+    ['b', 'aaa']
+
+    >>> merge_subwords([''], merges)
+    ['']
+    """
+    symbols: List[Optional[str]] = list(subwords)
+    # symbols that are not in the merge list cannot be merged, they all get id -1
+    ids = [merges.symbol_to_id(s) for s in symbols]
+    ids = [-1 if i is None else i for i in ids]
+    next_idx = list(range(1, len(symbols))) + [-1]
+    prev_idx = list(range(-1, len(symbols) - 1))
+    ranks = merges.rank_table
+
+    candidates = []
+
+    def push_candidate(left: int) -> None:
+        right = next_idx[left]
+        if right != -1:
+            rank = ranks.get((ids[left], ids[right]))
+            if rank is not None:
+                heappush(candidates, (rank, left, ids[left], ids[right]))
+
+    for i in range(len(symbols) - 1):
+        push_candidate(i)
+
+    while candidates:
+        priority = candidates[0][0]
+        same_priority_candidates = []
+        while candidates and candidates[0][0] == priority:
+            same_priority_candidates.append(heappop(candidates))
+
+        merged_id = merges.get_merged_symbol_id(priority)
+        merged = []
+        for _, left, left_id, right_id in same_priority_candidates:
+            right = next_idx[left]
+            if right == -1 or ids[left] != left_id or ids[right] != right_id:
+                # the pair has been destroyed by one of the previous merges
+                continue
+            ids[left] = merged_id
+            symbols[left] = merges.id_to_symbol(merged_id)
+            ids[right] = -1
+            symbols[right] = None
+            next_idx[left] = next_idx[right]
+            if next_idx[right] != -1:
+                prev_idx[next_idx[right]] = left
+            merged.append(left)
+
+        # new candidates are pushed only after all the merges with the current priority are done,
+        # pairs starting at merged subwords cover the pairs ending at the next merged subwords
+        last_merged = -1
+        for left in merged:
+            if prev_idx[left] != -1 and prev_idx[left] != last_merged:
+                push_candidate(prev_idx[left])
+            push_candidate(left)
+            last_merged = left
+
+    return [s for s in symbols if s is not None]
+
+
 def encode(words: Dict[str, int], merges: MergeList) -> Dict[str, int]:
     letters_list = {" ".join(to_char_list(k)): v for k, v in words.items()}
 
     new_letters_list = {}
     for letters, freq in letters_list.items():
-        subwords = letters.split(" ")
-
-        show_bpe_progress_bar = False
-        if len(subwords) > 5000:
-            logger.warning(f'Encountered a string of length {len(subwords)}. It will take a while to bpe-encode it.')
-            show_bpe_progress_bar = True
-
-        if show_bpe_progress_bar:
-            bpe_progress = tqdm(total=len(merges))
-            last_value = 0
-        while True:
-            merge_indices = []
-            merge_candidate_priority = sys.maxsize
-            for i in range(len(subwords) - 1):
-                merge_candidate = (subwords[i], subwords[i + 1])
-                if merge_candidate in merges:
-                    current_merge_candidate_priority = merges.get_priority(merge_candidate)
-                    if current_merge_candidate_priority < merge_candidate_priority:
-                        merge_candidate_priority = current_merge_candidate_priority
-                        merge_indices = [i]
-                    elif current_merge_candidate_priority == merge_candidate_priority:
-                        if not merge_indices or merge_indices[-1] != i - 1:
-                            merge_indices.append(i)
-
-            if not merge_indices:
-                break
-
-            subwords_after_this_merge_round = []
-            start_idx = 0
-            for merge_index in merge_indices:
-                for i in range(start_idx, merge_index):
-                    subwords_after_this_merge_round.append(subwords[i])
-                subwords_after_this_merge_round.append(subwords[merge_index] + subwords[merge_index + 1])
-                start_idx = merge_index + 2
-            for i in range(start_idx, len(subwords)):
-                subwords_after_this_merge_round.append(subwords[i])
-            subwords = subwords_after_this_merge_round
-            if show_bpe_progress_bar:
-                bpe_progress.update(merge_candidate_priority - last_value)
-                last_value = merge_candidate_priority
-        if show_bpe_progress_bar:
-            bpe_progress.update(len(merges) - last_value)
-            bpe_progress.close()
-
+        subwords = merge_subwords(letters.split(" "), merges)
         new_letters_list[" ".join(subwords)] = freq
     return new_letters_list
 
@@ -148,13 +198,19 @@ def encode_word(word: str, merges: MergeList) -> List[str]:
 
 
 def get_bpe_subwords(word: str, bpe_data: BpeData) -> List[str]:
-    merges = bpe_data.merges
-    cache = bpe_data.merges_cache
+    """
+    >>> merges = MergeList().append(Merge(('b', '@'))).append(Merge(('a', 'b@'))).append(Merge(('a', 'b')))
+    >>> bpe_data = BpeData(merges_cache={'x@': ['x@']}, merges=merges)
+    >>> get_bpe_subwords('abab', bpe_data), get_bpe_subwords('abab', bpe_data), get_bpe_subwords('x', bpe_data)
+    (['ab', 'ab'], ['ab', 'ab'], ['x'])
+    >>> bpe_data.cache_stats()
+    BpeCacheStats(hits=2, misses=1, evictions=0, size=1, max_size=1000000)
+    """
     word = escape(word, merged=True)
-    if word in cache:
-        result = cache[word]
-    else:
-        result = encode_word(word, merges)
+    result = bpe_data.cache.get(word)
+    if result is None:
+        result = encode_word(word, bpe_data.merges)
+        bpe_data.cache.put(word, result)
 
     return unescape(result)
 
@@ -3,17 +3,25 @@
 # SPDX-License-Identifier: Apache-2.0
 
 import collections
+import itertools
 import logging
+import time
+from array import array
+from multiprocessing import Process, Pipe
+from multiprocessing.connection import Connection
 
 import regex
 from tqdm import tqdm
-from typing import Dict, List, Tuple, Set
+from typing import Dict, List, Tuple, Set, Iterable, Callable, Optional
 
 from codeprep.bpepkg.merge import Merge, MergeList
+from codeprep.config import BPE_CHECKPOINT_EVERY_SECONDS
 from codeprep.util import PriorityCounter
 
 logger = logging.getLogger(__name__)
 
+GET_WORDS_TASK = 'get_words'
+
 # ======== BPE algo itself
 
 
@@ -114,6 +122,346 @@ def do_merges(vocab: Dict[str, int], n_merges: int) -> Tuple[Dict[str, int], Mer
             pairs.add(*p)
     return vocab, merges
 
+
+class SplitVocab(object):
+    """
+    Words split into subwords with their frequencies. Subwords are stored as ids in a symbol table,
+    which grows as merges are done, so that each word takes a compact array of integers.
+
+    >>> split_vocab = SplitVocab.from_dict({'w o r d @': 7, 'w o g @': 13})
+    >>> split_vocab.words[1], split_vocab.freqs[1]
+    (array('I', [0, 1, 5, 4]), 13)
+    >>> split_vocab.to_dict()
+    {'w o r d @': 7, 'w o g @': 13}
+    """
+    def __init__(self):
+        self.symbols: List[str] = []
+        self.symbol_ids: Dict[str, int] = {}
+        self.words: List[array] = []
+        self.freqs = array('q')
+
+    @classmethod
+    def from_dict(cls, vocab: Dict[str, int]) -> 'SplitVocab':
+        split_vocab = cls()
+        for word, freq in vocab.items():
+            split_vocab.add(word.split(' '), freq)
+        return split_vocab
+
+    def intern(self, symbol: str) -> int:
+        symbol_id = self.symbol_ids.get(symbol)
+        if symbol_id is None:
+            symbol_id = len(self.symbols)
+            self.symbol_ids[symbol] = symbol_id
+            self.symbols.append(symbol)
+        return symbol_id
+
+    def add(self, subwords: List[str], freq: int) -> None:
+        self.words.append(array('I', map(self.intern, subwords)))
+        self.freqs.append(freq)
+
+    def to_dict(self) -> Dict[str, int]:
+        vocab = {}
+        for word, freq in zip(self.words, self.freqs):
+            vocab[' '.join(self.symbols[symbol_id] for symbol_id in word)] = freq
+        return vocab
+
+    def __len__(self):
+        return len(self.words)
+
+
+def merge_pair_in_word(pair: Tuple[int, int], merged: int, symbols: array, freq: int) -> Tuple[array, List]:
+    """
+    Replaces all the occurrences of `pair` in the word split into `symbols` with `merged` left to right.
+    Returns the new split and the changes of pair frequencies in the same order as `merge_vocab` does.
+
+    >>> merge_pair_in_word((0, 1), 5, array('I', [0, 1, 2, 3, 4]), 7)
+    (array('I', [5, 2, 3, 4]), [((5, 2), 7), ((1, 2), -7)])
+    >>> merge_pair_in_word((0, 0), 5, array('I', [0, 0, 0, 0, 0, 4]), 3)
+    (array('I', [5, 5, 0, 4]), [((5, 0), 3), ((5, 5), 3), ((5, 0), -3), ((5, 0), 3)])
+    """
+    first, second = pair
+    new_symbols = array('I')
+    added_pairs = []
+    n_symbols = len(symbols)
+    i = 0
+    while i < n_symbols:
+        if i + 1 < n_symbols and symbols[i] == first and symbols[i + 1] == second:
+            if new_symbols:
+                subtoken_before = new_symbols[-1]
+                added_pairs.append(((subtoken_before, merged), freq))
+                if pair != (subtoken_before, first):
+                    added_pairs.append(((subtoken_before, first), -freq))
+            if i + 2 < n_symbols:
+                subtoken_after = symbols[i + 2]
+                added_pairs.append(((merged, subtoken_after), freq))
+                if pair != (second, subtoken_after):
+                    added_pairs.append(((second, subtoken_after), -freq))
+            new_symbols.append(merged)
+            i += 2
+        else:
+            new_symbols.append(symbols[i])
+            i += 1
+    return new_symbols, added_pairs
+
+
+class PairIndex(object):
+    """
+    Index from each pair of symbol ids to the words containing it.
+    Merging a pair touches only the words that contain it.
+    """
+    def __init__(self, words: List[array], freqs: array):
+        self.words = words
+        self.freqs = freqs
+        self._index: Dict[Tuple[int, int], Set[int]] = collections.defaultdict(set)
+
+    def count_pairs(self) -> Dict[Tuple[int, int], int]:
+        """
+        Builds the index and returns pair frequencies.
+        Pairs are counted in the same order as in `get_stats`, so that ties are broken the same way.
+        """
+        pair_counts = collections.defaultdict(int)
+        for word_idx, word in enumerate(self.words):
+            freq = self.freqs[word_idx]
+            for pair in zip(word, word[1:]):
+                pair_counts[pair] += freq
+                self._index[pair].add(word_idx)
+        return pair_counts
+
+    def merge(self, pair: Tuple[int, int], merged: int) -> List[Tuple[Tuple[int, int], int]]:
+        """
+        Replaces `pair` with `merged` in all the words and returns the changes of pair frequencies
+        in the same order as `merge_vocab` does.
+        """
+        pair_changes = []
+        for word_idx in sorted(self._index.pop(pair, ())):
+            old_word = self.words[word_idx]
+            new_word, added_pairs = merge_pair_in_word(pair, merged, old_word, self.freqs[word_idx])
+            pair_changes.extend(added_pairs)
+            self.words[word_idx] = new_word
+
+            old_pairs = set(zip(old_word, old_word[1:]))
+            new_pairs = set(zip(new_word, new_word[1:]))
+            for p in old_pairs - new_pairs:
+                word_indices = self._index.get(p)
+                if word_indices is not None:
+                    word_indices.discard(word_idx)
+                    if not word_indices:
+                        del self._index[p]
+            for p in new_pairs - old_pairs:
+                self._index[p].add(word_idx)
+        return pair_changes
+
+
+def aggregate_pair_changes(pair_changes: Iterable[Tuple[Tuple, int]]) -> List[Tuple[Tuple, int]]:
+    """
+    Sums up the changes of each pair. Pairs are ordered by their last change, so that adding the result
+    to `PriorityCounter` breaks ties the same way as adding each of the changes.
+    Pairs whose changes sum up to zero are kept since adding them still updates the tie-breaking order.
+
+    >>> aggregate_pair_changes([(('a', 'b'), 3), (('b', 'c'), -3), (('a', 'b'), -3), (('x', 'y'), 1)])
+    [(('b', 'c'), -3), (('a', 'b'), 0), (('x', 'y'), 1)]
+    """
+    aggregated = {}
+    for pair, change in pair_changes:
+        aggregated[pair] = aggregated.pop(pair, 0) + change
+    return list(aggregated.items())
+
+
+class Checkpoint(object):
+    """
+    State of bpe learning from which it can be continued: the words split according to the merges done so far,
+    the merges, and the pair counts. The pair counts are kept in the `PriorityCounter` they were updated in,
+    so that the ties are broken the same way as if learning had not been interrupted.
+    If `pairs` is None, pairs are counted from scratch when learning is continued.
+    """
+    def __init__(self, split_vocab: SplitVocab, merges: MergeList, pairs: Optional[PriorityCounter] = None):
+        self.split_vocab = split_vocab
+        self.merges = merges
+        self.pairs = pairs
+
+
+def _do_merges(checkpoint: Checkpoint, n_merges: int, pair_counts: Dict[Tuple[int, int], int],
+               merge_pair: Callable[[Tuple[int, int], int], List[Tuple[Tuple[int, int], int]]],
+               get_words: Callable[[], List[array]],
+               save_checkpoint: Optional[Callable[[Checkpoint], None]], checkpoint_every_seconds: float,
+               snapshots: Set[int], save_snapshot: Optional[Callable[[Checkpoint], None]]) -> None:
+    """
+    Chooses the most frequent pair until there are `n_merges` merges. `merge_pair` applies the chosen merge
+    to the words and returns the changes of pair frequencies. `get_words` returns the current splits of the words.
+    """
+    if checkpoint.pairs is None:
+        checkpoint.pairs = PriorityCounter(pair_counts)
+    del pair_counts
+    split_vocab, merges, pairs = checkpoint.split_vocab, checkpoint.merges, checkpoint.pairs
+
+    last_checkpoint_time = time.time()
+    for i in tqdm(range(len(merges), n_merges), total=n_merges, initial=len(merges)):
+        try:
+            best, occurences = pairs.pop_pair()
+        except KeyError:
+            break
+        first, second = split_vocab.symbols[best[0]], split_vocab.symbols[best[1]]
+        merges.append(Merge((first, second), freq=occurences, priority=i))
+        merged = split_vocab.intern(first + second)
+        for p in merge_pair(best, merged):
+            pairs.add(*p)
+
+        # getting the words from the workers transfers the whole vocabulary, so checkpoints are saved
+        # only after a time interval regardless of the number of merges done since the last one
+        if save_checkpoint and time.time() - last_checkpoint_time >= checkpoint_every_seconds:
+            split_vocab.words = get_words()
+            save_checkpoint(checkpoint)
+            last_checkpoint_time = time.time()
+
+        if save_snapshot and len(merges) in snapshots:
+            split_vocab.words = get_words()
+            save_snapshot(checkpoint)
+    split_vocab.words = get_words()
+
+
+def do_merges_indexed(split_vocab: SplitVocab, n_merges: int) -> Tuple[SplitVocab, MergeList]:
+    """
+    Does the same as `do_merges` but keeps an index from each pair to the words containing it.
+    This way, each merge touches only the words that contain the merged pair instead of the whole vocabulary.
+    The words are processed in the same order as by `do_merges`, so the resulting merges are identical.
+    `split_vocab` is modified in place.
+
+    >>> input_vocab = {
+    ...     "b i r d @": 3,
+    ...     "w o r d @": 7,
+    ...     "w o g @": 13
+    ... }
+
+    >>> split_vocab, merges = do_merges_indexed(SplitVocab.from_dict(input_vocab), 10)
+    >>> split_vocab.to_dict()
+    {'bird@': 3, 'word@': 7, 'wog@': 13}
+    >>> merges
+    [('w', 'o'): (20, 0), ('g', '@'): (13, 1), ('wo', 'g@'): (13, 2), ('r', 'd'): (10, 3), ('rd', '@'): (10, 4), \
+('wo', 'rd@'): (7, 5), ('b', 'i'): (3, 6), ('bi', 'rd@'): (3, 7)]
+
+    >>> split_vocab, merges = do_merges_indexed(SplitVocab.from_dict({"a a a a a @": 3}), 10)
+    >>> split_vocab.to_dict(), merges
+    ({'aaaaa@': 3}, [('a', 'a'): (12, 0), ('a', '@'): (3, 1), ('aa', 'aa'): (3, 2), ('aaaa', 'a@'): (3, 3)])
+
+    >>> split_vocab, merges = do_merges_indexed(SplitVocab.from_dict({"l a l a l a @": 3}), 10)
+    >>> split_vocab.to_dict(), merges
+    ({'lalala@': 3}, [('l', 'a'): (9, 0), ('la', 'la'): (6, 1), ('la', '@'): (3, 2), ('lala', 'la@'): (3, 3)])
+    """
+    return continue_merges(Checkpoint(split_vocab, MergeList()), n_merges)
+
+
+def do_merges_parallel(split_vocab: SplitVocab, n_merges: int, n_workers: int) -> Tuple[SplitVocab, MergeList]:
+    """
+    Does the same as `do_merges_indexed` with the words partitioned across `n_workers` processes.
+    Each chosen merge is sent to all the workers, each of them applies it to its partition and
+    returns the changes of pair frequencies, which are combined in the order of the partitions.
+    The resulting merges are identical to the ones done by `do_merges_indexed`.
+
+    >>> input_vocab = {"b i r d @": 3, "w o r d @": 7, "w o g @": 13}
+    >>> split_vocab, merges = do_merges_parallel(SplitVocab.from_dict(input_vocab), 10, n_workers=2)
+    >>> split_vocab.to_dict()
+    {'bird@': 3, 'word@': 7, 'wog@': 13}
+    >>> merges
+    [('w', 'o'): (20, 0), ('g', '@'): (13, 1), ('wo', 'g@'): (13, 2), ('r', 'd'): (10, 3), ('rd', '@'): (10, 4), \
+('wo', 'rd@'): (7, 5), ('b', 'i'): (3, 6), ('bi', 'rd@'): (3, 7)]
+    """
+    return continue_merges(Checkpoint(split_vocab, MergeList()), n_merges, n_workers)
+
+
+def _merge_worker(conn: Connection, words: List[array], freqs: array) -> None:
+    pair_index = PairIndex(words, freqs)
+    conn.send(pair_index.count_pairs())
+    while True:
+        task = conn.recv()
+        if task is None:
+            conn.close()
+            return
+        elif task == GET_WORDS_TASK:
+            conn.send(pair_index.words)
+        else:
+            pair, merged = task
+            conn.send(aggregate_pair_changes(pair_index.merge(pair, merged)))
+
+
+def continue_merges(checkpoint: Checkpoint, n_merges: int, n_workers: int = 1,
+                    save_checkpoint: Optional[Callable[[Checkpoint], None]] = None,
+                    checkpoint_every_seconds: float = BPE_CHECKPOINT_EVERY_SECONDS,
+                    snapshots: Iterable[int] = (),
+                    save_snapshot: Optional[Callable[[Checkpoint], None]] = None) -> Tuple[SplitVocab, MergeList]:
+    """
+    Continues learning from `checkpoint` until there are `n_merges` merges.
+    With `n_workers` > 1, the words are partitioned across `n_workers` processes.
+    `save_checkpoint` is called after a merge once `checkpoint_every_seconds` seconds have passed
+    since the previous checkpoint.
+    `save_snapshot` is called each time the number of merges reaches one of `snapshots`.
+
+    >>> split_vocab, merges = do_merges_indexed(SplitVocab.from_dict({"l a l a l a @": 3}), 2)
+    >>> merges
+    [('l', 'a'): (9, 0), ('la', 'la'): (6, 1)]
+
+    Without the pair counts, pairs are counted anew, so ties can be broken differently than in an uninterrupted run:
+    >>> split_vocab, merges = continue_merges(Checkpoint(split_vocab, merges), 4)
+    >>> split_vocab.to_dict(), merges
+    ({'lalala@': 3}, [('l', 'a'): (9, 0), ('la', 'la'): (6, 1), ('lala', 'la'): (3, 2), ('lalala', '@'): (3, 3)])
+
+    >>> _ = continue_merges(Checkpoint(SplitVocab.from_dict({"l a l a l a @": 3}), MergeList()), 3, snapshots=[1, 2],
+    ...                     save_snapshot=lambda c: print(c.split_vocab.to_dict(), len(c.merges)))
+    {'la la la @': 3} 1
+    {'lala la @': 3} 2
+    """
+    split_vocab = checkpoint.split_vocab
+    snapshots = set(snapshots)
+    n_workers = min(n_workers, len(split_vocab))
+    if n_workers <= 1:
+        pair_index = PairIndex(split_vocab.words, split_vocab.freqs)
+        _do_merges(checkpoint, n_merges, pair_index.count_pairs(),
+                   lambda pair, merged: aggregate_pair_changes(pair_index.merge(pair, merged)),
+                   lambda: pair_index.words, save_checkpoint, checkpoint_every_seconds, snapshots, save_snapshot)
+        return split_vocab, checkpoint.merges
+
+    bounds = [len(split_vocab) * i // n_workers for i in range(n_workers + 1)]
+    connections, workers = [], []
+    for start, end in zip(bounds, bounds[1:]):
+        parent_conn, child_conn = Pipe()
+        worker = Process(target=_merge_worker,
+                         args=(child_conn, split_vocab.words[start:end], split_vocab.freqs[start:end]))
+        worker.start()
+        child_conn.close()
+        connections.append(parent_conn)
+        workers.append(worker)
+    logger.info(f'Learning bpe merges using {n_workers} workers')
+
+    def merge_pair(pair: Tuple[int, int], merged: int) -> List[Tuple[Tuple[int, int], int]]:
+        for conn in connections:
+            conn.send((pair, merged))
+        return aggregate_pair_changes(itertools.chain.from_iterable(conn.recv() for conn in connections))
+
+    def get_words() -> List[array]:
+        for conn in connections:
+            conn.send(GET_WORDS_TASK)
+        return list(itertools.chain.from_iterable(conn.recv() for conn in connections))
+
+    try:
+        pair_counts = collections.defaultdict(int)
+        for conn in connections:
+            partition_pair_counts = conn.recv()
+            # pair counts are not needed if they are restored from the checkpoint
+            if checkpoint.pairs is None:
+                for pair, count in partition_pair_counts.items():
+                    pair_counts[pair] += count
+        _do_merges(checkpoint, n_merges, pair_counts, merge_pair, get_words, save_checkpoint,
+                   checkpoint_every_seconds, snapshots, save_snapshot)
+        for conn in connections:
+            conn.send(None)
+    except BaseException:
+        for worker in workers:
+            worker.terminate()
+        raise
+    finally:
+        for worker in workers:
+            worker.join()
+    return split_vocab, checkpoint.merges
+
 # ======== Create auxiliary data structures.
 
 
@@ -10,10 +10,20 @@
 >>> cache == read_bpe_cache(f.name)
 True
 """
-from typing import List, Dict
+import glob
+import logging
+import os
+import shutil
+from collections import OrderedDict
+from itertools import islice
+from typing import List, Dict, Optional, Mapping
 
+from codeprep.config import BPE_CACHE_MAX_SIZE
+from codeprep.fileutils import FileLock
 from codeprep.util import to_literal_str, to_non_literal_str
 
+logger = logging.getLogger(__name__)
+
 KEY_VALUE_DELIM = '\t'
 VALUE_PARTS_DELIM = ' '
 
@@ -29,8 +39,192 @@ def read_bpe_cache(file: str) -> Dict[str, List[str]]:
     return words
 
 
-def dump_bpe_cache(dct: Dict[str, List[str]], file: str) -> None:
-    with open(file, 'w') as f:
+def dump_bpe_cache(dct: Mapping[str, List[str]], file: str, append: bool = False) -> None:
+    with open(file, 'a' if append else 'w') as f:
         for word, subwords in dct.items():
             a = to_literal_str(" ".join(subwords))
-            f.write(f'{to_literal_str(str(word))}{KEY_VALUE_DELIM}{a}\n')
\ No newline at end of file
+            f.write(f'{to_literal_str(str(word))}{KEY_VALUE_DELIM}{a}\n')
+
+
+def merge_bpe_cache_parts(file: str, part_folder: str, max_size: int) -> None:
+    """
+    Adds entries saved to the files in `part_folder` to the bpe cache `file` and removes `part_folder`.
+    Entries which do not add up to the word they encode, e.g. the ones truncated by a crashed process, are skipped.
+    If there are more than `max_size` entries, the oldest ones are dropped.
+    The cache file is replaced atomically, so that concurrent readers never see a partially written file,
+    and concurrent merges into the same file wait for each other, so that no entries are lost.
+
+    >>> import tempfile
+    >>> d = tempfile.mkdtemp()
+    >>> cache_file, part_folder = os.path.join(d, 'merges_cache.txt'), os.path.join(d, 'part')
+    >>> os.makedirs(part_folder)
+    >>> dump_bpe_cache({'ab': ['a', 'b'], 'cd': ['c', 'd']}, cache_file)
+    >>> dump_bpe_cache({'ef': ['e', 'f'], 'ab': ['ab']}, os.path.join(part_folder, '1'))
+    >>> with open(os.path.join(part_folder, '2'), 'w') as f:
+    ...     _ = f.write('gh\tg')
+    >>> merge_bpe_cache_parts(cache_file, part_folder, max_size=2)
+    >>> read_bpe_cache(cache_file)
+    {'ef': ['e', 'f'], 'ab': ['ab']}
+    >>> os.path.exists(part_folder)
+    False
+    """
+    with FileLock(f'{file}.lock'):
+        cache = read_bpe_cache(file) if os.path.exists(file) else {}
+        for part_file in sorted(os.listdir(part_folder)):
+            try:
+                new_entries = read_bpe_cache(os.path.join(part_folder, part_file))
+            except (IndexError, UnicodeDecodeError) as err:
+                logger.warning(f'Could not read bpe cache entries from {part_file}: {err}. Skipping ...')
+                continue
+            for word, subwords in new_entries.items():
+                if ''.join(subwords) != word:
+                    continue
+                # re-inserting, so that the entry is considered new
+                cache.pop(word, None)
+                cache[word] = subwords
+        if len(cache) > max_size:
+            cache = dict(islice(cache.items(), len(cache) - max_size, None))
+
+        not_finished_file = f'{file}.{os.getpid()}.part'
+        dump_bpe_cache(cache, not_finished_file)
+        os.replace(not_finished_file, file)
+    shutil.rmtree(part_folder, ignore_errors=True)
+
+
+def get_bpe_cache_part_folder(file: str) -> str:
+    return f'{file}_part_{os.getpid()}'
+
+
+def merge_abandoned_bpe_cache_parts(file: str, max_size: int) -> None:
+    """
+    Merges the part folders of the bpe cache `file` left by the processes that did not finish, e.g. crashed.
+    A process holds the lock of its part folder until the folder is merged, so the folders of running processes
+    are skipped.
+
+    >>> import tempfile
+    >>> d = tempfile.mkdtemp()
+    >>> cache_file = os.path.join(d, 'merges_cache.txt')
+    >>> for pid, word in [(1, 'ab'), (2, 'cd')]:
+    ...     os.makedirs(f'{cache_file}_part_{pid}')
+    ...     dump_bpe_cache({word: list(word)}, os.path.join(f'{cache_file}_part_{pid}', str(pid)))
+    >>> with FileLock(f'{cache_file}_part_2.lock'):
+    ...     merge_abandoned_bpe_cache_parts(cache_file, max_size=10)
+    >>> read_bpe_cache(cache_file)
+    {'ab': ['a', 'b']}
+    >>> sorted(os.listdir(d))
+    ['merges_cache.txt', 'merges_cache.txt.lock', 'merges_cache.txt_part_2', 'merges_cache.txt_part_2.lock']
+    """
+    for part_folder in sorted(glob.glob(f'{glob.escape(file)}_part_*')):
+        if not os.path.isdir(part_folder):
+            continue
+        lock = FileLock(f'{part_folder}.lock')
+        if not lock.acquire(blocking=False):
+            continue
+        try:
+            # could have been merged by another process before the lock was acquired
+            if os.path.isdir(part_folder):
+                logger.info(f'Merging bpe cache entries left by an unfinished run: {part_folder}')
+                merge_bpe_cache_parts(file, part_folder, max_size)
+        finally:
+            lock.release()
+        lock.remove()
+
+
+class BpeCacheStats(object):
+    def __init__(self, hits: int, misses: int, evictions: int, size: int, max_size: int):
+        self.hits = hits
+        self.misses = misses
+        self.evictions = evictions
+        self.size = size
+        self.max_size = max_size
+
+    def __eq__(self, other):
+        return self.__class__ == other.__class__ and self.__dict__ == other.__dict__
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(hits={self.hits}, misses={self.misses}, evictions={self.evictions}, ' \
+               f'size={self.size}, max_size={self.max_size})'
+
+
+class BpeCache(object):
+    """
+    Cache of bpe-encoded words. Consists of a read-only `precomputed` mapping, e.g. loaded from merges_cache.txt,
+    and a bounded LRU part to which newly encoded words are written. The LRU part holds only the words
+    that are not in the `precomputed` mapping, so that lookups of precomputed words do not evict them.
+
+    >>> cache = BpeCache({'ab@': ['ab@']}, max_size=1)
+    >>> cache.get('ab@')
+    ['ab@']
+    >>> cache.get('abc@') is None
+    True
+    >>> cache.put('abc@', ['ab', 'c@'])
+    >>> cache.get('ab@')
+    ['ab@']
+    >>> cache.get('abc@')
+    ['ab', 'c@']
+    >>> cache.put('abcd@', ['ab', 'c', 'd@'])
+    >>> 'abc@' in cache, 'ab@' in cache
+    (False, True)
+    >>> cache.stats()
+    BpeCacheStats(hits=3, misses=1, evictions=1, size=1, max_size=1)
+
+    Newly encoded words can be kept until they are saved, e.g. to a persistent cache:
+    >>> cache.keep_new_entries = True
+    >>> cache.put('abcde@', ['ab', 'c', 'de@'])
+    >>> cache.pop_new_entries()
+    {'abcde@': ['ab', 'c', 'de@']}
+    >>> cache.pop_new_entries()
+    {}
+    """
+    def __init__(self, precomputed: Optional[Mapping[str, List[str]]] = None, max_size: int = BPE_CACHE_MAX_SIZE):
+        if max_size < 0:
+            raise ValueError(f'Max size of the cache cannot be negative: {max_size}')
+
+        self.precomputed = precomputed if precomputed is not None else {}
+        self.max_size = max_size
+        self._lru: OrderedDict = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self.keep_new_entries = False
+        self._new_entries: Dict[str, List[str]] = {}
+
+    def get(self, word: str) -> Optional[List[str]]:
+        subwords = self._lru.get(word)
+        if subwords is not None:
+            self._lru.move_to_end(word)
+            self._hits += 1
+            return subwords
+
+        subwords = self.precomputed.get(word)
+        if subwords is not None:
+            self._hits += 1
+        else:
+            self._misses += 1
+        return subwords
+
+    def put(self, word: str, subwords: List[str]) -> None:
+        if word not in self.precomputed:
+            self._store(word, subwords)
+        if self.keep_new_entries:
+            self._new_entries[word] = subwords
+
+    def pop_new_entries(self) -> Dict[str, List[str]]:
+        new_entries = self._new_entries
+        self._new_entries = {}
+        return new_entries
+
+    def _store(self, word: str, subwords: List[str]) -> None:
+        if self.max_size == 0:
+            return
+        self._lru[word] = subwords
+        self._lru.move_to_end(word)
+        if len(self._lru) > self.max_size:
+            self._lru.popitem(last=False)
+            self._evictions += 1
+
+    def __contains__(self, word: str) -> bool:
+        return word in self._lru or word in self.precomputed
+
+    def stats(self) -> BpeCacheStats:
+        return BpeCacheStats(self._hits, self._misses, self._evictions, len(self._lru), self.max_size)
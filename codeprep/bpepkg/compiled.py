@@ -0,0 +1,285 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Compiled binary representation of merges and bpe cache files.
+
+Compiled files are memory-mapped read-only: loading them does not require parsing
+and un-escaping every entry, and worker processes forked after loading share the mapped pages.
+A compiled file is built from the text file once and is rebuilt when the text file is newer.
+
+>>> import tempfile
+>>> f = tempfile.NamedTemporaryFile(delete=False)
+>>> cache = {'ab': ['a', 'b'], '\\t\\xa0': ['\\t', '\\xa0'], 'ü\\ud800': ['ü\\ud800']}
+>>> compile_bpe_cache(cache, f.name)
+>>> compiled_cache = CompiledBpeCache(f.name)
+>>> compiled_cache['\\t\\xa0']
+['\\t', '\\xa0']
+>>> 'ü\\ud800' in compiled_cache, 'ü' in compiled_cache, 5 in compiled_cache
+(True, False, False)
+>>> dict(compiled_cache) == cache
+True
+
+>>> from codeprep.bpepkg.merge import Merge
+>>> merges = MergeList().append(Merge(('a', 'b'), 34)).append(Merge(('ab', 'c'))).append(Merge(('\\xa0', '@')))
+>>> compile_merges(merges, f.name)
+>>> read_compiled_merges(f.name) == merges
+True
+>>> read_compiled_merges(f.name, 2)
+[('a', 'b'): (34, 0), ('ab', 'c'): (None, 1)]
+"""
+import logging
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from collections.abc import Mapping
+from typing import List, Dict, Optional, Iterator, Tuple, Iterable
+
+from codeprep.bpepkg.cache import read_bpe_cache, VALUE_PARTS_DELIM
+from codeprep.bpepkg.merge import MergeList, read_merges
+
+logger = logging.getLogger(__name__)
+
+COMPILED_EXT = '.bin'
+
+FORMAT_VERSION = 1
+MERGES_MAGIC = b'CPMERGES'
+CACHE_MAGIC = b'CPBPECAC'
+
+# magic, format version, whether arrays are little-endian, followed by section sizes
+MERGES_HEADER = struct.Struct('<8sBB6xQQQ')
+CACHE_HEADER = struct.Struct('<8sBB6xQQQQ')
+
+UINT64_SIZE = 8
+
+
+def get_compiled_path(file: str) -> str:
+    return file + COMPILED_EXT
+
+
+def _encode(s: str) -> bytes:
+    return s.encode('utf-8', 'surrogatepass')
+
+
+def _decode(b: bytes) -> str:
+    return b.decode('utf-8', 'surrogatepass')
+
+
+def _to_string_table(strings: Iterable[str]) -> Tuple[array, bytes]:
+    offsets = array('Q', [0])
+    encoded_strings = []
+    total = 0
+    for s in strings:
+        encoded = _encode(s)
+        encoded_strings.append(encoded)
+        total += len(encoded)
+        offsets.append(total)
+    return offsets, b''.join(encoded_strings)
+
+
+def _write_atomically(file: str, parts: List[bytes]) -> None:
+    dirname = os.path.dirname(file)
+    if dirname and not os.path.exists(dirname):
+        os.makedirs(dirname, exist_ok=True)
+    not_finished_file = f'{file}.{os.getpid()}.part'
+    with open(not_finished_file, 'wb') as f:
+        for part in parts:
+            f.write(part)
+    os.replace(not_finished_file, file)
+
+
+def _map_file(file: str, magic: bytes, header: struct.Struct) -> Tuple[mmap.mmap, List[int]]:
+    with open(file, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if len(mm) < header.size:
+        mm.close()
+        raise ValueError(f'{file} is not a valid compiled file')
+    actual_magic, version, little_endian, *sizes = header.unpack_from(mm, 0)
+    if actual_magic != magic or version != FORMAT_VERSION or bool(little_endian) != (sys.byteorder == 'little'):
+        mm.close()
+        raise ValueError(f'{file} is not a compiled file of a supported format')
+    return mm, sizes
+
+
+def _create_header(header: struct.Struct, magic: bytes, *sizes: int) -> bytes:
+    return header.pack(magic, FORMAT_VERSION, sys.byteorder == 'little', *sizes)
+
+
+# ======== Merges
+
+def compile_merges(merges: MergeList, file: str) -> None:
+    symbols, left_ids, right_ids, merged_ids, freqs = merges.to_arrays()
+    symbol_offsets, symbol_blob = _to_string_table(symbols)
+    _write_atomically(file, [
+        _create_header(MERGES_HEADER, MERGES_MAGIC, len(symbols), len(merges), len(symbol_blob)),
+        symbol_offsets.tobytes(),
+        left_ids.tobytes(), right_ids.tobytes(), merged_ids.tobytes(), freqs.tobytes(),
+        symbol_blob
+    ])
+
+
+def read_compiled_merges(file: str, n_merges: Optional[int] = None) -> MergeList:
+    mm, (n_symbols, n_total_merges, symbol_blob_size) = _map_file(file, MERGES_MAGIC, MERGES_HEADER)
+    try:
+        position = MERGES_HEADER.size
+
+        def read_array(typecode: str, length: int) -> array:
+            nonlocal position
+            arr = array(typecode)
+            arr.frombytes(mm[position:position + length * UINT64_SIZE])
+            position += length * UINT64_SIZE
+            return arr
+
+        symbol_offsets = read_array('Q', n_symbols + 1)
+        # left ids, right ids, merged ids, frequencies
+        arrays = [read_array('q', n_total_merges) for _ in range(4)]
+        symbol_blob = mm[position:position + symbol_blob_size]
+    finally:
+        mm.close()
+
+    symbols = [_decode(symbol_blob[symbol_offsets[i]:symbol_offsets[i + 1]]) for i in range(n_symbols)]
+    if n_merges and n_merges < n_total_merges:
+        arrays = [arr[:n_merges] for arr in arrays]
+    return MergeList.from_arrays(symbols, *arrays)
+
+
+# ======== Bpe cache
+
+def _get_n_buckets(n_entries: int) -> int:
+    n_buckets = 1
+    while n_buckets < 2 * n_entries:
+        n_buckets <<= 1
+    return n_buckets
+
+
+def compile_bpe_cache(dct: Dict[str, List[str]], file: str) -> None:
+    key_offsets, key_blob = _to_string_table(dct.keys())
+    value_offsets, value_blob = _to_string_table(VALUE_PARTS_DELIM.join(subwords) for subwords in dct.values())
+
+    # open addressing with linear probing, bucket value is the index of the entry + 1, 0 is an empty bucket
+    n_buckets = _get_n_buckets(len(dct))
+    mask = n_buckets - 1
+    buckets = array('Q', bytes(n_buckets * UINT64_SIZE))
+    for i in range(len(dct)):
+        bucket = zlib.crc32(key_blob[key_offsets[i]:key_offsets[i + 1]]) & mask
+        while buckets[bucket]:
+            bucket = (bucket + 1) & mask
+        buckets[bucket] = i + 1
+
+    _write_atomically(file, [
+        _create_header(CACHE_HEADER, CACHE_MAGIC, len(dct), n_buckets, len(key_blob), len(value_blob)),
+        key_offsets.tobytes(), value_offsets.tobytes(), buckets.tobytes(),
+        key_blob, value_blob
+    ])
+
+
+class CompiledBpeCache(Mapping):
+    """
+    Read-only mapping word -> subwords backed by a memory-mapped compiled bpe cache file.
+    Lookups go through the hash index stored in the file, nothing is loaded into memory upfront.
+    """
+    def __init__(self, file: str):
+        self.file = file
+        self._mm, (n_entries, n_buckets, key_blob_size, value_blob_size) = _map_file(file, CACHE_MAGIC, CACHE_HEADER)
+        view = memoryview(self._mm)
+        position = CACHE_HEADER.size
+        self._key_offsets = view[position:position + (n_entries + 1) * UINT64_SIZE].cast('Q')
+        position += (n_entries + 1) * UINT64_SIZE
+        self._value_offsets = view[position:position + (n_entries + 1) * UINT64_SIZE].cast('Q')
+        position += (n_entries + 1) * UINT64_SIZE
+        self._buckets = view[position:position + n_buckets * UINT64_SIZE].cast('Q')
+        position += n_buckets * UINT64_SIZE
+        self._key_blob_start = position
+        self._value_blob_start = position + key_blob_size
+        self._mask = n_buckets - 1
+        self._n_entries = n_entries
+
+    def _get_key(self, entry: int) -> bytes:
+        return self._mm[self._key_blob_start + self._key_offsets[entry]:self._key_blob_start + self._key_offsets[entry + 1]]
+
+    def _find(self, key: str) -> int:
+        encoded = _encode(key)
+        bucket = zlib.crc32(encoded) & self._mask
+        while True:
+            entry = self._buckets[bucket]
+            if entry == 0:
+                return -1
+            if self._get_key(entry - 1) == encoded:
+                return entry - 1
+            bucket = (bucket + 1) & self._mask
+
+    def __getitem__(self, key: str) -> List[str]:
+        entry = self._find(key) if isinstance(key, str) else -1
+        if entry == -1:
+            raise KeyError(key)
+        value = self._mm[self._value_blob_start + self._value_offsets[entry]:
+                         self._value_blob_start + self._value_offsets[entry + 1]]
+        return _decode(value).split(VALUE_PARTS_DELIM)
+
+    def __contains__(self, key) -> bool:
+        return isinstance(key, str) and self._find(key) != -1
+
+    def __len__(self) -> int:
+        return self._n_entries
+
+    def __iter__(self) -> Iterator[str]:
+        return (_decode(self._get_key(i)) for i in range(self._n_entries))
+
+    def __reduce__(self):
+        return self.__class__, (self.file,)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.file}, entries: {self._n_entries})'
+
+
+# ======== Loading with compilation on demand
+
+def _is_compiled_file_up_to_date(file: str, compiled_file: str) -> bool:
+    return os.path.exists(compiled_file) and os.path.getmtime(compiled_file) >= os.path.getmtime(file)
+
+
+def load_merges(file: str, n_merges: Optional[int] = None, compiled_file: Optional[str] = None) -> MergeList:
+    """
+    Loads merges from the compiled version of `file`. The compiled file is created first if it does not exist
+    or is outdated. By default it is saved next to `file`, `compiled_file` can be specified otherwise.
+    """
+    compiled_file = compiled_file or get_compiled_path(file)
+    if _is_compiled_file_up_to_date(file, compiled_file):
+        try:
+            return read_compiled_merges(compiled_file, n_merges)
+        except ValueError as err:
+            logger.warning(f'{err}. Recompiling ...')
+
+    merges = read_merges(file)
+    try:
+        compile_merges(merges, compiled_file)
+    except OSError as err:
+        logger.warning(f'Could not save compiled merges to {compiled_file}: {err}')
+        return read_merges(file, n_merges)
+    return read_compiled_merges(compiled_file, n_merges)
+
+
+def load_bpe_cache(file: str, compiled_file: Optional[str] = None) -> Mapping:
+    """
+    Returns a memory-mapped cache loaded from the compiled version of `file`.
+    The compiled file is created first if it does not exist or is outdated.
+    If the compiled file cannot be written, the text file is read into a dict.
+    """
+    compiled_file = compiled_file or get_compiled_path(file)
+    if _is_compiled_file_up_to_date(file, compiled_file):
+        try:
+            return CompiledBpeCache(compiled_file)
+        except ValueError as err:
+            logger.warning(f'{err}. Recompiling ...')
+
+    cache = read_bpe_cache(file)
+    try:
+        compile_bpe_cache(cache, compiled_file)
+    except OSError as err:
+        logger.warning(f'Could not save compiled bpe cache to {compiled_file}: {err}')
+        return cache
+    return CompiledBpeCache(compiled_file)
@@ -2,11 +2,12 @@
 #
 # SPDX-License-Identifier: Apache-2.0
 
-import copy
-
+from array import array
 from typing import List, Tuple, Union, Optional, Iterator, Dict
 
-from codeprep.util import is_python_3_6_and_higher, to_literal_str, to_non_literal_str
+from codeprep.util import to_literal_str, to_non_literal_str
+
+NO_FREQ = -1
 
 
 # TODO this class should be frozen
@@ -98,56 +99,153 @@ class MergeList(object):
     [('a', 'b'): (34, 0), ('b', 'c'): (44, 1), ('x', 'y'): (34, 2)]
     >>> merges.get_priority(('x', 'y'))
     2
+    >>> merges.get_priority(('y', 'x'))
+    Traceback (most recent call last):
+    ...
+    KeyError: ('y', 'x')
+
+    >>> a, b, ab = merges.symbol_to_id('a'), merges.symbol_to_id('b'), merges.symbol_to_id('ab')
+    >>> merges.rank_table[(a, b)]
+    0
+    >>> merges.id_to_symbol(merges.get_merged_symbol_id(0)) == 'ab' and merges.get_merged_symbol_id(0) == ab
+    True
+    >>> merges.symbol_to_id('unknown') is None
+    True
     """
     def __init__(self):
-        self.merges: Dict[Tuple[str, str], Merge] = {}
+        self._symbol_ids: Dict[str, int] = {}
+        self._symbols: List[str] = []
+        # merge with priority `i` is stored at index `i` of the parallel arrays below
+        self._left_ids = array('q')
+        self._right_ids = array('q')
+        self._merged_ids = array('q')
+        self._freqs = array('q')
+        self._ranks: Dict[Tuple[int, int], int] = {}
+
+    @classmethod
+    def from_arrays(cls, symbols: List[str], left_ids: array, right_ids: array, merged_ids: array,
+                    freqs: array) -> 'MergeList':
+        """
+        Creates a merge list directly from its array representation, e.g. loaded from a compiled merges file.
+        Merge with priority `i` is formed by `left_ids[i]`, `right_ids[i]`, `merged_ids[i]` and `freqs[i]`.
+        """
+        merge_list = cls()
+        merge_list._symbols = symbols
+        merge_list._symbol_ids = {symbol: i for i, symbol in enumerate(symbols)}
+        merge_list._left_ids = left_ids
+        merge_list._right_ids = right_ids
+        merge_list._merged_ids = merged_ids
+        merge_list._freqs = freqs
+        merge_list._ranks = {pair: i for i, pair in enumerate(zip(left_ids, right_ids))}
+        return merge_list
+
+    def to_arrays(self) -> Tuple[List[str], array, array, array, array]:
+        return self._symbols, self._left_ids, self._right_ids, self._merged_ids, self._freqs
+
+    def _intern(self, symbol: str) -> int:
+        symbol_id = self._symbol_ids.get(symbol)
+        if symbol_id is None:
+            symbol_id = len(self._symbols)
+            self._symbol_ids[symbol] = symbol_id
+            self._symbols.append(symbol)
+        return symbol_id
+
+    def symbol_to_id(self, symbol: str) -> Optional[int]:
+        return self._symbol_ids.get(symbol)
+
+    def id_to_symbol(self, symbol_id: int) -> str:
+        return self._symbols[symbol_id]
+
+    @property
+    def rank_table(self) -> Dict[Tuple[int, int], int]:
+        """
+        Mapping (left symbol id, right symbol id) -> priority of the merge. Must not be modified.
+        """
+        return self._ranks
+
+    def get_merged_symbol_id(self, priority: int) -> int:
+        return self._merged_ids[priority]
+
+    def _get_ids(self, pair: Tuple[str, str]) -> Optional[Tuple[int, int]]:
+        left_id = self._symbol_ids.get(pair[0])
+        right_id = self._symbol_ids.get(pair[1])
+        if left_id is None or right_id is None:
+            return None
+        return left_id, right_id
 
     def __contains__(self, item):
-        return item in self.merges
+        return self._get_ids(item) in self._ranks
 
     def __len__(self):
-        return len(self.merges)
+        return len(self._left_ids)
 
     def __iter__(self) -> Iterator[Merge]:
-        return iter(self._get_sorted_merges())
-
-    def _get_sorted_merges(self) -> List[Merge]:
-        if not is_python_3_6_and_higher():
-            # we cannot rely on dict order for python versions lower than 3.6
-            raise NotImplementedError()
-
-        return list(self.merges.values())
+        return (self._create_merge(i) for i in range(len(self)))
+
+    def _create_merge(self, priority: int) -> Merge:
+        freq = self._freqs[priority]
+        return Merge((self._symbols[self._left_ids[priority]], self._symbols[self._right_ids[priority]]),
+                     freq=freq if freq != NO_FREQ else None, priority=priority)
+
+    def _copy(self) -> 'MergeList':
+        new_merge_list = MergeList()
+        new_merge_list._symbol_ids = dict(self._symbol_ids)
+        new_merge_list._symbols = list(self._symbols)
+        new_merge_list._left_ids = array('q', self._left_ids)
+        new_merge_list._right_ids = array('q', self._right_ids)
+        new_merge_list._merged_ids = array('q', self._merged_ids)
+        new_merge_list._freqs = array('q', self._freqs)
+        new_merge_list._ranks = dict(self._ranks)
+        return new_merge_list
 
     def __add__(self, other: 'MergeList'):
         if self.__class__ != other.__class__:
             raise TypeError(f"Cannot add {other.__class__} to a MergeList")
 
-        new_merge_list = copy.deepcopy(self)
-        other_copy = copy.deepcopy(other)
+        new_merge_list = self._copy()
         first_list_len = len(new_merge_list)
-        for merge in other_copy:
-            merge.priority += first_list_len
-            new_merge_list.append(merge)
+        for merge in other:
+            new_merge_list.append(Merge(merge.pair, merge.freq, merge.priority + first_list_len))
 
         return new_merge_list
 
     def append(self, merge: Merge) -> 'MergeList':
         # along with the pair we save its priority and the number of its occurrences
         if merge.priority is None:
-            merge.priority = len(self.merges)
-        elif merge.priority != len(self.merges):
+            merge.priority = len(self)
+        elif merge.priority != len(self):
             raise ValueError(f"It's only possible to add merges in priority order. "
-                             f"The priority of the next merge should be {len(self.merges)} but is {merge.priority}")
-
-        self.merges[merge.pair] = merge
+                             f"The priority of the next merge should be {len(self)} but is {merge.priority}")
+
+        freq = merge.freq if merge.freq is not None else NO_FREQ
+        ids = self._get_ids(merge.pair)
+        if ids in self._ranks:
+            # the pair is already in the list, only its frequency is updated
+            self._freqs[self._ranks[ids]] = freq
+            return self
+
+        left_id, right_id = self._intern(merge.pair[0]), self._intern(merge.pair[1])
+        self._left_ids.append(left_id)
+        self._right_ids.append(right_id)
+        self._merged_ids.append(self._intern(merge.pair[0] + merge.pair[1]))
+        self._freqs.append(freq)
+        self._ranks[(left_id, right_id)] = merge.priority
         return self
 
     def get_priority(self, pair: Tuple[str, str]) -> int:
-        return self.merges[pair].priority
+        ids = self._get_ids(pair)
+        if ids not in self._ranks:
+            raise KeyError(pair)
+        return self._ranks[ids]
 
     def __getitem__(self, item) -> Union[List[Merge], Merge]:
-        lst = self._get_sorted_merges()
-        return lst[item]
+        if isinstance(item, slice):
+            return [self._create_merge(i) for i in range(*item.indices(len(self)))]
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError('list index out of range')
+        return self._create_merge(item)
 
     def __repr__(self):
         return repr(self[:])
@@ -21,6 +21,8 @@ __version__ = '0.2'
 class BpePerformanceStatsEntry(object):
     def __init__(self, merges_done: int, time_for_last_merge: float,
                  n_priority_queue_entries: int,
+                 n_live_priority_queue_entries: int,
+                 n_removed_priority_queue_entries: int,
                  n_index_enties: int,
                  location_index_obj_size: float,
                  neighbour_index_obj_size: float,
@@ -29,6 +31,8 @@ class BpePerformanceStatsEntry(object):
         self.merges_done = merges_done
         self.time_for_last_merge = time_for_last_merge
         self.n_priority_queue_entries = n_priority_queue_entries
+        self.n_live_priority_queue_entries = n_live_priority_queue_entries
+        self.n_removed_priority_queue_entries = n_removed_priority_queue_entries
         self.n_index_entries = n_index_enties
         self.location_index_obj_size = location_index_obj_size
         self.neighbour_index_obj_size = neighbour_index_obj_size
@@ -392,6 +396,8 @@ def run(generator: Generator[str, None, None], n_merges: int=sys.maxsize,
                 merges_done=0,
                 time_for_last_merge=0,
                 n_priority_queue_entries=len(priority_counter.pq),
+                n_live_priority_queue_entries=priority_counter.n_live_entries,
+                n_removed_priority_queue_entries=priority_counter.n_removed_entries,
                 n_index_enties=len(location_index),
                 location_index_obj_size=getsize(location_index) / 1e+6,
                 neighbour_index_obj_size=getsize(neighbour_index) / 1e+6,
@@ -421,6 +427,8 @@ def run(generator: Generator[str, None, None], n_merges: int=sys.maxsize,
         if include_performance_stats_every_n_merges > 0 and (i == 1 or i % include_performance_stats_every_n_merges == 0):
             n_index_entries = len(location_index)
             n_priority_queue_entries = len(priority_counter.pq)
+            n_live_priority_queue_entries = priority_counter.n_live_entries
+            n_removed_priority_queue_entries = priority_counter.n_removed_entries
             location_index_obj_size = getsize(location_index) / 1e+6
             neighbour_index_obj_size = getsize(neighbour_index) / 1e+6
             priority_queue_obj_size = getsize(priority_counter) / 1e+6
@@ -428,7 +436,8 @@ def run(generator: Generator[str, None, None], n_merges: int=sys.maxsize,
             logger.debug(f"---------------------------  After merge {i}")
             logger.debug(f"Last merge was done in {time_per_merge} s")
             logger.debug(f'The number of keys in the index: {n_index_entries}')
-            logger.debug(f'Length of pq {n_priority_queue_entries}')
+            logger.debug(f'Length of pq {n_priority_queue_entries} '
+                         f'(live: {n_live_priority_queue_entries}, removed: {n_removed_priority_queue_entries})')
             logger.debug(f'Size of location index: {location_index_obj_size} (MB)')
             logger.debug(f'Size of neighbour index: {neighbour_index_obj_size} (MB)')
             logger.debug(f'Size of priority counter: {priority_queue_obj_size} (MB)')
@@ -438,6 +447,8 @@ def run(generator: Generator[str, None, None], n_merges: int=sys.maxsize,
                     merges_done=i,
                     time_for_last_merge=time_per_merge,
                     n_priority_queue_entries=n_priority_queue_entries,
+                    n_live_priority_queue_entries=n_live_priority_queue_entries,
+                    n_removed_priority_queue_entries=n_removed_priority_queue_entries,
                     n_index_enties=n_index_entries,
                     location_index_obj_size=location_index_obj_size,
                     neighbour_index_obj_size=neighbour_index_obj_size,
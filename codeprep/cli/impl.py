@@ -13,6 +13,7 @@ import codeprep.api.corpus
 import codeprep.api.text
 from codeprep.api.common import create_split_value, create_str_value
 from codeprep.bpepkg.bpe_config import BpeParam, BpeConfig
+from codeprep.config import BPE_CHECKPOINT_EVERY_SECONDS
 from codeprep.pipeline import bpelearner
 from codeprep.pipeline.bperegistry import InvalidBpeCodesIdError, USER_PREDEFINED_BPE_CODES
 from codeprep.pipeline.dataset import Dataset, normalize_extension_string
@@ -40,7 +41,12 @@ def handle_learnbpe(args):
     set_log_level(args)
     path = os.path.abspath(args['--path'])
     bpe_config = create_bpe_config_from_args(args)
-    n_merges = int(args['<n-merges>'])
+    n_merges = [int(n) for n in args['<n-merges>']]
+    n_workers = get_option(args, '--workers')
+    n_workers = int(n_workers) if n_workers is not None else 1
+    checkpoint_every_seconds = get_option(args, '--checkpoint-every')
+    checkpoint_every_seconds = int(checkpoint_every_seconds) if checkpoint_every_seconds is not None \
+        else BPE_CHECKPOINT_EVERY_SECONDS
     if args['--legacy']:
         parsed_extensions = normalize_extension_string(args['--ext'])
         if parsed_extensions and parsed_extensions != ['java']:
@@ -59,7 +65,8 @@ def handle_learnbpe(args):
         logger.warning(f"Ignoring passed bpe codes id: {bpe_codes_id}. "
               f"This dataset has already been assigned id: {dataset.bpe_codes_id}")
 
-    bpelearner.run(dataset, n_merges, bpe_config)
+    bpelearner.run(dataset, n_merges, bpe_config, n_workers=n_workers,
+                   checkpoint_every_seconds=checkpoint_every_seconds)
 
 
 def handle_splitting(args: Dict) -> None:
@@ -75,7 +82,8 @@ def handle_splitting(args: Dict) -> None:
             codeprep.api.corpus.preprocess_corpus(args['--path'], prep_config, bpe_codes_id,
                                                   extensions=args['--ext'],
                                                   output_path=args['--output-path'],
-                                                  calc_vocab=bool(args['--calc-vocab']))
+                                                  calc_vocab=bool(args['--calc-vocab']),
+                                                  approx_vocab=bool(args['--approx-vocab']))
     except InvalidBpeCodesIdError as err:
         logger.error(err)
         return
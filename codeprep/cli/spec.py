@@ -16,7 +16,7 @@ logger = logging.getLogger(__name__)
 def nosplit_handler(args):
     """usage: {program} nosplit (-p <path> [-o <path-out>] | <text>) [-e <ext>]
     [--no-spaces] [--no-unicode] [--no-com] ( [--no-str] | [-L=<max-str-length>] [--full-strings] )
-    [--calc-vocab] [--verbose]
+    [--calc-vocab | --approx-vocab] [--verbose]
 
     Preprocesses the dataset without splitting compound identifier.
 
@@ -40,6 +40,8 @@ def nosplit_handler(args):
                                                     equals to `sys.maxsize` if not specified.
 
       --calc-vocab -V                               Calculate vocabulary of the preprocessed dataset afterwards
+      --approx-vocab                                Calculate vocabulary approximately in bounded memory: keep only
+                                                    the most frequent words and estimate their counts
 
       --verbose, -v                                 Print logs with log level DEBUG and higher to stdout.
     """
@@ -50,7 +52,7 @@ def nosplit_handler(args):
 def chars_handler(args):
     """usage: {program} chars (-p <path> [-o <path-out>] | <text>) [-e <ext>]
     [--no-spaces] [--no-unicode] [--no-com] [--no-str | -L=<max-str-length>]
-    [--calc-vocab] [--verbose]
+    [--calc-vocab | --approx-vocab] [--verbose]
 
     Preprocesses the dataset by splitting identifiers into characters.
 
@@ -73,6 +75,8 @@ def chars_handler(args):
                                                     equals to `sys.maxsize` if not specified.
 
       --calc-vocab -V                               Calculate vocabulary of the preprocessed dataset afterwards
+      --approx-vocab                                Calculate vocabulary approximately in bounded memory: keep only
+                                                    the most frequent words and estimate their counts
 
       --verbose, -v                                 Print logs with log level DEBUG and higher to stdout.
     """
@@ -83,7 +87,7 @@ def chars_handler(args):
 def basic_handler(args):
     """usage: {program} basic (-p <path> [-o <path-out>] | <text>) [-e <ext>] [-n [-r [-s]]]
     [--no-spaces] [--no-unicode] [--no-case] [--no-com] [--no-str | -L=<max-str-length>]
-    [--calc-vocab] [--verbose]
+    [--calc-vocab | --approx-vocab] [--verbose]
 
 
     Preprocesses the dataset by splitting compound identifiers according to CamelCase and snake_case conventions.
@@ -112,6 +116,8 @@ def basic_handler(args):
                                                     equals to `sys.maxsize` if not specified.
 
       --calc-vocab -V                               Calculate vocabulary of the preprocessed dataset afterwards
+      --approx-vocab                                Calculate vocabulary approximately in bounded memory: keep only
+                                                    the most frequent words and estimate their counts
 
       --verbose, -v                                 Print logs with log level DEBUG and higher to stdout.
     """
@@ -121,7 +127,8 @@ def basic_handler(args):
 @dsc.command()
 def bpe_handler(args):
     """usage: {program} bpe (1k | 5k | 10k | <bpe-codes-id>) (-p <path> [-o <path-out>] | <text>) [-e <ext>]
-    [--no-str | -L=<max-str-length>] [--no-com] [--no-spaces] [--no-unicode] [--calc-vocab] [--verbose]
+    [--no-str | -L=<max-str-length>] [--no-com] [--no-spaces] [--no-unicode] [--calc-vocab | --approx-vocab]
+    [--verbose]
 
     Preprocesses the dataset by splitting compound identifiers according to CamelCase and snake_case conventions,
     and applies byte-pair encoding (BPE) on top.
@@ -146,6 +153,8 @@ def bpe_handler(args):
                                                     equals to `sys.maxsize` if not specified.
 
       --calc-vocab -V                               Calculate vocabulary of the preprocessed dataset afterwards
+      --approx-vocab                                Calculate vocabulary approximately in bounded memory: keep only
+                                                    the most frequent words and estimate their counts
 
       --verbose, -v                                 Print logs with log level DEBUG and higher to stdout.
     """
@@ -154,12 +163,13 @@ def bpe_handler(args):
 
 @dsc.command()
 def bpelearn_handler(args):
-    """usage: {program} learn-bpe <n-merges> -p <path> [-e <ext>] [--id <bpe-codes-id>] [--no-unicode | --bytes] [--word-end] [--legacy] [--verbose]
+    """usage: {program} learn-bpe <n-merges>... -p <path> [-e <ext>] [--id <bpe-codes-id>] [--no-unicode | --bytes] [--word-end] [--legacy] [-j <n-workers>] [--checkpoint-every <seconds>] [--verbose]
 
     Trains bpe codes on a specified corpus.
 
     Options:
-      <n-merges>                                   The number of BPE merges to compute
+      <n-merges>                                   The number of BPE merges to compute. If several numbers are specified,
+                                                   merges are learned in one pass and the results are saved for each of them.
       -p, --path <path>                            Path to the dataset to be used to learn bpe codes.
       -e --ext <ext>                               Limits the set of input files to the files with the specified extension(s).
                                                    The format is the following: "ext1|ext2|...|extN" If not specififed, all the files are read.
@@ -168,6 +178,8 @@ def bpelearn_handler(args):
       --bytes, -b                                  Treat non-ascii characters as 2 bytes and do real byte-pair encoding.
       --word-end, -z                               Add a special character to the end of each word.
       --legacy                                     Parse using legacy parser (only files with extension “.java” will be processed)
+      -j, --workers <n-workers>                    The number of processes used to learn merges. If not specified, merges are learned in a single process.
+      --checkpoint-every <seconds>                 The interval between checkpoints from which learning is resumed if it is interrupted. 0 disables checkpoints. If not specified, a checkpoint is saved every 15 minutes.
       --verbose, -v                                Print logs with log level DEBUG and higher to stdout.
     """
     handle_learnbpe(args)
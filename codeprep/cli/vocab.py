@@ -5,6 +5,7 @@
 import argparse
 import logging
 
+from codeprep.config import VOCAB_N_PARTITIONS
 from codeprep.dirutils import walk
 from codeprep.pipeline.vocab import calc_vocab
 
@@ -16,8 +17,11 @@ if __name__ == '__main__':
     parser.add_argument('path_to_dataset', action='store', help=f'path to dataset')
     parser.add_argument('output_dir', action='store', help=f'output dir')
     parser.add_argument('extension', action='store', help=f'extension')
+    parser.add_argument('--partitions', action='store', type=int, default=VOCAB_N_PARTITIONS,
+                        help=f'number of partitions words are split into by hash and counted in separate processes')
 
     args = parser.parse_known_args()
     args = args[0]
 
-    calc_vocab(args.path_to_dataset, walk(args.path_to_dataset.encode(), extension=args.extension.encode()), args.output_dir)
\ No newline at end of file
+    file_iterator = walk(args.path_to_dataset.encode(), extension=args.extension.encode())
+    calc_vocab(args.path_to_dataset, file_iterator, args.output_dir, n_partitions=args.partitions)
\ No newline at end of file
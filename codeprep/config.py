@@ -44,5 +44,34 @@ REWRITE_PARSED_FILE=False
 REWRITE_PREPROCESSED_FILE=False
 
 CHUNKSIZE=24
+# Java and Python files are lexed by the scanners from codeprep.parse.scanners instead of the Pygments lexers
+USE_FAST_SCANNERS=True
+# number of distinct tokens, e.g. identifiers, whose split is cached by each parsing process
+SPLIT_TOKEN_CACHE_MAX_SIZE=1 << 16
+BPE_CACHE_MAX_SIZE=1000000
+# newly encoded words are added to merges_cache.txt of predefined codes, the oldest entries are dropped above this size
+BPE_PERSISTENT_CACHE_MAX_SIZE=3000000
+# collect distinct words of the corpus first and bpe-encode each of them once before preprocessing files
+BPE_ENCODE_UNIQUE_WORDS_ONCE=False
+# default interval between checkpoints of learn-bpe runs, can be set with learn-bpe --checkpoint-every
+BPE_CHECKPOINT_EVERY_SECONDS=15 * 60
+# partial vocabs held in memory by a process merging them are spilled to disk above this number of words.
+# Each of the merging processes holds up to this number of words, and the vocabs they return to the parent process
+# are spilled above this number divided by the number of processes. So the peak is about (n_processes + 1) times
+# this number of words, until the final merged vocab is loaded by the parent process
+VOCAB_MERGE_MAX_WORDS_IN_MEMORY=20000000
+# if > 0, words are split into this number of partitions by hash and each partition is counted by a separate process
+VOCAB_N_PARTITIONS=0
+# approximate vocab: the number of the most frequent words kept, the bound of the overestimation of word counts
+# relative to the total number of words and the probability of exceeding it
+VOCAB_APPROX_MAX_WORDS=1000000
+VOCAB_APPROX_EPSILON=1e-5
+VOCAB_APPROX_DELTA=1e-3
+# word counts are stored per top-level directory of the dataset, so that the vocab of a newer version of the dataset
+# is updated by counting only the directories that have been added or changed
+VOCAB_INCREMENTAL=False
 LIMIT_FILES_ON_LAST_MODIFICATION_CHECK=1000
-LIMIT_FILES_SCANNING=50000
\ No newline at end of file
+LIMIT_FILES_SCANNING=50000
+# compression of parsed files: none, fast (gzip level 1) or default (gzip level 9),
+# parsed files saved with any of them can be read
+PARSED_FILE_CODEC='fast'
\ No newline at end of file
@@ -3,8 +3,15 @@
 # SPDX-License-Identifier: Apache-2.0
 
 import logging
+import os
 
-from typing import List, Tuple
+from typing import List, Tuple, Optional, IO
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
 
 logger = logging.getLogger(__name__)
 
@@ -45,4 +52,69 @@ def read_file_contents(file_path: bytes) -> Tuple[List[str], bytes]:
 
 def read_file_with_encoding(file_path: bytes, encoding: str) -> Tuple[List[str], bytes]:
     with open(file_path, 'r', encoding=encoding) as f:
-        return [line.rstrip('\n') for line in f], file_path
\ No newline at end of file
+        return [line.rstrip('\n') for line in f], file_path
+
+
+class FileLock(object):
+    """
+    Exclusive lock between processes on the file at `path`, which is created if it does not exist.
+    The lock is released when the process that holds it exits, even if the process crashes.
+
+    >>> import os, tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'file.lock')
+    >>> with FileLock(path):
+    ...     FileLock(path).acquire(blocking=False)
+    False
+    >>> lock = FileLock(path)
+    >>> lock.acquire(blocking=False)
+    True
+    >>> lock.release()
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._file: Optional[IO] = None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        """
+        Returns False if `blocking` is False and the lock is held by another file object.
+        """
+        f = open(self.path, 'a+')
+        try:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+        except OSError:
+            f.close()
+            if blocking:
+                raise
+            return False
+        self._file = f
+        return True
+
+    def release(self) -> None:
+        if fcntl:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        else:
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        self._file.close()
+        self._file = None
+
+    def remove(self) -> None:
+        """
+        Removes the lock file once the lock is not needed any more. The processes which have opened the file before
+        can still acquire the lock, so they must check that what the lock protects still exists.
+        """
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
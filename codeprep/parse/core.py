@@ -3,14 +3,17 @@
 # SPDX-License-Identifier: Apache-2.0
 
 import logging
-from typing import List
+from typing import List, Dict, Optional
 
 from pygments import lex
-from pygments.lexers import get_lexer_by_name, guess_lexer
+from pygments.lexer import Lexer
+from pygments.lexers import get_lexer_by_name, guess_lexer, find_lexer_class
 from pygments.util import ClassNotFound
 
+from codeprep.config import USE_FAST_SCANNERS
 from codeprep.parse import matchers
 from codeprep.parse.matchers import DefaultMatcher
+from codeprep.parse.scanners import get_scanner
 from codeprep.tokens.rootclasses import ParsedToken
 
 logger = logging.getLogger(__name__)
@@ -31,28 +34,156 @@ matchers = [
 ]
 
 
-def _convert(token, value: str) -> List[ParsedToken]:
+default_matcher = DefaultMatcher()
+
+NEW_LINE_SHAPE, TAB_SHAPE, WHITESPACE_SHAPE, OTHER_SHAPE = range(4)
+
+
+def get_value_shape(value: str) -> int:
+    """
+    The matchers that look at the value of a token only check if it is a new line, a tab or whitespace,
+    so the first matcher matching a token is determined by its type and the shape of its value.
+
+    >>> [get_value_shape(value) for value in ['\\n', '\\t', '  ', '', 'a', ' a ']]
+    [0, 1, 2, 2, 3, 3]
+    """
+    if value == '\n':
+        return NEW_LINE_SHAPE
+    elif value == '\t':
+        return TAB_SHAPE
+    elif not value or value.isspace():
+        return WHITESPACE_SHAPE
+    else:
+        return OTHER_SHAPE
+
+
+_matcher_dispatch_table = {}
+
+
+def _find_matcher(token, value: str):
     for matcher in matchers:
         if matcher.match(token, value):
-            return matcher.transform(value)
+            return matcher
 
-    if DefaultMatcher().match(token, value):
-        return DefaultMatcher().transform(value)
+    if default_matcher.match(token, value):
+        return default_matcher
 
     assert False
 
 
-def convert_text(text: str, extension: str) -> List[ParsedToken]:
-    extension = extension or 'java'
-    if extension:
+def get_matcher(token, value: str):
+    """
+    The matcher found for a token is memoized by the type of the token and the shape of its value.
+    """
+    key = (token, get_value_shape(value))
+    matcher = _matcher_dispatch_table.get(key)
+    if matcher is None:
+        matcher = _find_matcher(token, value)
+        _matcher_dispatch_table[key] = matcher
+    return matcher
+
+
+def _convert(token, value: str) -> List[ParsedToken]:
+    return get_matcher(token, value).transform(value)
+
+
+class LexerCacheStats(object):
+    def __init__(self, lookups: int, guesses: int, guesses_avoided: int, unknown_extensions: int):
+        self.lookups = lookups
+        self.guesses = guesses
+        self.guesses_avoided = guesses_avoided
+        self.unknown_extensions = unknown_extensions
+
+    def __eq__(self, other):
+        return self.__class__ == other.__class__ and self.__dict__ == other.__dict__
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(lookups={self.lookups}, guesses={self.guesses}, ' \
+               f'guesses_avoided={self.guesses_avoided}, unknown_extensions={self.unknown_extensions})'
+
+
+class LexerCache(object):
+    """
+    Per-process cache of lexers keyed by file extension. Extensions unknown to Pygments are cached too:
+    the lexer is guessed from the text of the first file with such an extension and is reused for all
+    the other files with it. `resolution_table` maps unknown extensions to the names of the lexers guessed for them,
+    e.g. once for the whole dataset, so that no guessing is needed at all for the extensions it contains.
+    If `use_fast_scanners` is set, the lexers of the languages which have a scanner in `codeprep.parse.scanners`
+    are replaced by these scanners.
+
+    >>> cache = LexerCache({'jav': 'Java'})
+    >>> cache.get_lexer('py', 'x = 1').name
+    'Python'
+    >>> cache.get_lexer('jav', 'class A {}').name
+    'Java'
+    >>> cache.get_lexer('unknownext', '#!/usr/bin/env python\\nx = 1').name
+    'Python'
+    >>> cache.get_lexer('unknownext', '<?php echo 1; ?>').name
+    'Python'
+    >>> cache.resolution_table
+    {'jav': 'Java', 'unknownext': 'Python'}
+    >>> cache.stats()
+    LexerCacheStats(lookups=4, guesses=1, guesses_avoided=2, unknown_extensions=2)
+    """
+    def __init__(self, resolution_table: Optional[Dict[str, str]] = None, use_fast_scanners: bool = USE_FAST_SCANNERS):
+        self.resolution_table = dict(resolution_table) if resolution_table else {}
+        self.use_fast_scanners = use_fast_scanners
+        self._lexers: Dict[str, Lexer] = {}
+        self._unknown_extensions = set()
+        self._lookups = 0
+        self._guesses = 0
+        self._guesses_avoided = 0
+
+    def get_lexer(self, extension: str, text: str) -> Lexer:
+        self._lookups += 1
+        lexer = self._lexers.get(extension)
+        if lexer is not None:
+            if extension in self._unknown_extensions:
+                self._guesses_avoided += 1
+            return lexer
+
         try:
             lexer = get_lexer_by_name(extension)
         except ClassNotFound as err:
-            logger.warning(err)
-            lexer = guess_lexer(text)
-    else:
-        lexer = guess_lexer(text)
+            self._unknown_extensions.add(extension)
+            lexer_class = None
+            if extension in self.resolution_table:
+                lexer_class = find_lexer_class(self.resolution_table[extension])
+                if lexer_class is None:
+                    logger.warning(f'Lexer {self.resolution_table[extension]} resolved for extension {extension} '
+                                   f'is not found. Guessing the lexer instead.')
+            if lexer_class is not None:
+                lexer = lexer_class()
+                self._guesses_avoided += 1
+            else:
+                logger.warning(err)
+                lexer = guess_lexer(text)
+                self._guesses += 1
+                self.resolution_table[extension] = lexer.name
+        if self.use_fast_scanners:
+            lexer = get_scanner(lexer)
+        self._lexers[extension] = lexer
+        return lexer
+
+    def stats(self) -> LexerCacheStats:
+        return LexerCacheStats(self._lookups, self._guesses, self._guesses_avoided, len(self._unknown_extensions))
+
+
+lexer_cache = LexerCache()
+
+
+def init_lexer_cache(resolution_table: Optional[Dict[str, str]] = None) -> None:
+    global lexer_cache
+    lexer_cache = LexerCache(resolution_table)
+
+
+def get_lexer(text: str, extension: Optional[str]) -> Lexer:
+    return lexer_cache.get_lexer(extension or 'java', text)
+
+
+def convert_text(text: str, extension: Optional[str]) -> List[ParsedToken]:
+    lexer = get_lexer(text, extension)
     for token, value in lex(text, lexer):
         model_tokens = _convert(token, value)
         for mr in model_tokens:
-            yield mr
\ No newline at end of file
+            yield mr
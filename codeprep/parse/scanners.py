@@ -0,0 +1,311 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Fast scanners for the languages most of the datasets are written in.
+
+A Pygments `RegexLexer` tries the rules of its current state one after another at each position of the text,
+i.e. a regex is matched from Python for each rule until one of them matches. The scanners use the rules
+of the Pygments lexers of these languages, but the rules of each state are combined into alternations,
+one per possible first ASCII character of a token, which contain only the rules that can match
+a token starting with this character. The alternatives are tried in the order of the rules, so the first
+matching rule is the same as for the Pygments lexer, and so are the produced tokens.
+
+>>> from pygments import lex
+>>> code = 'class A {\\n  // comment\\n  int a = 0x1F;\\n}'
+>>> list(lex(code, JavaScanner())) == list(lex(code, JavaLexer()))
+True
+"""
+import logging
+import re
+from typing import Dict, FrozenSet, List, Tuple, Callable, Optional, Type
+
+from pygments.lexer import Lexer, RegexLexer
+from pygments.lexers.jvm import JavaLexer
+from pygments.lexers.python import PythonLexer
+from pygments.token import Text, Error, _TokenType
+
+try:
+    from re import _constants as sre_constants, _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_constants
+    import sre_parse
+
+logger = logging.getLogger(__name__)
+
+N_ASCII_CHARS = 128
+ALL_ASCII_CHARS = frozenset(range(N_ASCII_CHARS))
+
+# a flag like (?i) at the beginning of a rule applies to the whole regex, it is scoped to the rule once it is combined
+GLOBAL_INLINE_FLAGS_REGEX = re.compile(r'\(\?([imsx]+)\)')
+
+_CATEGORY_REGEXES = {
+    sre_constants.CATEGORY_WORD: r'\w', sre_constants.CATEGORY_NOT_WORD: r'\W',
+    sre_constants.CATEGORY_DIGIT: r'\d', sre_constants.CATEGORY_NOT_DIGIT: r'\D',
+    sre_constants.CATEGORY_SPACE: r'\s', sre_constants.CATEGORY_NOT_SPACE: r'\S',
+}
+
+Rule = Tuple[Callable, object, object]
+
+
+def _with_other_case(chars: FrozenSet[int], ignore_case: bool) -> FrozenSet[int]:
+    if not ignore_case:
+        return chars
+    result = set(chars)
+    for char in chars:
+        for variant in [chr(char).lower(), chr(char).upper()]:
+            if len(variant) == 1 and ord(variant) < N_ASCII_CHARS:
+                result.add(ord(variant))
+    return frozenset(result)
+
+
+def _first_chars_of_set(items, ignore_case: bool) -> FrozenSet[int]:
+    chars = set()
+    negate = False
+    for op, av in items:
+        if op is sre_constants.NEGATE:
+            negate = True
+        elif op is sre_constants.LITERAL:
+            if av < N_ASCII_CHARS:
+                chars.add(av)
+        elif op is sre_constants.RANGE:
+            chars.update(range(av[0], min(av[1], N_ASCII_CHARS - 1) + 1))
+        elif op is sre_constants.CATEGORY and av in _CATEGORY_REGEXES:
+            category_regex = re.compile(_CATEGORY_REGEXES[av])
+            chars.update(char for char in range(N_ASCII_CHARS) if category_regex.match(chr(char)))
+        else:
+            return ALL_ASCII_CHARS
+    chars = _with_other_case(frozenset(chars), ignore_case)
+    return ALL_ASCII_CHARS - chars if negate else chars
+
+
+def _first_chars(items, ignore_case: bool) -> Tuple[FrozenSet[int], bool]:
+    """
+    Returns the ASCII characters a match of the parsed regex can start with and whether the match can be empty.
+    Zero-width assertions are assumed to always hold, so the result can only contain more characters than necessary.
+    """
+    result = frozenset()
+    for op, av in items:
+        can_be_empty = False
+        if op is sre_constants.LITERAL:
+            chars = _with_other_case(frozenset([av] if av < N_ASCII_CHARS else []), ignore_case)
+        elif op is sre_constants.IN:
+            chars = _first_chars_of_set(av, ignore_case)
+        elif op in (sre_constants.AT, sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            chars, can_be_empty = frozenset(), True
+        elif op is sre_constants.SUBPATTERN:
+            _, add_flags, del_flags, subpattern = av
+            chars, can_be_empty = _first_chars(subpattern, (ignore_case or bool(add_flags & re.IGNORECASE))
+                                               and not del_flags & re.IGNORECASE)
+        elif op is sre_constants.BRANCH:
+            chars = frozenset()
+            for alternative in av[1]:
+                alternative_chars, alternative_can_be_empty = _first_chars(alternative, ignore_case)
+                chars |= alternative_chars
+                can_be_empty = can_be_empty or alternative_can_be_empty
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+            min_repeat, _, subpattern = av
+            chars, can_be_empty = _first_chars(subpattern, ignore_case)
+            can_be_empty = can_be_empty or min_repeat == 0
+        else:
+            return ALL_ASCII_CHARS, True
+        result |= chars
+        if not can_be_empty:
+            return result, False
+    return result, True
+
+
+def first_ascii_chars(pattern) -> FrozenSet[int]:
+    """
+    Codes of the ASCII characters a non-empty match of a compiled regex can start with;
+    all of them if the regex can match an empty string.
+
+    >>> sorted(map(chr, first_ascii_chars(re.compile('(?i)(rb|br|r)(")'))))
+    ['B', 'R', 'b', 'r']
+    >>> sorted(map(chr, first_ascii_chars(re.compile(r'(?<!\\.)(abs|all)\\b|[0-2]'))))
+    ['0', '1', '2', 'a']
+    >>> first_ascii_chars(re.compile('a?')) == ALL_ASCII_CHARS
+    True
+    """
+    try:
+        chars, can_be_empty = _first_chars(sre_parse.parse(pattern.pattern, pattern.flags),
+                                           bool(pattern.flags & re.IGNORECASE))
+    except (sre_constants.error, TypeError, ValueError):
+        return ALL_ASCII_CHARS
+    return ALL_ASCII_CHARS if can_be_empty else chars
+
+
+def _nested_subpatterns(av):
+    if isinstance(av, sre_parse.SubPattern):
+        yield av
+    elif isinstance(av, (tuple, list)):
+        for item in av:
+            yield from _nested_subpatterns(item)
+
+
+def _references_groups(items) -> bool:
+    for op, av in items:
+        if op in (sre_constants.GROUPREF, sre_constants.GROUPREF_EXISTS):
+            return True
+        if any(_references_groups(subpattern) for subpattern in _nested_subpatterns(av)):
+            return True
+    return False
+
+
+def references_groups(pattern) -> bool:
+    """
+    Whether a compiled regex contains a backreference or a conditional referring to a group,
+    which would refer to a different group once the regex is combined with others.
+
+    >>> references_groups(re.compile(r'(a|b)+\\1')), references_groups(re.compile(r'(?:(a)|b)(?(1)c)'))
+    (True, True)
+    >>> references_groups(re.compile(r'(a|b)+\\\\1'))
+    False
+    """
+    return _references_groups(sre_parse.parse(pattern.pattern, pattern.flags))
+
+
+def _scoped(pattern: str) -> str:
+    m = GLOBAL_INLINE_FLAGS_REGEX.match(pattern)
+    return f'(?{m[1]}:{pattern[m.end():]})' if m else pattern
+
+
+def combine_rules(rules: List[Rule], flags: int) -> Tuple[Callable, Dict[int, Rule]]:
+    """
+    Combines the regexes of `rules` into one alternation. Returns its `match` method and the rules
+    by the index of the group wrapping their regexes, which is the last index of a match.
+    """
+    alternatives = []
+    rules_by_group = {}
+    group = 1
+    for rule in rules:
+        pattern = rule[0].__self__
+        if pattern.groupindex:
+            raise ValueError(f'Rules with named groups cannot be combined: {pattern.pattern}')
+        if references_groups(pattern):
+            raise ValueError(f'Rules with group references cannot be combined: {pattern.pattern}')
+        alternatives.append(f'({_scoped(pattern.pattern)})')
+        rules_by_group[group] = rule
+        group += pattern.groups + 1
+    # no rule can match a token starting with some characters, (?!) never matches
+    return re.compile('|'.join(alternatives) or '(?!)', flags).match, rules_by_group
+
+
+class ScannerState(object):
+    def __init__(self, rules: List[Rule], flags: int):
+        self.all_rules = combine_rules(rules, flags)
+        first_chars = [first_ascii_chars(rule[0].__self__) for rule in rules]
+        combined_by_rule_indices = {}
+        self.rules_by_first_char = []
+        for char in range(N_ASCII_CHARS):
+            rule_indices = tuple(i for i, chars in enumerate(first_chars) if char in chars)
+            if rule_indices not in combined_by_rule_indices:
+                combined_by_rule_indices[rule_indices] = combine_rules([rules[i] for i in rule_indices], flags)
+            self.rules_by_first_char.append(combined_by_rule_indices[rule_indices])
+
+
+class FastScanningMixin(object):
+    """
+    Replaces `RegexLexer.get_tokens_unprocessed` of a Pygments lexer. The combined regexes are compiled
+    once per process, by `get_scanner` when the first scanner of the language is created.
+    """
+    _scanner_states: Optional[Dict[str, ScannerState]] = None
+
+    @classmethod
+    def get_scanner_states(cls) -> Dict[str, ScannerState]:
+        if cls.__dict__.get('_scanner_states') is None:
+            flags = cls.flags & ~re.IGNORECASE
+            cls._scanner_states = {state: ScannerState(rules, flags) for state, rules in cls._tokens.items()}
+        return cls._scanner_states
+
+    def get_tokens_unprocessed(self, text, stack=('root',)):
+        scanner_states = self.get_scanner_states()
+        pos = 0
+        text_length = len(text)
+        statestack = list(stack)
+        state = scanner_states[statestack[-1]]
+        while True:
+            if pos < text_length:
+                char = ord(text[pos])
+                match, rules_by_group = state.rules_by_first_char[char] if char < N_ASCII_CHARS else state.all_rules
+            else:
+                match, rules_by_group = state.all_rules
+            m = match(text, pos)
+            if m:
+                rexmatch, action, new_state = rules_by_group[m.lastindex]
+                if action is not None:
+                    if type(action) is _TokenType:
+                        yield pos, action, m.group()
+                    else:
+                        # callbacks expect the groups of the rule's own regex
+                        yield from action(self, rexmatch(text, pos))
+                pos = m.end()
+                if new_state is not None:
+                    # state transitions as in `RegexLexer.get_tokens_unprocessed`
+                    if isinstance(new_state, tuple):
+                        for s in new_state:
+                            if s == '#pop':
+                                if len(statestack) > 1:
+                                    statestack.pop()
+                            elif s == '#push':
+                                statestack.append(statestack[-1])
+                            else:
+                                statestack.append(s)
+                    elif isinstance(new_state, int):
+                        if abs(new_state) >= len(statestack):
+                            del statestack[1:]
+                        else:
+                            del statestack[new_state:]
+                    elif new_state == '#push':
+                        statestack.append(statestack[-1])
+                    else:
+                        assert False, f"wrong state def: {new_state}"
+                    state = scanner_states[statestack[-1]]
+            elif pos >= text_length:
+                break
+            elif text[pos] == '\n':
+                statestack = ['root']
+                state = scanner_states['root']
+                yield pos, Text, '\n'
+                pos += 1
+            else:
+                yield pos, Error, text[pos]
+                pos += 1
+
+
+class JavaScanner(FastScanningMixin, JavaLexer):
+    pass
+
+
+class PythonScanner(FastScanningMixin, PythonLexer):
+    pass
+
+
+SCANNERS: Dict[Type[RegexLexer], Type[Lexer]] = {
+    JavaLexer: JavaScanner,
+    PythonLexer: PythonScanner,
+}
+
+
+def get_scanner(lexer: Lexer) -> Lexer:
+    """
+    Returns the fast scanner for the language of `lexer` if there is one, otherwise the lexer itself.
+    The lexer itself is returned too if the rules of its language cannot be combined into a scanner.
+
+    >>> type(get_scanner(JavaLexer())).__name__
+    'JavaScanner'
+    >>> from pygments.lexers.javascript import JavascriptLexer
+    >>> type(get_scanner(JavascriptLexer())).__name__
+    'JavascriptLexer'
+    """
+    scanner_class = SCANNERS.get(type(lexer))
+    if not scanner_class:
+        return lexer
+    scanner = scanner_class(**lexer.options)
+    try:
+        scanner.get_scanner_states()
+    except ValueError as err:
+        logger.warning(f'Cannot use the fast scanner for {lexer.name}, falling back to the Pygments lexer: {err}')
+        return lexer
+    return scanner
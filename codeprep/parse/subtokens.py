@@ -2,28 +2,38 @@
 #
 # SPDX-License-Identifier: Apache-2.0
 
-from typing import List
+from functools import lru_cache
+from typing import List, Tuple, Type
 
 import regex
 
+from codeprep.config import SPLIT_TOKEN_CACHE_MAX_SIZE
 from codeprep.noneng import is_non_eng
 from codeprep.tokens.containers import SplitContainer
 from codeprep.tokens.noneng import NonEng
 from codeprep.tokens.numeric import Number
-from codeprep.tokens.rootclasses import ParsedToken
+from codeprep.tokens.rootclasses import ParsedToken, ParsedSubtoken
 from codeprep.tokens.whitespace import NewLine, Tab, SpaceInString
 from codeprep.tokens.word import Underscore, Word, NonCodeChar
 
 
-def split_identifier(token: str) -> SplitContainer:
-    parts = [m[0] for m in
-             regex.finditer('(_|[0-9]+|[[:upper:]]?[[:lower:]]+|[[:upper:]]+(?![[:lower:]])|[^ ])', token)]
+IDENTIFIER_PART_REGEX = regex.compile('(_|[0-9]+|[[:upper:]]?[[:lower:]]+|[[:upper:]]+(?![[:lower:]])|[^ ])')
+WORD_REGEX = regex.compile('\\w+')
+# runs of spaces in strings, which are kept as `SpaceInString`s, are matched by the second group
+STRING_PART_REGEX = regex.compile('(\\w+|[^ ])|( +)')
+FOUR_SPACES = ' ' * 4
+WORDS_REGEX = regex.compile(f'(\\w+|[^ ]|{FOUR_SPACES})')
+
 
-    processable_tokens = [Word.from_(p) if p != '_' else Underscore() for p in parts]
-    split_container = SplitContainer(processable_tokens)
+def split_identifier(token: str) -> SplitContainer:
+    split_container = SplitContainer(list(_split_identifier_parts(token)))
     return NonEng(split_container) if is_non_eng(token) else split_container
 
 
+def _split_identifier_parts(token: str) -> Tuple[ParsedSubtoken, ...]:
+    return tuple(Word.from_(m[0]) if m[0] != '_' else Underscore() for m in IDENTIFIER_PART_REGEX.finditer(token))
+
+
 # Using the same regexps SLP team uses to parse numbers in java code
 # https://github.com/SLP-team/SLP-Core/blob/master/src/main/java/slp/core/lexing/code/JavaLexer.java
 
@@ -36,6 +46,7 @@ DBL_REGEXC = "\\.[0-9]+([eE][-+]?[0-9]+)?[fFdD]?"
 DBL_REGEXD = "[0-9]+[eE][-+]?[0-9]+[fFdD]?"
 
 NUMBER_PATTERN = f'({HEX_REGEX}|{BIN_REGEX}|{IR_REGEX}|{DBL_REGEXA}|{DBL_REGEXB}|{DBL_REGEXC}|{DBL_REGEXD})'
+NUMBER_REGEX = regex.compile(NUMBER_PATTERN)
 
 
 def is_number(word: str) -> bool:
@@ -109,20 +120,44 @@ def is_number(word: str) -> bool:
     >>> is_number("0x56Dl")
     True
     """
-    return regex.fullmatch(NUMBER_PATTERN, word) is not None
+    return NUMBER_REGEX.fullmatch(word) is not None
 
 
-def to_parsed_token(token: str) -> ParsedToken:
+@lru_cache(maxsize=SPLIT_TOKEN_CACHE_MAX_SIZE)
+def _split_token(token: str) -> Tuple[Type[ParsedToken], tuple]:
+    """
+    Returns the type of the parsed token and the arguments to create it with, the subtokens of an identifier
+    as a tuple. The result is cached, so it is immutable.
+    """
     if token == '\n':
-        return NewLine()
+        return NewLine, ()
     elif token == '\t':
-        return Tab()
+        return Tab, ()
     elif is_number(token):
-        return Number(token)
-    elif regex.fullmatch("\\w+", token):
-        return split_identifier(token)
+        return Number, (token,)
+    elif WORD_REGEX.fullmatch(token):
+        return (NonEng if is_non_eng(token) else SplitContainer), _split_identifier_parts(token)
     else:
-        return NonCodeChar(token)
+        return NonCodeChar, (token,)
+
+
+def to_parsed_token(token: str) -> ParsedToken:
+    """
+    A new token is created for each occurrence from the cached split of the token, so it can be modified.
+
+    >>> to_parsed_token('getValue') is not to_parsed_token('getValue')
+    True
+    >>> to_parsed_token('getValue').add(Underscore())
+    >>> to_parsed_token('getValue')
+    SplitContainer[Word(('get', none)), Word(('value', first_letter))]
+    """
+    token_type, args = _split_token(token)
+    if token_type is SplitContainer:
+        return SplitContainer(list(args))
+    elif token_type is NonEng:
+        return NonEng(SplitContainer(list(args)))
+    else:
+        return token_type(*args)
 
 
 def split_string(token: str) -> List[ParsedToken]:
@@ -133,12 +168,11 @@ def split_string(token: str) -> List[ParsedToken]:
 NonCodeChar(.), <Number>(4), <Tab>, <NewLine>]
     """
     res = []
-    arbitrary_whitespace = "( )+"
-    for m in regex.finditer(f"(\\w+|[^ ]|{arbitrary_whitespace})", token):
-        if regex.fullmatch(arbitrary_whitespace, m[0]):
-            res.append(SpaceInString(n_chars=len(m[0])))
+    for m in STRING_PART_REGEX.finditer(token):
+        if m[2]:
+            res.append(SpaceInString(n_chars=len(m[2])))
         else:
-            res.append(to_parsed_token(m[0]))
+            res.append(to_parsed_token(m[1]))
     return res
 
 
@@ -149,10 +183,22 @@ def split_into_words(token: str) -> List[ParsedToken]:
 NonCodeChar(.), <Number>(4), <Tab>, <NewLine>]
     """
     res = []
-    four_char_whitespace = " " * 4
-    for m in regex.finditer(f"(\\w+|[^ ]|{four_char_whitespace})", token):
-        if m[0] == four_char_whitespace:
+    for m in WORDS_REGEX.finditer(token):
+        if m[0] == FOUR_SPACES:
             res.append(Tab())
         else:
             res.append(to_parsed_token(m[0]))
-    return res
\ No newline at end of file
+    return res
+
+
+def split_token_cache_stats():
+    """
+    Statistics of the cache of split tokens of the current process, for debugging.
+
+    >>> _split_token.cache_clear()
+    >>> split_into_words("i = i + 1")
+    [SplitContainer[Word(('i', none))], NonCodeChar(=), SplitContainer[Word(('i', none))], NonCodeChar(+), <Number>(1)]
+    >>> split_token_cache_stats()
+    CacheInfo(hits=1, misses=4, maxsize=65536, currsize=4)
+    """
+    return _split_token.cache_info()
\ No newline at end of file
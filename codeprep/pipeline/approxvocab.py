@@ -0,0 +1,315 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Calculates the vocabulary of a corpus approximately in bounded memory.
+
+Frequencies of all words are estimated with a Count-Min sketch, the most frequent words are kept
+with the Space-Saving algorithm and the number of distinct words is estimated with HyperLogLog.
+All three structures are mergeable, so each process counts its share of the files and the results are merged.
+"""
+import hashlib
+import logging
+import math
+import multiprocessing
+import os
+from array import array
+from collections import Counter
+from heapq import heappush, heappop, heapify, nlargest
+from multiprocessing.pool import Pool
+from typing import List, Tuple, Dict, Iterator
+
+from tqdm import tqdm
+
+from codeprep.config import VOCAB_APPROX_MAX_WORDS, VOCAB_APPROX_EPSILON, VOCAB_APPROX_DELTA
+from codeprep.pipeline.vocab import MAX_INIT_PARTIAL_VOCABS, VOCAB_FILENAME, VOCABSIZE_FILENAME, VocabStats, \
+    get_vocab, write_vocab_stats, _dump_vocab_dict
+from codeprep.preprocess.placeholders import placeholders
+from codeprep.util import groupify
+
+logger = logging.getLogger(__name__)
+
+
+def hash_word(word: str) -> int:
+    """
+    64-bit hash of a word which, unlike `hash()`, is the same in all processes.
+
+    >>> hash_word('foo') == hash_word('foo'), hash_word('foo') == hash_word('bar')
+    (True, False)
+    """
+    digest = hashlib.blake2b(word.encode('utf-8', 'surrogatepass'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+class CountMinSketch(object):
+    """
+    Estimates never undercount. With probability at least 1 - `delta`, an estimate exceeds the true count
+    by at most `epsilon` * total count of all the words added.
+
+    >>> sketch = CountMinSketch.from_error_bounds(epsilon=0.01, delta=0.01)
+    >>> sketch.width, sketch.depth
+    (272, 5)
+    >>> sketch.add(hash_word('a'), 3)
+    >>> other = CountMinSketch(272, 5)
+    >>> other.add(hash_word('a'), 2)
+    >>> sketch.merge(other)
+    >>> sketch.estimate(hash_word('a')), sketch.estimate(hash_word('b'))
+    (5, 0)
+    """
+    def __init__(self, width: int, depth: int):
+        self.width = width
+        self.depth = depth
+        self.table = array('Q', bytes(8 * width * depth))
+
+    @classmethod
+    def from_error_bounds(cls, epsilon: float, delta: float) -> 'CountMinSketch':
+        return cls(math.ceil(math.e / epsilon), math.ceil(math.log(1 / delta)))
+
+    def _cells(self, word_hash: int) -> List[int]:
+        # double hashing: row i uses h1 + i * h2
+        h1, h2 = word_hash & 0xffffffff, (word_hash >> 32) | 1
+        width = self.width
+        return [row * width + (h1 + row * h2) % width for row in range(self.depth)]
+
+    def add(self, word_hash: int, count: int = 1) -> None:
+        table = self.table
+        for cell in self._cells(word_hash):
+            table[cell] += count
+
+    def estimate(self, word_hash: int) -> int:
+        table = self.table
+        return min(table[cell] for cell in self._cells(word_hash))
+
+    def merge(self, other: 'CountMinSketch') -> None:
+        if (self.width, self.depth) != (other.width, other.depth):
+            raise ValueError(f"Cannot merge sketches of different sizes: "
+                             f"{self.width}x{self.depth} and {other.width}x{other.depth}")
+        self.table = array('Q', map(int.__add__, self.table, other.table))
+
+
+class HyperLogLog(object):
+    """
+    Estimates the number of distinct items with the relative standard error of about 1.04 / sqrt(2 ** `precision`).
+
+    >>> hll = HyperLogLog()
+    >>> for i in range(1000):
+    ...     hll.add(hash_word(str(i)))
+    >>> other = HyperLogLog()
+    >>> for i in range(500, 2000):
+    ...     other.add(hash_word(str(i)))
+    >>> hll.merge(other)
+    >>> abs(hll.estimate() - 2000) < 2000 * 0.05
+    True
+    """
+    def __init__(self, precision: int = 14):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, word_hash: int) -> None:
+        n_rest_bits = 64 - self.precision
+        index = word_hash >> n_rest_bits
+        rank = n_rest_bits - (word_hash & ((1 << n_rest_bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def estimate(self) -> int:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw_estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        n_zero_registers = self.registers.count(0)
+        if raw_estimate <= 2.5 * m and n_zero_registers:
+            # linear counting is more precise for small cardinalities
+            return int(round(m * math.log(m / n_zero_registers)))
+        return int(round(raw_estimate))
+
+    def merge(self, other: 'HyperLogLog') -> None:
+        if self.precision != other.precision:
+            raise ValueError(f"Cannot merge HyperLogLogs of different precision: {self.precision} and {other.precision}")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+
+class SpaceSaving(object):
+    """
+    Keeps at most `capacity` words. Every word occurring more than (total count) / `capacity` times is kept.
+    The count of a kept word is never lower than its true count and overestimates it by at most its error.
+
+    >>> heavy_hitters = SpaceSaving(2)
+    >>> for word, count in [('a', 5), ('b', 1), ('c', 2), ('a', 1)]:
+    ...     heavy_hitters.add(word, count)
+    >>> sorted(heavy_hitters.counts.items()), sorted(heavy_hitters.errors.items())
+    ([('a', 6), ('c', 3)], [('a', 0), ('c', 1)])
+    >>> other = SpaceSaving(2)
+    >>> other.add('c', 4)
+    >>> heavy_hitters.merge(other)
+    >>> sorted(heavy_hitters.counts.items()), sorted(heavy_hitters.errors.items())
+    ([('a', 6), ('c', 7)], [('a', 0), ('c', 1)])
+    """
+    def __init__(self, capacity: int):
+        if capacity <= 0:
+            raise ValueError(f"Capacity must be positive, got: {capacity}")
+        self.capacity = capacity
+        self.counts: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        # (count, word) pairs, the ones with an outdated count are skipped when popped
+        self._heap: List[Tuple[int, str]] = []
+
+    def min_count(self) -> int:
+        """The count an unkept word might have had; 0 until the capacity is reached."""
+        if len(self.counts) < self.capacity:
+            return 0
+        heap, counts = self._heap, self.counts
+        while counts.get(heap[0][1]) != heap[0][0]:
+            heappop(heap)
+        return heap[0][0]
+
+    def add(self, word: str, count: int = 1) -> None:
+        counts = self.counts
+        if word in counts:
+            counts[word] += count
+        elif len(counts) < self.capacity:
+            counts[word] = count
+            self.errors[word] = 0
+        else:
+            min_count = self.min_count()
+            _, evicted_word = heappop(self._heap)
+            del counts[evicted_word]
+            del self.errors[evicted_word]
+            counts[word] = min_count + count
+            self.errors[word] = min_count
+        heappush(self._heap, (counts[word], word))
+        if len(self._heap) > 2 * self.capacity:
+            self._rebuild_heap()
+
+    def merge(self, other: 'SpaceSaving') -> None:
+        """
+        A word missing from one of the summaries might have had up to the minimum count of that summary there.
+        """
+        self_min_count, other_min_count = self.min_count(), other.min_count()
+        merged_counts = {}
+        merged_errors = {}
+        for word in list(self.counts) + [w for w in other.counts if w not in self.counts]:
+            merged_counts[word] = self.counts.get(word, self_min_count) + other.counts.get(word, other_min_count)
+            merged_errors[word] = self.errors.get(word, self_min_count) + other.errors.get(word, other_min_count)
+        kept_words = nlargest(self.capacity, merged_counts, key=merged_counts.__getitem__)
+        self.counts = {word: merged_counts[word] for word in kept_words}
+        self.errors = {word: merged_errors[word] for word in kept_words}
+        self._rebuild_heap()
+
+    def _rebuild_heap(self) -> None:
+        self._heap = [(count, word) for word, count in self.counts.items()]
+        heapify(self._heap)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_heap']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._rebuild_heap()
+
+
+class ApproximateVocab(object):
+    def __init__(self, max_words: int = VOCAB_APPROX_MAX_WORDS, epsilon: float = VOCAB_APPROX_EPSILON,
+                 delta: float = VOCAB_APPROX_DELTA):
+        self.heavy_hitters = SpaceSaving(max_words)
+        self.sketch = CountMinSketch.from_error_bounds(epsilon, delta)
+        self.distinct_words = HyperLogLog()
+        self.n_files = 0
+        self.n_words = 0
+        self.stats = VocabStats()
+
+    def add_word_counts(self, word_counts: Counter, n_files: int) -> None:
+        for word, count in word_counts.items():
+            word_hash = hash_word(word)
+            self.sketch.add(word_hash, count)
+            self.distinct_words.add(word_hash)
+            self.heavy_hitters.add(word, count)
+        self.n_files += n_files
+        self.n_words += sum(word_counts.values())
+        self._add_stats_entry()
+
+    def add_vocab(self, other: 'ApproximateVocab') -> None:
+        self.sketch.merge(other.sketch)
+        self.distinct_words.merge(other.distinct_words)
+        self.heavy_hitters.merge(other.heavy_hitters)
+        self.n_files += other.n_files
+        self.n_words += other.n_words
+        self.stats.merge(other.stats)
+        self._add_stats_entry()
+
+    def _add_stats_entry(self) -> None:
+        self.stats.add(self.n_files, self.distinct_words.estimate(), self.estimate(placeholders['non_eng']))
+
+    def estimate(self, word: str) -> int:
+        """Both the sketch and the heavy hitters overestimate, so the smaller of the two is taken."""
+        sketch_estimate = self.sketch.estimate(hash_word(word))
+        return min(sketch_estimate, self.heavy_hitters.counts.get(word, sketch_estimate))
+
+    def word_estimates(self) -> List[Tuple[str, int]]:
+        """The kept words with their estimated counts, the most frequent first."""
+        estimates = [(word, self.estimate(word)) for word in self.heavy_hitters.counts]
+        estimates.sort(key=lambda x: x[1], reverse=True)
+        return estimates
+
+    def write_stats(self, path_to_stats_file: str) -> None:
+        write_vocab_stats(self.stats, self.n_files, self.distinct_words.estimate(),
+                          self.estimate(placeholders['non_eng']), path_to_stats_file)
+
+    def write_vocab(self, path_to_vocab_file: str) -> None:
+        _dump_vocab_dict(self.word_estimates(), path_to_vocab_file, to_literal=False)
+
+
+def count_files_approximately(param: Tuple[List[List[str]], int, float, float]) -> ApproximateVocab:
+    file_groups, max_words, epsilon, delta = param
+    vocab = ApproximateVocab(max_words, epsilon, delta)
+    for file_group in file_groups:
+        vocab.add_word_counts(get_vocab(file_group), len(file_group))
+    return vocab
+
+
+def calc_approximate_vocab(path: str, file_iterator: Iterator[bytes], output_dir: str,
+                           max_words: int = VOCAB_APPROX_MAX_WORDS, epsilon: float = VOCAB_APPROX_EPSILON,
+                           delta: float = VOCAB_APPROX_DELTA) -> None:
+    """
+    Writes `max_words` most frequent words (or fewer) with their estimated counts in the format of `calc_vocab`.
+    The total vocabulary size and the vocabulary growth in the stats file are estimated too.
+
+    Each process keeps a Count-Min sketch of size ceil(e / `epsilon`) * ceil(ln(1 / `delta`)),
+    up to `max_words` heavy hitters and the words of the file group being counted.
+    """
+    n_processes = multiprocessing.cpu_count()
+    vocab_file_path = os.path.join(output_dir, VOCAB_FILENAME)
+    vocab_size_file_path = os.path.join(output_dir, VOCABSIZE_FILENAME)
+    if os.path.exists(vocab_size_file_path) and os.path.exists(vocab_file_path):
+        logger.info(f"Vocab files already exist at: {os.path.dirname(vocab_size_file_path)}/ . Doing nothing.")
+        return
+
+    logger.info(f"Calculating approximate vocabulary")
+    logger.debug(f"Reading files from: {path}")
+    all_files = [file for file in file_iterator]
+    if not all_files:
+        logger.warning("No preprocessed files found.")
+        exit(4)
+    os.makedirs(output_dir, exist_ok=True)
+
+    file_groups = groupify(all_files, MAX_INIT_PARTIAL_VOCABS)
+    n_processes = min(n_processes, len(file_groups))
+    group_size = math.ceil(len(file_groups) / n_processes)
+    params = [(file_groups[i:i + group_size], max_words, epsilon, delta)
+              for i in range(0, len(file_groups), group_size)]
+    vocab = None
+    with Pool(n_processes) as pool:
+        for partial_vocab in tqdm(pool.imap_unordered(count_files_approximately, params), total=len(params)):
+            if vocab is None:
+                vocab = partial_vocab
+            else:
+                vocab.add_vocab(partial_vocab)
+
+    vocab.write_stats(vocab_size_file_path)
+    vocab.write_vocab(vocab_file_path)
+    logger.info(f"Approximate vocab of {vocab.n_words} words is available at {vocab_file_path}, "
+                f"counts are overestimated by at most {epsilon * vocab.n_words:.0f} "
+                f"with probability {1 - delta}")
+    logger.info(f"Vocab stats is available at {vocab_size_file_path}")
@@ -4,16 +4,19 @@
 
 import logging
 import os
-from typing import Tuple, Dict, Set, Optional
+import pickle
+from typing import Tuple, Dict, Set, Optional, List, Union
 
 from codeprep.bpepkg.bpe_config import BpeConfig, BpeParam, BpeConfigNotSupported
 from codeprep.bpepkg.bpe_encode import escape
-from codeprep.bpepkg.bpe_learn import separate_vocabs, logger, do_merges, create_resulting_vocab, create_bpe_cache
+from codeprep.bpepkg.bpe_learn import separate_vocabs, logger, continue_merges, create_resulting_vocab, \
+    create_bpe_cache, SplitVocab, Checkpoint
 from codeprep.bpepkg.cache import dump_bpe_cache
 from codeprep.bpepkg.merge import MergeList, read_merges, dump_merges
+from codeprep.config import BPE_CHECKPOINT_EVERY_SECONDS
 from codeprep.pipeline import stages
 from codeprep.pipeline.bperegistry import get_max_merges, MERGES_FILE_NAME, MERGES_CACHE_FILE_NAME, \
-    RESULTING_VOCAB_FILE_NAME, BPE_REASSEMBLED_VOCAB_FILE_NAME
+    RESULTING_VOCAB_FILE_NAME, BPE_REASSEMBLED_VOCAB_FILE_NAME, CHECKPOINT_FILE_NAME
 from codeprep.pipeline.dataset import Dataset
 from codeprep.pipeline.vocab import _dump_vocab_dict, _load_vocab_dict
 from codeprep.util import to_non_literal_str
@@ -45,16 +48,20 @@ def check_if_bpe_config_supported(bpe_config: BpeConfig):
         raise BpeConfigNotSupported('BPE with case encoded in prefix is not yet supported')
 
 
-def prepare_vocabs(dataset: Dataset, dir_with_most_merges, starting_from_scratch):
+def prepare_vocabs(dataset: Dataset, dir_with_most_merges,
+                   starting_from_scratch) -> Tuple[SplitVocab, Dict[str, int]]:
     if starting_from_scratch:
         base_bpe_vocab, other_vocab = get_base_vocab(dataset)  # TODO extract this into stages
         other_vocab = {escape(k, merged=True): v for k, v in other_vocab.items()}
-        split_base_vocab = {escape(" ".join(k)): v for k, v in base_bpe_vocab.items()}
+        split_base_vocab = SplitVocab()
+        for k, v in base_bpe_vocab.items():
+            split_base_vocab.add(escape(" ".join(k)).split(' '), v)
     else:
         path_to_bpe_vocab_file = os.path.join(dir_with_most_merges, BPE_REASSEMBLED_VOCAB_FILE_NAME)
         non_bpe_vocab = {escape(k, merged=True) for k in load_nonbpe_vocab(dataset)}
         split_base_vocab = _load_vocab_dict(path_to_bpe_vocab_file)
         split_base_vocab, other_vocab = separate_vocabs(split_base_vocab, non_bpe_vocab)
+        split_base_vocab = SplitVocab.from_dict(split_base_vocab)
 
     return split_base_vocab, other_vocab
 
@@ -68,10 +75,15 @@ def get_dir_with_most_merges(dataset_bpe_path, n_merges) -> Optional[str]:
     return dir_with_most_merges
 
 
-def save_results(split_base_vocab, merges, new_bpe_dir):
+def save_results(split_base_vocab: SplitVocab, other_vocab: Dict[str, int], merges: MergeList, new_bpe_dir: str):
 
     os.makedirs(new_bpe_dir)
 
+    # words are converted back from symbol ids only here
+    split_base_vocab = split_base_vocab.to_dict()
+    for k, v in other_vocab.items():
+        split_base_vocab[k] = v
+
     resulting_vocab = create_resulting_vocab(split_base_vocab)
     resulting_vocab_sorted = sorted(resulting_vocab.items(), key=lambda x: x[1], reverse=True)
     _dump_vocab_dict(resulting_vocab_sorted, os.path.join(new_bpe_dir, RESULTING_VOCAB_FILE_NAME))
@@ -84,11 +96,48 @@ def save_results(split_base_vocab, merges, new_bpe_dir):
     logger.info(f'Bpe output files are saved into {new_bpe_dir} folder')
 
 
-def run(dataset: Dataset, n_merges: int, bpe_config: BpeConfig) -> None:
+def save_checkpoint(checkpoint_file: str, already_done_merges: MergeList, other_vocab: Dict[str, int],
+                    checkpoint: Checkpoint) -> None:
+    """
+    The total number of merges is pickled first, so that it can be read without loading the whole checkpoint.
+    The checkpoint file is replaced atomically, so that an interrupted run never leaves a partially written file.
+    """
+    os.makedirs(os.path.dirname(checkpoint_file), exist_ok=True)
+    not_finished_file = f'{checkpoint_file}.part'
+    with open(not_finished_file, 'wb') as f:
+        pickle.dump(len(already_done_merges) + len(checkpoint.merges), f, pickle.HIGHEST_PROTOCOL)
+        pickle.dump((already_done_merges, other_vocab, checkpoint), f, pickle.HIGHEST_PROTOCOL)
+    os.replace(not_finished_file, checkpoint_file)
+    logger.info(f'Saved checkpoint with {len(already_done_merges) + len(checkpoint.merges)} merges '
+                f'to {checkpoint_file}')
+
+
+def read_checkpoint_n_merges(checkpoint_file: str) -> Optional[int]:
+    if not os.path.exists(checkpoint_file):
+        return None
+    with open(checkpoint_file, 'rb') as f:
+        return pickle.load(f)
+
+
+def load_checkpoint(checkpoint_file: str) -> Tuple[MergeList, Dict[str, int], Checkpoint]:
+    with open(checkpoint_file, 'rb') as f:
+        pickle.load(f)
+        return pickle.load(f)
+
+
+def run(dataset: Dataset, n_merges: Union[int, List[int]], bpe_config: BpeConfig, n_workers: int = 1,
+        checkpoint_every_seconds: int = BPE_CHECKPOINT_EVERY_SECONDS) -> None:
+    """
+    If a list is passed as `n_merges`, merges are learned in a single pass
+    and the results are saved each time the number of merges reaches one of the values in the list.
+    A checkpoint to resume from is saved every `checkpoint_every_seconds` seconds, none if it is 0.
+    """
 
     check_if_bpe_config_supported(bpe_config)
     dataset_bpe_path = dataset.bpe_path
 
+    n_merges_list = sorted(set(n_merges)) if isinstance(n_merges, list) else [n_merges]
+    n_merges = n_merges_list[-1]
     dir_with_most_merges = get_dir_with_most_merges(dataset_bpe_path, n_merges)
 
     if dir_with_most_merges:
@@ -98,13 +147,37 @@ def run(dataset: Dataset, n_merges: int, bpe_config: BpeConfig) -> None:
         logger.info("Starting encoding from scratch.    ..")
         already_done_merges = MergeList()
 
-    split_base_vocab, other_vocab = prepare_vocabs(dataset, dir_with_most_merges,
-                                                   starting_from_scratch=not dir_with_most_merges)
+    checkpoint_file = os.path.join(dataset_bpe_path, CHECKPOINT_FILE_NAME)
+    checkpoint_n_merges = read_checkpoint_n_merges(checkpoint_file)
+    if checkpoint_n_merges is not None and len(already_done_merges) < checkpoint_n_merges <= n_merges:
+        logger.info(f"Resuming from the checkpoint with {checkpoint_n_merges} merges...")
+        already_done_merges, other_vocab, checkpoint = load_checkpoint(checkpoint_file)
+    else:
+        split_base_vocab, other_vocab = prepare_vocabs(dataset, dir_with_most_merges,
+                                                       starting_from_scratch=not dir_with_most_merges)
+        checkpoint = Checkpoint(split_base_vocab, MergeList())
+
+    n_done_merges = len(already_done_merges) + len(checkpoint.merges)
+    for snapshot in n_merges_list[:-1]:
+        if snapshot < n_done_merges and not os.path.exists(os.path.join(dataset_bpe_path, str(snapshot))):
+            logger.warning(f"Cannot save results for {snapshot} merges: "
+                           f"learning is continued from {n_done_merges} merges.")
+
+    def save_snapshot(c: Checkpoint) -> None:
+        snapshot_merges = already_done_merges + c.merges
+        snapshot_dir = os.path.join(dataset_bpe_path, str(len(snapshot_merges)))
+        if not os.path.exists(snapshot_dir):
+            save_results(c.split_vocab, other_vocab, snapshot_merges, snapshot_dir)
 
     logger.info("Learning bpe codes...")
-    split_base_vocab, merges = do_merges(split_base_vocab, n_merges - len(already_done_merges))
-    for k, v in other_vocab.items():
-        split_base_vocab[k] = v
+    split_base_vocab, merges = continue_merges(
+        checkpoint, n_merges - len(already_done_merges), n_workers,
+        save_checkpoint=(lambda c: save_checkpoint(checkpoint_file, already_done_merges, other_vocab, c))
+        if checkpoint_every_seconds > 0 else None,
+        checkpoint_every_seconds=checkpoint_every_seconds,
+        snapshots=[n - len(already_done_merges) for n in n_merges_list[:-1]],
+        save_snapshot=save_snapshot
+    )
     merges = already_done_merges + merges
 
     new_bpe_dir = os.path.join(dataset_bpe_path, str(len(merges)))
@@ -112,4 +185,8 @@ def run(dataset: Dataset, n_merges: int, bpe_config: BpeConfig) -> None:
         logging.info("Merges already learned!")
         return
 
-    save_results(split_base_vocab, merges, new_bpe_dir)
\ No newline at end of file
+    save_results(split_base_vocab, other_vocab, merges, new_bpe_dir)
+
+    checkpoint_n_merges = read_checkpoint_n_merges(checkpoint_file)
+    if checkpoint_n_merges is not None and checkpoint_n_merges <= len(merges):
+        os.remove(checkpoint_file)
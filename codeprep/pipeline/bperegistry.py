@@ -11,7 +11,7 @@ import sys
 import time
 
 from codeprep.bpepkg.bpe_config import BpeConfig
-from codeprep.bpepkg.bpe_encode import read_merges
+from codeprep.bpepkg.compiled import load_merges
 from codeprep.bpepkg.merge import MergeList
 from codeprep.config import USER_BPE_DIR, USER_VOCAB_DIR
 
@@ -23,6 +23,7 @@ RESULTING_VOCAB_FILE_NAME = "vocab_res.txt"
 
 MERGES_FILE_NAME = "merges.txt"
 MERGES_CACHE_FILE_NAME = "merges_cache.txt"
+CHECKPOINT_FILE_NAME = "checkpoint.pickle"
 BPE_CODES_ID_FILENAME = '.name'
 
 USER_PREDEFINED_BPE_CODES = ['1k', '5k', '10k']
@@ -186,7 +187,7 @@ def get_bpe_dir(merge_list_id: str, n_merges: int) -> str:
 
 def load_bpe_merges(merge_list_id: str, n_merges: int) -> MergeList:
     custom_bpe_config = CustomBpeConfig.create(merge_list_id, n_merges)
-    return read_merges(custom_bpe_config.codes_file, n_merges)
+    return load_merges(custom_bpe_config.codes_file, n_merges)
 
 
 def format_available_merge_list_ids() -> str:
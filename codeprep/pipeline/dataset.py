@@ -52,13 +52,19 @@ class SubDataset(object):
         return is_path_outdated(self.path)
 
     def file_iterator(self) -> Generator[bytes, None, None]:
+        for file in self._dataset.get_all_files():
+            yield self.get_file_path(file)
+
+    def get_file_path(self, file: bytes) -> bytes:
+        """
+        :param file: path of the file relative to the dataset as returned by `Dataset.get_all_files()`
+        """
         encoded_path = self.path.encode()
         encoded_suffix = self._suffix.encode()
-        for file in self._dataset.get_all_files():
-            if os.path.isfile(encoded_path):
-                yield encoded_path + encoded_suffix
-            else:
-                yield os.path.join(encoded_path, file + encoded_suffix)
+        if os.path.isfile(encoded_path):
+            return encoded_path + encoded_suffix
+        else:
+            return os.path.join(encoded_path, file + encoded_suffix)
 
     def get_new_file_name(self, file_path: bytes, new_subdataset: 'SubDataset') -> bytes:
         encoded_path = self.path.encode()
@@ -234,6 +240,24 @@ class Dataset(object):
     def path_to_vocab_file(self) -> str:
         return os.path.join(self.vocab_path, VOCAB_FILENAME)
 
+    @property
+    def vocab_shards_path(self) -> str:
+        """
+        Unlike other paths, does not depend on the last modification of the dataset.
+        """
+        name = self.name
+        if self._normalized_extension_list:
+            name += ('_' + "_".join(self._normalized_extension_list))
+        return os.path.join(USER_VOCAB_DIR, f'{name}_-_{self._get_prep_suffix()}_-_shards')
+
+    @property
+    def approx_vocab_path(self) -> str:
+        return f'{self.vocab_path}_-_approx'
+
+    @property
+    def path_to_approx_vocab_file(self) -> str:
+        return os.path.join(self.approx_vocab_path, VOCAB_FILENAME)
+
     @property
     def path_to_bpe_vocab_file(self) -> str:
         return os.path.join(self.base_bpe_vocab_path, VOCAB_FILENAME)
@@ -7,17 +7,51 @@ import logging
 import os
 import pickle
 from multiprocessing.pool import Pool
-from typing import Tuple
+from typing import Tuple, Dict, List
 
+from pygments.lexers import get_lexer_by_name
+from pygments.util import ClassNotFound
 from tqdm import tqdm
 
-from codeprep.config import REWRITE_PARSED_FILE, CHUNKSIZE, LIMIT_FILES_SCANNING
+from codeprep.config import REWRITE_PARSED_FILE, CHUNKSIZE, LIMIT_FILES_SCANNING, PARSED_FILE_CODEC
 from codeprep.fileutils import read_file_contents
 from codeprep.pipeline.dataset import Dataset, NOT_FINISHED_EXTENSION
-from codeprep.parse.core import convert_text
+from codeprep.parse.core import convert_text, init_lexer_cache, LexerCache
+from codeprep.tokens.rootclasses import ParsedToken
 
 logger = logging.getLogger(__name__)
 
+PARSED_FILE_COMPRESS_LEVELS = {'none': 0, 'fast': 1, 'default': 9}
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def dump_parsed_file(parsed: List[ParsedToken], path: bytes, codec: str = PARSED_FILE_CODEC) -> None:
+    """
+    Pickles parsed tokens to `path`. Unless `codec` is 'none', the pickle is gzipped
+    with the compression level of the codec: 1 for 'fast' and 9 for 'default'.
+    """
+    if codec not in PARSED_FILE_COMPRESS_LEVELS:
+        raise ValueError(f'Unknown parsed file codec: {codec}, '
+                         f'possible values are: {list(PARSED_FILE_COMPRESS_LEVELS.keys())}')
+    compresslevel = PARSED_FILE_COMPRESS_LEVELS[codec]
+    with open(path, 'wb') as f:
+        if compresslevel:
+            with gzip.GzipFile(fileobj=f, mode='wb', compresslevel=compresslevel) as g:
+                pickle.dump(parsed, g, pickle.HIGHEST_PROTOCOL)
+        else:
+            pickle.dump(parsed, f, pickle.HIGHEST_PROTOCOL)
+
+
+def load_parsed_file(path: bytes) -> List[ParsedToken]:
+    """
+    Loads a file saved by `dump_parsed_file` with any codec: gzipped files are recognized by their magic number.
+    """
+    with open(path, 'rb') as f:
+        if f.peek(len(GZIP_MAGIC))[:len(GZIP_MAGIC)] == GZIP_MAGIC:
+            with gzip.GzipFile(fileobj=f, mode='rb') as g:
+                return pickle.load(g)
+        return pickle.load(f)
+
 
 def preprocess_and_write(params: Tuple[bytes, bytes]) -> None:
     src_file_path, dest_file_path = params
@@ -31,20 +65,58 @@ def preprocess_and_write(params: Tuple[bytes, bytes]) -> None:
         return
 
     not_finished_dest_file_path = dest_file_path + NOT_FINISHED_EXTENSION.encode()
-    with gzip.GzipFile(not_finished_dest_file_path, 'wb') as f:
-        try:
-            lines_from_file, path = read_file_contents(src_file_path)
-        except FileNotFoundError:
-            logger.error(f"File was found when scanning the directory, but cannot be read: {src_file_path}. "
-                         f"Invalid symlink? Ignoring ...")
-            return
-        extension_bin = os.path.splitext(src_file_path)[1].decode()[1:]
-        parsed = [p for p in convert_text("\n".join(lines_from_file), extension_bin)]
-        pickle.dump(parsed, f, pickle.HIGHEST_PROTOCOL)
+    try:
+        lines_from_file, path = read_file_contents(src_file_path)
+    except FileNotFoundError:
+        logger.error(f"File was found when scanning the directory, but cannot be read: {src_file_path}. "
+                     f"Invalid symlink? Ignoring ...")
+        return
+    extension_bin = get_extension(src_file_path)
+    parsed = [p for p in convert_text("\n".join(lines_from_file), extension_bin)]
+    dump_parsed_file(parsed, not_finished_dest_file_path)
 
     os.rename(not_finished_dest_file_path, dest_file_path)
 
 
+def get_extension(file_path: bytes) -> str:
+    """
+    >>> get_extension(b'src/Main.java'), get_extension(b'Makefile')
+    ('java', '')
+    """
+    return os.path.splitext(file_path)[1].decode()[1:]
+
+
+def build_lexer_resolution_table(dataset: Dataset) -> Dict[str, str]:
+    """
+    Resolves each extension of the dataset that is unknown to Pygments by guessing the lexer from the first file
+    with this extension, so that the lexer does not have to be guessed for every such file in each of the workers.
+    """
+    lexer_cache = LexerCache()
+    known_extensions = set()
+    n_files_with_unknown_extensions = 0
+    for file in dataset.get_all_files():
+        extension = get_extension(file) or 'java'
+        if extension in known_extensions:
+            continue
+        if extension not in lexer_cache.resolution_table:
+            try:
+                get_lexer_by_name(extension)
+                known_extensions.add(extension)
+                continue
+            except ClassNotFound:
+                try:
+                    lines_from_file, _ = read_file_contents(dataset.original.get_file_path(file))
+                except FileNotFoundError:
+                    continue
+                lexer_cache.get_lexer(extension, "\n".join(lines_from_file))
+        n_files_with_unknown_extensions += 1
+    n_guesses = len(lexer_cache.resolution_table)
+    if n_guesses:
+        logger.info(f"Lexers guessed for {n_guesses} unknown extensions: {lexer_cache.resolution_table}. "
+                    f"Guesses avoided: {n_files_with_unknown_extensions - n_guesses}")
+    return lexer_cache.resolution_table
+
+
 def params_generator(dataset: Dataset):
     for input_file_path in dataset.original.file_iterator():
         output_file_path = dataset.original.get_new_file_name(input_file_path, dataset.parsed)
@@ -66,7 +138,8 @@ def run(dataset: Dataset) -> None:
                 break
     else:
         files_total = len([f for f in dataset.get_all_files()])
-    with Pool() as pool:
+    lexer_resolution_table = build_lexer_resolution_table(dataset)
+    with Pool(initializer=init_lexer_cache, initargs=(lexer_resolution_table,)) as pool:
         it = pool.imap_unordered(preprocess_and_write, params_generator(dataset), chunksize=CHUNKSIZE)
         for _ in tqdm(it, total=files_total):
             pass
@@ -8,10 +8,13 @@ import logging
 import os
 from typing import Optional
 
+from codeprep.config import VOCAB_INCREMENTAL
 from codeprep.pipeline import parse_projects, to_repr
 from codeprep.pipeline.bperegistry import CustomBpeConfig
 from codeprep.pipeline.dataset import Dataset, is_path_ready, is_path_outdated, archive_path
+from codeprep.pipeline.approxvocab import calc_approximate_vocab
 from codeprep.pipeline.vocab import calc_vocab
+from codeprep.pipeline.vocabshards import calc_vocab_incrementally
 
 logger = logging.getLogger(__name__)
 
@@ -27,14 +30,15 @@ def run_parsing(dataset: Dataset) -> None:
         logger.info("Parsed dataset is up-to-date.")
 
 
-def run_until_preprocessing(dataset: Dataset, custom_bpe_config: Optional[CustomBpeConfig]=None) -> None:
+def run_until_preprocessing(dataset: Dataset, custom_bpe_config: Optional[CustomBpeConfig]=None,
+                            vocab_output_dir: Optional[str]=None) -> None:
     run_parsing(dataset)
     logger.info("Preprocessing...")
     if not dataset.preprocessed.ready():
-        to_repr.run(dataset, custom_bpe_config)
+        to_repr.run(dataset, custom_bpe_config, vocab_output_dir=vocab_output_dir)
     elif dataset.preprocessed.is_outdated():
         dataset.preprocessed.archive()
-        to_repr.run(dataset, custom_bpe_config)
+        to_repr.run(dataset, custom_bpe_config, vocab_output_dir=vocab_output_dir)
     else:
         logger.info(f"Dataset is already preprocessed and up-to-date.")
 
@@ -51,20 +55,33 @@ def run_until_base_bpe_vocab(dataset: Dataset, custom_bpe_config: Optional[Custo
         logger.info("Vocabulary is already computed and up-to-date")
 
 
-def run_until_vocab(dataset: Dataset, custom_bpe_config: Optional[CustomBpeConfig]=None) -> None:
-    logger.info(f'Checking first if vocabulary file exists: {dataset.path_to_vocab_file}')
-    if os.path.exists(dataset.path_to_vocab_file):
+def run_until_vocab(dataset: Dataset, custom_bpe_config: Optional[CustomBpeConfig]=None,
+                    approximate: bool=False) -> None:
+    if approximate:
+        vocab_path, path_to_vocab_file, calc = \
+            dataset.approx_vocab_path, dataset.path_to_approx_vocab_file, calc_approximate_vocab
+    elif VOCAB_INCREMENTAL:
+        def calc(path: str, file_iterator, output_dir: str) -> None:
+            calc_vocab_incrementally(dataset, output_dir)
+
+        vocab_path, path_to_vocab_file = dataset.vocab_path, dataset.path_to_vocab_file
+    else:
+        vocab_path, path_to_vocab_file, calc = dataset.vocab_path, dataset.path_to_vocab_file, calc_vocab
+    logger.info(f'Checking first if vocabulary file exists: {path_to_vocab_file}')
+    if os.path.exists(path_to_vocab_file):
         logger.info("Vocabulary is already computed and up-to-date")
         return
 
-    if not is_path_ready(dataset.path_to_vocab_file):
-        run_until_preprocessing(dataset, custom_bpe_config)
+    # words are counted while the files are preprocessed, if they need to be
+    vocab_output_dir = None if approximate or VOCAB_INCREMENTAL else vocab_path
+    if not is_path_ready(path_to_vocab_file):
+        run_until_preprocessing(dataset, custom_bpe_config, vocab_output_dir)
         logger.info("Computing vocab...")
-        calc_vocab(dataset.preprocessed.path, dataset.preprocessed.file_iterator(), dataset.vocab_path)
-    elif is_path_outdated(dataset.path_to_vocab_file):
-        run_until_preprocessing(dataset, custom_bpe_config)
+        calc(dataset.preprocessed.path, dataset.preprocessed.file_iterator(), vocab_path)
+    elif is_path_outdated(path_to_vocab_file):
+        run_until_preprocessing(dataset, custom_bpe_config, vocab_output_dir)
         logger.info("Computing vocab...")
         archive_path(dataset.path_to_bpe_vocab_file)
-        calc_vocab(dataset.preprocessed.path, dataset.preprocessed.file_iterator(), dataset.vocab_path)
+        calc(dataset.preprocessed.path, dataset.preprocessed.file_iterator(), vocab_path)
     else:
-        raise AssertionError()
\ No newline at end of file
+        raise AssertionError()
@@ -2,25 +2,30 @@
 #
 # SPDX-License-Identifier: Apache-2.0
 
-import gzip
 import logging
+import math
 import os
-import pickle
 import platform
 from multiprocessing.pool import Pool
-from typing import List, Tuple
+from typing import List, Tuple, Set, Dict
 from typing import Optional
 
 import time
+from collections import ChainMap, Counter
 from tqdm import tqdm
 
-from codeprep.bpepkg.bpe_encode import read_merges, BpeData
-from codeprep.bpepkg.cache import read_bpe_cache
+from codeprep.bpepkg.bpe_encode import BpeData, escape, encode_word
+from codeprep.bpepkg.cache import dump_bpe_cache, merge_bpe_cache_parts, merge_abandoned_bpe_cache_parts, \
+    get_bpe_cache_part_folder
+from codeprep.bpepkg.compiled import load_merges, load_bpe_cache, get_compiled_path
 from codeprep.config import DEFAULT_BPE_DIR, NO_CASE_DIR, CASE_DIR, DEFAULT_BPE_CACHE_DIR, REWRITE_PREPROCESSED_FILE, \
-    CHUNKSIZE, LIMIT_FILES_SCANNING
+    CHUNKSIZE, LIMIT_FILES_SCANNING, BPE_PERSISTENT_CACHE_MAX_SIZE, BPE_ENCODE_UNIQUE_WORDS_ONCE, \
+    VOCAB_N_PARTITIONS
+from codeprep.fileutils import FileLock
 from codeprep.pipeline import vocabloader
-from codeprep.pipeline.bperegistry import CustomBpeConfig
+from codeprep.pipeline.bperegistry import CustomBpeConfig, MERGES_FILE_NAME
 from codeprep.pipeline.dataset import Dataset, NOT_FINISHED_EXTENSION
+from codeprep.pipeline.parse_projects import load_parsed_file
 from codeprep.prepconfig import PrepParam, PrepConfig
 from codeprep.preprocess.core import to_repr_list
 from codeprep.preprocess.metadata import PreprocessingMetadata
@@ -28,7 +33,9 @@ from codeprep.preprocess.metadata import save_metadata
 from codeprep.preprocess.placeholders import placeholders
 from codeprep.tokens.rootclasses import ParsedToken
 from codeprep.tokens.word import SpecialToken
-from codeprep.util import to_literal_str
+from codeprep.pipeline.vocab import get_partial_vocabs_dir, init_partial_vocabs_dir, set_partial_vocabs_ready, \
+    dump_word_counts, get_vocab, MAX_INIT_PARTIAL_VOCABS
+from codeprep.util import to_literal_str, groupify, chunks
 
 logger = logging.getLogger(__name__)
 
@@ -57,8 +64,12 @@ def to_token_str(tokens: List) -> str:
     return " ".join(map(lambda t: str(t), tokens))
 
 
-def preprocess_and_write(params: Tuple[bytes, bytes, PrepConfig, str], bpe_data: Optional[BpeData] = None):
-    src_file_path, dest_file_path, prep_config, part_nonbpe_vocab_folder = params
+def preprocess_and_write(params: Tuple[bytes, bytes, PrepConfig, str, str],
+                         bpe_data: Optional[BpeData] = None) -> Optional[str]:
+    """
+    Returns the line written to `dest_file_path` or None if the file had already existed.
+    """
+    src_file_path, dest_file_path, prep_config, part_nonbpe_vocab_folder, part_bpe_cache_folder = params
 
     dest_dirname = os.path.dirname(dest_file_path)
     if not os.path.exists(dest_dirname):
@@ -66,19 +77,59 @@ def preprocess_and_write(params: Tuple[bytes, bytes, PrepConfig, str], bpe_data:
 
     if not REWRITE_PREPROCESSED_FILE and os.path.exists(dest_file_path):
         logger.warning(f"File {dest_file_path} already exists! Doing nothing.")
-        return
+        return None
 
     not_finished_dest_file_path = dest_file_path + NOT_FINISHED_EXTENSION.encode()
-    with gzip.GzipFile(src_file_path, 'rb') as i, open(not_finished_dest_file_path, 'w') as o:
-        token_list = pickle.load(i)
+    token_list = load_parsed_file(src_file_path)
+    with open(not_finished_dest_file_path, 'w') as o:
         bpe_data = get_global_bpe_data_if_available() if bpe_data is None else bpe_data
         repr, metadata = to_repr(prep_config, token_list + [SpecialToken(placeholders['ect'])], bpe_data)
-        o.write(to_literal_str(to_token_str(repr)) + '\n')
+        line = to_literal_str(to_token_str(repr))
+        o.write(line + '\n')
 
     if part_nonbpe_vocab_folder:
         save_metadata(metadata, os.path.join(part_nonbpe_vocab_folder, f'{os.path.basename(dest_file_path)}_-_{time.time()}'))
 
+    if part_bpe_cache_folder:
+        new_entries = bpe_data.cache.pop_new_entries()
+        if new_entries:
+            dump_bpe_cache(new_entries, os.path.join(part_bpe_cache_folder, str(os.getpid())), append=True)
+
     os.rename(not_finished_dest_file_path, dest_file_path)
+    return line
+
+
+def preprocess_write_and_count(params: Tuple[List[Tuple[bytes, bytes, PrepConfig, str, str]], str, int],
+                               bpe_data: Optional[BpeData] = None) -> int:
+    """
+    Preprocesses a group of files counting the words written the same way `calc_vocab` counts them
+    in the preprocessed files. The counts are saved as a partial vocab to `path_to_vocab_dump`.
+    Returns the number of files in the group.
+    """
+    file_params, path_to_vocab_dump, n_partitions = params
+    word_counts = Counter()
+    for p in file_params:
+        line = preprocess_and_write(p, bpe_data)
+        if line is not None:
+            word_counts.update(line.split(' '))
+        else:
+            # preprocessed by a previous run
+            word_counts.update(get_vocab([p[1]]))
+    dump_word_counts(word_counts, path_to_vocab_dump, n_partitions)
+    return len(file_params)
+
+
+def get_predefined_bpe_dir(prep_config: PrepConfig, base_dir: str) -> str:
+    bpe_n_merges_dict = {'4': '5k', '5': '1k', '6': '10k', '7': '20k', '8': '0'}
+    bpe_n_merges = bpe_n_merges_dict[prep_config.get_param_value(PrepParam.SPLIT)]
+    return os.path.join(base_dir,
+                        CASE_DIR if prep_config.get_param_value(PrepParam.CASE) == 'u' else NO_CASE_DIR,
+                        str(bpe_n_merges))
+
+
+def get_predefined_bpe_cache_file(prep_config: PrepConfig) -> str:
+    return os.path.join(get_predefined_bpe_dir(prep_config, DEFAULT_BPE_CACHE_DIR), 'merges_cache.txt')
+
 
 #TODO make this method independent of actual directory structure
 def init_bpe_data(prep_config: PrepConfig, custom_bpe_config: Optional[CustomBpeConfig], force_reinit: bool=True):
@@ -89,36 +140,88 @@ def init_bpe_data(prep_config: PrepConfig, custom_bpe_config: Optional[CustomBpe
     if custom_bpe_config:
         logger.info(f'Using bpe merges file: {custom_bpe_config.codes_file}')
         if custom_bpe_config.can_use_cache_file():
-            global_bpe_data.merges_cache = read_bpe_cache(custom_bpe_config.cache_file)
+            merges_cache = load_bpe_cache(custom_bpe_config.cache_file)
         else:
-            global_bpe_data.merges_cache = {}
-        global_bpe_data.merges = read_merges(custom_bpe_config.codes_file, custom_bpe_config.n_merges)
+            merges_cache = {}
+        global_bpe_data.merges = load_merges(custom_bpe_config.codes_file, custom_bpe_config.n_merges)
 
         if custom_bpe_config.n_merges:
             logger.info(f'Using first {custom_bpe_config.n_merges} merges.')
         nonbpe_vocab = vocabloader.nonbpe(custom_bpe_config.merge_list_id)
-        global_bpe_data.merges_cache.update({s: [s] for s in nonbpe_vocab})
+        # compiled cache is read-only, non-bpe tokens are looked up first
+        global_bpe_data.merges_cache = ChainMap({s: [s] for s in nonbpe_vocab}, merges_cache)
     else:
-        bpe_n_merges_dict = {'4': '5k', '5': '1k', '6': '10k', '7': '20k', '8': '0'}
-        bpe_n_merges = bpe_n_merges_dict[prep_config.get_param_value(PrepParam.SPLIT)]
-
-        bpe_merges_file = os.path.join(DEFAULT_BPE_DIR,
-                                       CASE_DIR if prep_config.get_param_value(PrepParam.CASE) == 'u' else NO_CASE_DIR,
-                                       str(bpe_n_merges), 'merges.txt')
-        bpe_merges_cache_file = os.path.join(DEFAULT_BPE_CACHE_DIR,
-                                             CASE_DIR if prep_config.get_param_value(PrepParam.CASE) == 'u' else NO_CASE_DIR,
-                                             str(bpe_n_merges), 'merges_cache.txt')
+        bpe_merges_file = os.path.join(get_predefined_bpe_dir(prep_config, DEFAULT_BPE_DIR), 'merges.txt')
+        bpe_merges_cache_file = get_predefined_bpe_cache_file(prep_config)
         if os.path.exists(bpe_merges_cache_file):
-            global_bpe_data.merges_cache = read_bpe_cache(bpe_merges_cache_file)
+            global_bpe_data.merges_cache = load_bpe_cache(bpe_merges_cache_file)
         else:
             global_bpe_data.merges_cache = {}
-        global_bpe_data.merges = read_merges(bpe_merges_file)
+        # predefined merges are shipped with the package, the compiled version is saved into the user's cache dir
+        compiled_merges_file = get_compiled_path(os.path.join(os.path.dirname(bpe_merges_cache_file), MERGES_FILE_NAME))
+        global_bpe_data.merges = load_merges(bpe_merges_file, compiled_file=compiled_merges_file)
 
 
-def params_generator(dataset: Dataset, path_to_part_metadata: Optional[str]):
+def params_generator(dataset: Dataset, path_to_part_metadata: Optional[str], path_to_part_bpe_cache: Optional[str]):
     for input_file_path in dataset.parsed.file_iterator():
         output_file_path = dataset.parsed.get_new_file_name(input_file_path, dataset.preprocessed)
-        yield (input_file_path, output_file_path, dataset.prep_config, path_to_part_metadata)
+        yield (input_file_path, output_file_path, dataset.prep_config, path_to_part_metadata, path_to_part_bpe_cache)
+
+
+def collect_bpe_words(params: Tuple[bytes, PrepConfig]) -> Set[str]:
+    """
+    Returns the words from a parsed file which are bpe-encoded when the file is preprocessed with `prep_config`.
+    """
+    src_file_path, prep_config = params
+    words = set()
+
+    def collect(word: str, bpe_data: BpeData) -> List[str]:
+        words.add(word)
+        return [word]
+
+    repr_config = prep_config.get_repr_config(BpeData())
+    repr_config.word_splitter = collect
+    repr_config.number_splitter = collect
+    token_list = load_parsed_file(src_file_path)
+    to_repr_list(token_list, repr_config)
+    return words
+
+
+def encode_bpe_words(words: List[str]) -> Dict[str, List[str]]:
+    merges = get_global_bpe_data_if_available().merges
+    escaped_words = (escape(word, merged=True) for word in words)
+    return {escaped_word: encode_word(escaped_word, merges) for escaped_word in escaped_words}
+
+
+def encode_unique_words(dataset: Dataset, n_cpus: int) -> Dict[str, List[str]]:
+    """
+    Bpe-encodes each distinct word of the dataset once.
+    Returns the mapping in the format of the bpe cache: escaped word -> subwords.
+    Words that are already in the cache of the global bpe data are not encoded again.
+    """
+    params = ((input_file_path, dataset.prep_config) for input_file_path in dataset.parsed.file_iterator())
+    words = set()
+    logger.info("Collecting unique words...")
+    if n_cpus > 1:
+        with Pool(processes=n_cpus) as pool:
+            for file_words in tqdm(pool.imap_unordered(collect_bpe_words, params, chunksize=CHUNKSIZE)):
+                words.update(file_words)
+    else:
+        for p in tqdm(params):
+            words.update(collect_bpe_words(p))
+
+    cache = get_global_bpe_data_if_available().cache
+    words_to_encode = [word for word in words if escape(word, merged=True) not in cache]
+    logger.info(f"Unique words: {len(words)}, not found in the cache: {len(words_to_encode)}. Encoding...")
+    encoded_words = {}
+    if n_cpus > 1:
+        word_groups = groupify(words_to_encode, n_cpus * CHUNKSIZE)
+        with Pool(processes=n_cpus) as pool:
+            for encoded_group in tqdm(pool.imap_unordered(encode_bpe_words, word_groups), total=len(word_groups)):
+                encoded_words.update(encoded_group)
+    else:
+        encoded_words = encode_bpe_words(words_to_encode)
+    return encoded_words
 
 
 def get_n_cpus_to_be_used():
@@ -128,7 +231,14 @@ def get_n_cpus_to_be_used():
     return n_cpus
 
 
-def run(dataset: Dataset, custom_bpe_config: Optional[CustomBpeConfig]) -> None:
+def run(dataset: Dataset, custom_bpe_config: Optional[CustomBpeConfig],
+        encode_unique_words_once: bool = BPE_ENCODE_UNIQUE_WORDS_ONCE, vocab_output_dir: Optional[str] = None,
+        n_vocab_partitions: int = VOCAB_N_PARTITIONS) -> None:
+    """
+    If `vocab_output_dir` is specified, the words of the preprocessed files are counted on the fly
+    and saved as partial vocabs, which `calc_vocab` with the same `n_vocab_partitions` then merges
+    without reading the preprocessed files again.
+    """
     path_to_parsed_dataset = dataset.parsed.path
 
     if not os.path.exists(path_to_parsed_dataset):
@@ -136,9 +246,35 @@ def run(dataset: Dataset, custom_bpe_config: Optional[CustomBpeConfig]) -> None:
         exit(3)
     logger.info(f"Reading parsed files from: {path_to_parsed_dataset}")
 
+    n_cpus = get_n_cpus_to_be_used()
+    if dataset.prep_config.is_bpe() and not custom_bpe_config:
+        # entries left by unfinished runs are loaded with the rest of the cache
+        merge_abandoned_bpe_cache_parts(get_predefined_bpe_cache_file(dataset.prep_config),
+                                        BPE_PERSISTENT_CACHE_MAX_SIZE)
     if dataset.prep_config.is_bpe():
         init_bpe_data(dataset.prep_config, custom_bpe_config)
 
+    if dataset.prep_config.is_bpe() and encode_unique_words_once:
+        encoded_words = encode_unique_words(dataset, n_cpus)
+        # workers created later share the encoded words, preprocessing files comes down to cache lookups
+        global_bpe_data.merges_cache = ChainMap(encoded_words, global_bpe_data.merges_cache)
+    else:
+        encoded_words = None
+
+    # words encoded with predefined merges are saved to be reused in the next runs
+    if dataset.prep_config.is_bpe() and not custom_bpe_config and len(global_bpe_data.merges) > 0:
+        path_to_part_bpe_cache = get_bpe_cache_part_folder(get_predefined_bpe_cache_file(dataset.prep_config))
+        # held until the folder is merged, so that other runs do not take the folder for an abandoned one
+        os.makedirs(os.path.dirname(path_to_part_bpe_cache), exist_ok=True)
+        part_bpe_cache_lock = FileLock(f'{path_to_part_bpe_cache}.lock')
+        part_bpe_cache_lock.acquire()
+        os.makedirs(path_to_part_bpe_cache, exist_ok=True)
+        if encoded_words:
+            dump_bpe_cache(encoded_words, os.path.join(path_to_part_bpe_cache, 'unique_words'))
+        global_bpe_data.cache.keep_new_entries = True
+    else:
+        path_to_part_bpe_cache = None
+
     if not os.path.exists(dataset.path_to_nonbpe_vocab_file) and dataset.prep_config.is_base_bpe_config():
         path_to_part_metadata = f'{dataset.path_to_nonbpe_vocab_file}_part'
     else:
@@ -159,17 +295,44 @@ def run(dataset: Dataset, custom_bpe_config: Optional[CustomBpeConfig]) -> None:
                 break
     else:
         files_total = len([f for f in dataset.get_all_files()])
-    n_cpus = get_n_cpus_to_be_used()
-    if n_cpus > 1:
+    if vocab_output_dir:
+        path_to_vocab_dump = get_partial_vocabs_dir(vocab_output_dir, n_vocab_partitions)
+        init_partial_vocabs_dir(path_to_vocab_dump, n_vocab_partitions)
+        # as many partial vocabs as `calc_vocab` would create when reading the files
+        group_size = math.ceil((files_total or LIMIT_FILES_SCANNING) / MAX_INIT_PARTIAL_VOCABS)
+        file_groups = chunks(params_generator(dataset, path_to_part_metadata, path_to_part_bpe_cache), group_size)
+        vocab_params = ((file_group, path_to_vocab_dump, n_vocab_partitions) for file_group in file_groups)
+        n_files_counted = 0
+        with tqdm(total=files_total) as progress_bar:
+            if n_cpus > 1:
+                with Pool(processes=n_cpus) as pool:
+                    for n_files in pool.imap_unordered(preprocess_write_and_count, vocab_params):
+                        progress_bar.update(n_files)
+                        n_files_counted += n_files
+            else:
+                for params in vocab_params:
+                    n_files = preprocess_write_and_count(params, get_global_bpe_data_if_available())
+                    progress_bar.update(n_files)
+                    n_files_counted += n_files
+        if n_files_counted:
+            set_partial_vocabs_ready(path_to_vocab_dump)
+    elif n_cpus > 1:
         with Pool(processes=n_cpus) as pool:
-            it = pool.imap_unordered(preprocess_and_write, params_generator(dataset, path_to_part_metadata), chunksize=CHUNKSIZE)
+            it = pool.imap_unordered(preprocess_and_write, params_generator(dataset, path_to_part_metadata, path_to_part_bpe_cache), chunksize=CHUNKSIZE)
             for _ in tqdm(it, total=files_total):
                 pass
     else:
-        for params in tqdm(params_generator(dataset, path_to_part_metadata), total=files_total):
+        for params in tqdm(params_generator(dataset, path_to_part_metadata, path_to_part_bpe_cache), total=files_total):
             preprocess_and_write(params, get_global_bpe_data_if_available())
 
     if path_to_part_metadata:
         vocabloader.gather_non_bpe_vocab(dataset)
 
+    if path_to_part_bpe_cache:
+        global_bpe_data.cache.keep_new_entries = False
+        merge_bpe_cache_parts(get_predefined_bpe_cache_file(dataset.prep_config), path_to_part_bpe_cache,
+                              BPE_PERSISTENT_CACHE_MAX_SIZE)
+        part_bpe_cache_lock.release()
+        part_bpe_cache_lock.remove()
+
     dataset.preprocessed.set_ready()
\ No newline at end of file
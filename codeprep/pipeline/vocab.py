@@ -2,58 +2,137 @@
 #
 # SPDX-License-Identifier: Apache-2.0
 
+import heapq
 import logging.config
 import multiprocessing
 import os
-import platform
+import pickle
 import random
 import shutil
+import struct
 import sys
+import zlib
+from array import array
 from collections import Counter, defaultdict
 from fnmatch import fnmatch
-from multiprocessing import Queue
 from multiprocessing.pool import Pool
-from queue import Empty
-from typing import List, Tuple, Dict, Iterator, Set
+from operator import itemgetter
+from typing import List, Tuple, Dict, Iterator, Set, Union, Iterable, Optional
 
-import dill as pickle
 import time
 from tqdm import tqdm
 
 from codeprep.fileutils import read_file_contents
 from codeprep.preprocess.placeholders import placeholders
-from codeprep.util import to_literal_str, to_non_literal_str, AtomicInteger, NonAtomicCounter, \
-    merge_dicts_, groupify, create_chunk_generator
+from codeprep.config import VOCAB_MERGE_MAX_WORDS_IN_MEMORY, VOCAB_N_PARTITIONS
+from codeprep.util import to_literal_str, to_non_literal_str, merge_dicts_, groupify
 
 logger = logging.getLogger(__name__)
 
-queue_size = AtomicInteger()
-
 PARTVOCAB_EXT = 'partvocab'
 PARTIAL_VOCABS_READY_FILENAME = 'ready'
+SPILLED_VOCABS_DIR = 'spilled'
 
 VOCABSIZE_FILENAME = 'vocabsize'
 VOCAB_FILENAME = 'vocab'
 
-N_CHUNKS = 20
-BLOCKING_TIMEOUT_SECONDS_SHORT = 5
-BLOCKING_TIMEOUT_SECONDS_LONG = 300
 MAX_INIT_PARTIAL_VOCABS = 256 * 20
 
 
+class VocabStats(object):
+    """
+    Fixed-size summary of how the vocab grows with the number of files. Each vocab merged on the way
+    to the final one is put into a bin by the number of files it covers. A bin keeps the number of vocabs
+    and the sums of their numbers of files, of their sizes and of the counts of the `non_eng` placeholder.
+    Up to 7 files, there is a bin per number of files, above that each power of two is split into 4 bins.
+
+    >>> stats = VocabStats.from_entries([(1, 10, 0), (1, 20, 2), (8, 100, 5), (9, 110, 3)])
+    >>> stats.rows(20)
+    [(0.05, 15.0, 1.0), (0.425, 105.0, 4.0)]
+    >>> stats.n_vocabs
+    4
+    """
+    N_BINS = 256
+    N_FIELDS = 4
+
+    def __init__(self):
+        self.bins = array('q', bytes(8 * self.N_FIELDS * self.N_BINS))
+
+    @classmethod
+    def from_entries(cls, entries: Iterable[Tuple[int, int, int]]) -> 'VocabStats':
+        stats = cls()
+        for n_files, vocab_size, non_eng_count in entries:
+            stats.add(n_files, vocab_size, non_eng_count)
+        return stats
+
+    @staticmethod
+    def bin(n_files: int) -> int:
+        shift = max(n_files.bit_length() - 3, 0)
+        return shift * 4 + (n_files >> shift)
+
+    def add(self, n_files: int, vocab_size: int, non_eng_count: int) -> None:
+        i = self.bin(n_files) * self.N_FIELDS
+        bins = self.bins
+        bins[i] += 1
+        bins[i + 1] += n_files
+        bins[i + 2] += vocab_size
+        bins[i + 3] += non_eng_count
+
+    def remove(self, n_files: int, vocab_size: int, non_eng_count: int) -> None:
+        i = self.bin(n_files) * self.N_FIELDS
+        bins = self.bins
+        bins[i] -= 1
+        bins[i + 1] -= n_files
+        bins[i + 2] -= vocab_size
+        bins[i + 3] -= non_eng_count
+
+    def merge(self, other: 'VocabStats') -> None:
+        self.bins = array('q', map(int.__add__, self.bins, other.bins))
+
+    def add_partition(self, other: 'VocabStats') -> None:
+        """
+        Adds up the sizes of vocabs of different partitions of the same files, merged in the same way.
+        """
+        bins = self.bins
+        for i in range(0, len(bins), self.N_FIELDS):
+            bins[i + 2] += other.bins[i + 2]
+            bins[i + 3] += other.bins[i + 3]
+
+    @property
+    def n_vocabs(self) -> int:
+        return sum(self.bins[::self.N_FIELDS])
+
+    def nonempty_bins(self) -> List[Tuple[int, int, int, int, int]]:
+        bins = self.bins
+        return [(i // self.N_FIELDS,) + tuple(bins[i:i + self.N_FIELDS])
+                for i in range(0, len(bins), self.N_FIELDS) if bins[i]]
+
+    def set_bin(self, bin: int, n_vocabs: int, n_files: int, vocab_size: int, non_eng_count: int) -> None:
+        i = bin * self.N_FIELDS
+        self.bins[i:i + self.N_FIELDS] = array('q', (n_vocabs, n_files, vocab_size, non_eng_count))
+
+    def rows(self, n_files_total: int) -> List[Tuple[float, float, float]]:
+        """
+        The fraction of the files, the vocab size and the count of `non_eng` on average for each non-empty bin.
+        """
+        return [(n_files / n_vocabs / n_files_total, vocab_size / n_vocabs, non_eng_count / n_vocabs)
+                for _, n_vocabs, n_files, vocab_size, non_eng_count in self.nonempty_bins()]
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, VocabStats) and self.bins == other.bins
+
+
 class PartialVocab(object):
     CLASS_VERSION = '2.0.0'
 
-    def __init__(self, word_counts: Counter, chunk: int):
+    def __init__(self, word_counts: Counter):
         if not isinstance(word_counts, Counter):
             raise TypeError(f'Vocab must be a Counter, but is {type(word_counts)}')
 
         self.merged_word_counts = word_counts
-        self.stats = [(1,
-                       len(self.merged_word_counts),
-                       self.merged_word_counts[placeholders['non_eng']])]
+        self.stats = VocabStats()
+        self.stats.add(1, len(self.merged_word_counts), self.merged_word_counts[placeholders['non_eng']])
         self.n_files = 1
-        self.chunk = chunk
         self.id = self._generate_id()
 
     def _generate_id(self) -> str:
@@ -70,137 +149,363 @@ class PartialVocab(object):
         cur_vocab_size = len(self.merged_word_counts)
 
         self.n_files += partial_vocab.n_files
-        new_stats_entry = (self.n_files,
-                           cur_vocab_size,
-                           self.merged_word_counts[placeholders['non_eng']])
-        self.stats.extend(partial_vocab.stats + [new_stats_entry])
+        self.stats.merge(partial_vocab.stats)
+        self.stats.add(self.n_files, cur_vocab_size, self.merged_word_counts[placeholders['non_eng']])
         return new_words
 
     def write_stats(self, path_to_stats_file: str) -> None:
-        stats = self.__generate_stats()
-        with open(path_to_stats_file, 'w') as f:
-            vocabsize = int(stats[-1][1][0])
-            f.write(f'{vocabsize}\n')
-            for percent, (v, n) in stats:
-                f.write(f"{percent:.4f} {int(v)} {int(n)}\n")
+        write_vocab_stats(self.stats, self.n_files, len(self.merged_word_counts),
+                          self.merged_word_counts[placeholders['non_eng']], path_to_stats_file)
 
     def limit_max_vocab(self, vocab_size_threshold: int) -> None:
-        sorted_vocab = sorted(self.merged_word_counts.items(), key=lambda x: x[1], reverse=True)
-        if vocab_size_threshold > len(sorted_vocab):
+        """
+        Keeps at most `vocab_size_threshold` most frequent words. Words with the frequency of the most frequent
+        excluded word are excluded too, so that the threshold does not cut a group of equally frequent words.
+
+        >>> vocab = PartialVocab(Counter({'a': 5, 'b': 3, 'c': 3, 'd': 1}))
+        >>> vocab.limit_max_vocab(2)
+        >>> vocab.merged_word_counts
+        {'a': 5}
+        >>> vocab = PartialVocab(Counter({'a': 5, 'b': 3, 'c': 3, 'd': 1}))
+        >>> vocab.limit_max_vocab(3)
+        >>> vocab.merged_word_counts
+        {'a': 5, 'b': 3, 'c': 3}
+        """
+        if vocab_size_threshold >= len(self.merged_word_counts):
             return
-        min_freq_excluded = sorted_vocab[vocab_size_threshold][1]
-        adjusted_threshold = vocab_size_threshold - 1
-        while adjusted_threshold >= 0 and sorted_vocab[adjusted_threshold][1] == min_freq_excluded:
-            adjusted_threshold -= 1
-        self.merged_word_counts = {k: v for (k, v) in sorted_vocab[:adjusted_threshold + 1]}
+        n_words_with_freq = Counter(self.merged_word_counts.values())
+        n_more_frequent_words = 0
+        for freq in sorted(n_words_with_freq, reverse=True):
+            n_more_frequent_words += n_words_with_freq[freq]
+            if n_more_frequent_words > vocab_size_threshold:
+                min_freq_excluded = freq
+                break
+        kept_vocab = [(word, freq) for word, freq in self.merged_word_counts.items() if freq > min_freq_excluded]
+        kept_vocab.sort(key=itemgetter(1), reverse=True)
+        self.merged_word_counts = dict(kept_vocab)
 
     def write_vocab(self, path_to_vocab_file: str) -> None:
-        sorted_vocab = sorted(self.merged_word_counts.items(), key=lambda x: x[1], reverse=True)
-        _dump_vocab_dict(sorted_vocab, path_to_vocab_file, to_literal=False)
-
-    def __generate_stats(self):
-        d = defaultdict(list)
-        for entry in self.stats:
-            d[entry[0]].append(tuple(entry[1:]))
-        fin = {(float(k) / self.n_files): tuple([sum(elm) / len(elm) for elm in zip(*v)]) for k, v in d.items()}
-        return sorted(fin.items())
-
-
-class VocabMerger(multiprocessing.Process):
-    def __init__(self, id: int, tasks: Dict[int, Queue], path_to_dump: str, process_counter: AtomicInteger,
-                 chunk_queue: Queue, merges_left_counter: AtomicInteger,
-                 vocab_file_path: str, vocab_size_file_path: str):
-        multiprocessing.Process.__init__(self)
-        self.id = id
-        self.tasks = tasks
-        self.path_to_dump = path_to_dump
-        self.process_counter = process_counter
-        self.chunk_queue = chunk_queue
-        self.merges_left_counter = merges_left_counter
-        self.total_merges = merges_left_counter.value
-        self.vocab_file_path = vocab_file_path
-        self.vocav_size_file_path = vocab_size_file_path
-
-    def run(self) -> None:
-        while True:
-            chunk_assigned = self.chunk_queue.get(block=True, timeout=BLOCKING_TIMEOUT_SECONDS_SHORT)
-            if chunk_assigned == -1:
-                if not self.process_counter.compare_and_dec(1):
-                    logger.debug(
-                        f"[{self.id}] No vocabs available for merge. "
-                        f"Terminating process..., mergers left: {self.process_counter.value}")
-                    break
-                else:
-                    logger.debug("Leaving 1 process to finish the merges")
-                    self._finish_merges()
-                    logger.debug(f'[{self.id}] Vocab files are saved. Terminating the process...')
-                    break
-
-            first = None
+        _dump_vocab_dict(_sorted_by_frequency(self.merged_word_counts), path_to_vocab_file, to_literal=False)
+
+
+def _sorted_by_frequency(word_counts: Dict[str, int]) -> Iterator[Tuple[str, int]]:
+    """
+    Yields the words the most frequent first, equally frequent ones in the order of `word_counts`.
+    The words are grouped by frequency in a single pass, so only the distinct frequencies are sorted.
+
+    >>> list(_sorted_by_frequency({'e': 1, 'a': 5, 'c': 4, 'f': 1, 'b': 4, 'd': 2}))
+    [('a', 5), ('c', 4), ('b', 4), ('d', 2), ('e', 1), ('f', 1)]
+    """
+    words_with_freq = defaultdict(list)
+    for word, freq in word_counts.items():
+        words_with_freq[freq].append(word)
+    for freq in sorted(words_with_freq, reverse=True):
+        for word in words_with_freq.pop(freq):
+            yield word, freq
+
+
+def write_vocab_stats(stats: VocabStats, n_files: int, vocab_size: int, non_eng_count: int,
+                      path_to_stats_file: str) -> None:
+    """
+    The last entry of `stats` must be the final vocab. It is written as the last row with its exact size,
+    the rows before it are the averages of the bins without it.
+
+    >>> import tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), VOCABSIZE_FILENAME)
+    >>> stats = VocabStats.from_entries([(1, 10, 0), (1, 20, 2), (8, 90, 4), (9, 110, 3), (10, 121, 5)])
+    >>> write_vocab_stats(stats, 10, 121, 5, path)
+    >>> print(open(path).read(), end='')
+    121
+    0.1000 15 1
+    0.8500 100 3
+    1.0000 121 5
+    """
+    stats_without_final = VocabStats()
+    stats_without_final.merge(stats)
+    stats_without_final.remove(n_files, vocab_size, non_eng_count)
+    with open(path_to_stats_file, 'w') as f:
+        f.write(f'{vocab_size}\n')
+        for percent, v, n in stats_without_final.rows(n_files):
+            f.write(f"{percent:.4f} {int(v)} {int(n)}\n")
+        f.write(f"{1:.4f} {int(vocab_size)} {int(non_eng_count)}\n")
+
+
+# a partial vocab kept in memory or the path to the file it is saved to
+PartialVocabOrPath = Union[PartialVocab, str]
+
+
+# ======== Binary format of partial vocabs
+
+PARTVOCAB_MAGIC = b'CPPARTVC'
+PARTVOCAB_FORMAT_VERSION = 2
+# magic, format version, whether arrays are little-endian, number of words, number of non-empty stats bins,
+# number of files, sizes of the id and of the word blob
+PARTVOCAB_HEADER = struct.Struct('<8sBB6xQQQQQ')
+# crc32 of everything before the footer, magic
+PARTVOCAB_FOOTER = struct.Struct('<I4x8s')
+# version 1 saved stats as (number of files, vocab size, non-eng count) entries
+STATS_ENTRY_SIZE = {1: 3, 2: 1 + VocabStats.N_FIELDS}
+WORD_SEPARATOR = b'\0'
+
+
+def dump_partial_vocab(partial_vocab: PartialVocab, path: str) -> None:
+    """
+    Words are saved sorted as a utf-8 blob, in which they are separated by zero characters, and offsets into it.
+    Counts are saved as uint64 array, non-empty stats bins as int64 array of their indices and fields.
+    The file is written under a temporary name and renamed when it is complete.
+
+    >>> import tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), f'1.{PARTVOCAB_EXT}')
+    >>> partial_vocab = PartialVocab(Counter({'b': 2, 'a\\xa0': 3, '\\ud800': 1}))
+    >>> dump_partial_vocab(partial_vocab, path)
+    >>> loaded = load_partial_vocab(path)
+    >>> loaded.merged_word_counts
+    Counter({'a\\xa0': 3, 'b': 2, '\\ud800': 1})
+    >>> loaded.__dict__ == partial_vocab.__dict__
+    True
+    >>> dump_partial_vocab(PartialVocab(Counter({'a\\x00b': 1, '': 2, 'c': 3})), path)
+    >>> load_partial_vocab(path).merged_word_counts
+    Counter({'c': 3, '': 2, 'a\\x00b': 1})
+    >>> is_partial_vocab_file_complete(path)
+    True
+    >>> with open(path, 'r+b') as f:
+    ...     _ = f.truncate(os.path.getsize(path) - 1)
+    >>> is_partial_vocab_file_complete(path)
+    False
+    """
+    words = sorted(partial_vocab.merged_word_counts)
+    encoded_words = [word.encode('utf-8', 'surrogatepass') for word in words]
+    # the offset of each word and the offset the next word would have after the last one
+    word_offsets = array('Q', [0])
+    for encoded_word in encoded_words:
+        word_offsets.append(word_offsets[-1] + len(encoded_word) + 1)
+    counts = array('Q', (partial_vocab.merged_word_counts[word] for word in words))
+    stats_bins = partial_vocab.stats.nonempty_bins()
+    stats = array('q', (value for bin in stats_bins for value in bin))
+    id = partial_vocab.id.encode('utf-8')
+    word_blob = WORD_SEPARATOR.join(encoded_words)
+    parts = [
+        PARTVOCAB_HEADER.pack(PARTVOCAB_MAGIC, PARTVOCAB_FORMAT_VERSION, sys.byteorder == 'little',
+                              len(words), len(stats_bins), partial_vocab.n_files, len(id), len(word_blob)),
+        word_offsets.tobytes(), counts.tobytes(), stats.tobytes(), id, word_blob
+    ]
+    checksum = 0
+    not_finished_file = f'{path}.{os.getpid()}.part'
+    with open(not_finished_file, 'wb') as f:
+        for part in parts:
+            checksum = zlib.crc32(part, checksum)
+            f.write(part)
+        f.write(PARTVOCAB_FOOTER.pack(checksum, PARTVOCAB_MAGIC))
+    os.replace(not_finished_file, path)
+
+
+def is_partial_vocab_file_complete(path: str) -> bool:
+    """
+    Checks the header and the footer only, the checksum is verified when the file is loaded.
+    Files saved by older versions are pickled, they are loaded completely.
+    """
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        magic = f.read(len(PARTVOCAB_MAGIC))
+        if magic != PARTVOCAB_MAGIC:
+            f.seek(0)
             try:
-                first = self.tasks[chunk_assigned].get(block=True, timeout=BLOCKING_TIMEOUT_SECONDS_LONG)
-                second = self.tasks[chunk_assigned].get(block=True, timeout=BLOCKING_TIMEOUT_SECONDS_LONG)
-            except Empty:
-                logger.debug(f"[{self.id}] Could not get a task from queue. Terminating")
-                if first:
-                    self.tasks[chunk_assigned].put_nowait(first)
-                return
-
-            start = time.time()
-
-            merges_left = self.merges_left_counter.get_and_dec()
-            merges_done = self.total_merges - merges_left
-            log_this_merge = (merges_left & (merges_left - 1) == 0 or merges_done & (merges_done - 1) == 0)
-            if log_this_merge:
-                logger.info(
-                    f'[{self.id}] Merging vocabs ({self.total_merges - merges_left} out of {self.total_merges})')
-
-            first, new_words = self._merge(first, second)
-
-            if log_this_merge:
-                self._log_merge_results(new_words, len(first.merged_word_counts), time.time() - start)
-
-            self.tasks[chunk_assigned].put_nowait(first)
-
-    def _finish_merges(self) -> None:
-        logger.info("===============     Finishing merges    ===============")
-        list_from_chunks = [queue.get(block=True, timeout=BLOCKING_TIMEOUT_SECONDS_SHORT) for queue in
-                            self.tasks.values()]
-
-        percents_in_one_chunk = 100 // len(list_from_chunks)
-
-        first = list_from_chunks.pop()
-        for i, vocab in enumerate(list_from_chunks):
-            logger.info(
-                f'{(i+1)* percents_in_one_chunk}% + {percents_in_one_chunk}%  ---> {(i+2) * percents_in_one_chunk}%')
-
-            start = time.time()
-
-            first, new_words = self._merge(first, vocab)
-
-            self._log_merge_results(new_words, len(first.merged_word_counts), time.time() - start)
-
-        first.write_stats(self.vocav_size_file_path)
-        first.write_vocab(self.vocab_file_path)
-        shutil.rmtree(self.path_to_dump)
-
-    def _log_merge_results(self, new_words: List[str], resulting_vocab_size: int, time: float) -> None:
-        logger.debug(f"[{self.id}] New words: {new_words[:10]} ..., total: {len(new_words)}")
-        logger.debug(
-            f"[{self.id}] Merging took {time:.3f} s, current vocab size: {resulting_vocab_size}")
-
-    def _merge(self, first: PartialVocab, second: PartialVocab) -> Tuple[PartialVocab, List[str]]:
-        first_id = first.id
-        second_id = second.id
-
-        new_words = first.add_vocab(second)
+                pickle.load(f)
+                return True
+            except (EOFError, pickle.UnpicklingError):
+                return False
+        if size < PARTVOCAB_HEADER.size + PARTVOCAB_FOOTER.size:
+            return False
+        f.seek(0)
+        _, version, _, n_words, n_stats, _, id_size, word_blob_size = \
+            PARTVOCAB_HEADER.unpack(f.read(PARTVOCAB_HEADER.size))
+        if version not in STATS_ENTRY_SIZE:
+            return False
+        expected_size = (PARTVOCAB_HEADER.size + (2 * n_words + 1 + STATS_ENTRY_SIZE[version] * n_stats) * 8
+                         + id_size + word_blob_size + PARTVOCAB_FOOTER.size)
+        if size != expected_size:
+            return False
+        f.seek(size - PARTVOCAB_FOOTER.size)
+        _, footer_magic = PARTVOCAB_FOOTER.unpack(f.read(PARTVOCAB_FOOTER.size))
+        return footer_magic == PARTVOCAB_MAGIC
+
+
+def load_partial_vocab(path: str) -> PartialVocab:
+    with open(path, 'rb') as f:
+        content = f.read()
+    if not content.startswith(PARTVOCAB_MAGIC):
+        partial_vocab = pickle.loads(content)
+        if not isinstance(partial_vocab, PartialVocab):
+            raise TypeError(f"Object {str(partial_vocab)} must be PartialVocab version {PartialVocab.CLASS_VERSION}")
+        if isinstance(partial_vocab.stats, list):
+            partial_vocab.stats = VocabStats.from_entries(partial_vocab.stats)
+        return partial_vocab
+
+    if len(content) < PARTVOCAB_HEADER.size + PARTVOCAB_FOOTER.size:
+        raise ValueError(f'{path} is not a complete partial vocab file')
+    _, version, little_endian, n_words, n_stats, n_files, id_size, word_blob_size = \
+        PARTVOCAB_HEADER.unpack_from(content, 0)
+    if version not in STATS_ENTRY_SIZE or bool(little_endian) != (sys.byteorder == 'little'):
+        raise ValueError(f'{path} is a partial vocab file of an unsupported format')
+    checksum, footer_magic = PARTVOCAB_FOOTER.unpack_from(content, len(content) - PARTVOCAB_FOOTER.size)
+    if footer_magic != PARTVOCAB_MAGIC or zlib.crc32(memoryview(content)[:-PARTVOCAB_FOOTER.size]) != checksum:
+        raise ValueError(f'{path} is corrupted')
+
+    position = PARTVOCAB_HEADER.size
+
+    def read(length: int) -> bytes:
+        nonlocal position
+        position += length
+        return content[position - length:position]
+
+    word_offsets, counts, stats = array('Q'), array('Q'), array('q')
+    word_offsets.frombytes(read((n_words + 1) * 8))
+    counts.frombytes(read(n_words * 8))
+    stats_entry_size = STATS_ENTRY_SIZE[version]
+    stats.frombytes(read(n_stats * stats_entry_size * 8))
+    id = read(id_size).decode('utf-8')
+    word_blob = read(word_blob_size)
+
+    if not n_words:
+        words = []
+    elif word_blob.count(WORD_SEPARATOR) == n_words - 1:
+        words = word_blob.decode('utf-8', 'surrogatepass').split(WORD_SEPARATOR.decode())
+    else:
+        # some words contain the separator
+        words = [word_blob[word_offsets[i]:word_offsets[i + 1] - 1].decode('utf-8', 'surrogatepass')
+                 for i in range(n_words)]
+
+    partial_vocab = PartialVocab.__new__(PartialVocab)
+    partial_vocab.merged_word_counts = Counter()
+    # Counter.update would add up the counts, dict.update just sets them
+    dict.update(partial_vocab.merged_word_counts, zip(words, counts))
+    stats_entries = [tuple(stats[i:i + stats_entry_size]) for i in range(0, len(stats), stats_entry_size)]
+    if version == 1:
+        partial_vocab.stats = VocabStats.from_entries(stats_entries)
+    else:
+        partial_vocab.stats = VocabStats()
+        for entry in stats_entries:
+            partial_vocab.stats.set_bin(*entry)
+    partial_vocab.n_files = n_files
+    partial_vocab.id = id
+    return partial_vocab
 
-        first.renew_id()
-        path_to_new_file = os.path.join(self.path_to_dump, f'{first_id}_{second_id}_{first.id}.{PARTVOCAB_EXT}')
-        pickle.dump(first, open(path_to_new_file, 'wb'))
-        finish_file_dumping(path_to_new_file)
 
-        return first, new_words
+def merge_two_partial_vocabs(first: PartialVocab, second: PartialVocab) -> PartialVocab:
+    """
+    Adds `second` to `first`. The words of the smaller vocab are added to the bigger one.
+    """
+    if len(first.merged_word_counts) < len(second.merged_word_counts):
+        first.merged_word_counts, second.merged_word_counts = second.merged_word_counts, first.merged_word_counts
+    first.add_vocab(second)
+    return first
+
+
+def reduce_partial_vocabs(partial_vocabs: List[PartialVocabOrPath], spill_dir: str,
+                          max_words_in_memory: int = VOCAB_MERGE_MAX_WORDS_IN_MEMORY,
+                          max_words_returned: int = sys.maxsize) -> List[PartialVocabOrPath]:
+    """
+    Merges `partial_vocabs` as a balanced binary tree: two vocabs are merged only if they have been merged
+    from the same number of vocabs, so that at most log(n) vocabs are kept in memory at the same time.
+    If there are more than `max_words_in_memory` words in these vocabs, they are merged and the result
+    is spilled to `spill_dir`. Returns the paths to the spilled vocabs followed by the vocab merged from the rest,
+    which is spilled too if it has more than `max_words_returned` words.
+    Only vocabs merged from at least two vocabs are spilled because of `max_words_in_memory`, so that there are
+    at most half as many vocabs returned as passed, even if each of them exceeds the limit.
+
+    >>> import tempfile
+    >>> vocabs = [PartialVocab(Counter({'a': 1, w: 1})) for w in 'bcde']
+    >>> [v.merged_word_counts for v in reduce_partial_vocabs(vocabs, tempfile.mkdtemp())]
+    [Counter({'a': 4, 'b': 1, 'c': 1, 'd': 1, 'e': 1})]
+
+    >>> vocabs = [PartialVocab(Counter({'a': 1, w: 1})) for w in 'bcde']
+    >>> reduced = reduce_partial_vocabs(vocabs, tempfile.mkdtemp(), max_words_in_memory=2)
+    >>> [load_partial_vocab(v).merged_word_counts for v in reduced]
+    [Counter({'a': 2, 'b': 1, 'c': 1}), Counter({'a': 2, 'd': 1, 'e': 1})]
+
+    >>> vocabs = [PartialVocab(Counter({'a': 1, w: 1})) for w in 'bcde']
+    >>> reduced = reduce_partial_vocabs(vocabs, tempfile.mkdtemp(), max_words_returned=4)
+    >>> [load_partial_vocab(v).merged_word_counts for v in reduced]
+    [Counter({'a': 4, 'b': 1, 'c': 1, 'd': 1, 'e': 1})]
+    """
+    result: List[PartialVocabOrPath] = []
+    # pairs of the number of vocabs a vocab was merged from and the vocab itself
+    stack: List[Tuple[int, PartialVocab]] = []
+    for partial_vocab in partial_vocabs:
+        if isinstance(partial_vocab, str):
+            partial_vocab = load_partial_vocab(partial_vocab)
+        n_merged = 1
+        while stack and stack[-1][0] == n_merged:
+            partial_vocab = merge_two_partial_vocabs(stack.pop()[1], partial_vocab)
+            n_merged *= 2
+        stack.append((n_merged, partial_vocab))
+
+        if sum(n for n, _ in stack) >= 2 and sum(len(v.merged_word_counts) for _, v in stack) > max_words_in_memory:
+            result.append(_spill_partial_vocab(_merge_stack(stack), spill_dir))
+            stack = []
+    if stack:
+        merged = _merge_stack(stack)
+        if len(merged.merged_word_counts) > max_words_returned:
+            result.append(_spill_partial_vocab(merged, spill_dir))
+        else:
+            result.append(merged)
+    return result
+
+
+def _spill_partial_vocab(partial_vocab: PartialVocab, spill_dir: str) -> str:
+    path = os.path.join(spill_dir, f'{partial_vocab.id}.{PARTVOCAB_EXT}')
+    logger.debug(f"Spilling partial vocab with {len(partial_vocab.merged_word_counts)} words to {path}")
+    dump_partial_vocab(partial_vocab, path)
+    return path
+
+
+def _merge_stack(stack: List[Tuple[int, PartialVocab]]) -> PartialVocab:
+    merged = stack.pop()[1]
+    while stack:
+        merged = merge_two_partial_vocabs(stack.pop()[1], merged)
+    return merged
+
+
+def _reduce_partial_vocabs(params: Tuple[List[PartialVocabOrPath], str, int, int]) -> List[PartialVocabOrPath]:
+    return reduce_partial_vocabs(*params)
+
+
+def merge_partial_vocabs(partial_vocabs: List[PartialVocabOrPath], spill_dir: str, n_processes: int,
+                         max_words_in_memory: int = VOCAB_MERGE_MAX_WORDS_IN_MEMORY) -> PartialVocab:
+    """
+    Splits `partial_vocabs` into `n_processes` contiguous groups each of which is reduced in a separate process.
+    The results are then merged pairwise, each level of the tree in parallel.
+    Vocabs are passed between the processes in memory unless they have been spilled to disk. A process spills
+    the vocab it returns if it has more than `max_words_in_memory / n_processes` words, so that the vocabs
+    returned by all the processes do not hold more than `max_words_in_memory` words in the parent process.
+    """
+    if not partial_vocabs:
+        raise ValueError('There must be at least one partial vocab to merge')
+    os.makedirs(spill_dir, exist_ok=True)
+    n_processes = min(n_processes, len(partial_vocabs))
+    if n_processes <= 1:
+        level = reduce_partial_vocabs(partial_vocabs, spill_dir, max_words_in_memory)
+        while len(level) > 1:
+            level = reduce_partial_vocabs(level, spill_dir, max_words_in_memory)
+    else:
+        bounds = [len(partial_vocabs) * i // n_processes for i in range(n_processes + 1)]
+        groups = [partial_vocabs[start:end] for start, end in zip(bounds, bounds[1:])]
+        max_words_returned = max_words_in_memory // n_processes
+        with Pool(n_processes) as pool:
+            logger.info(f"Merging {len(partial_vocabs)} partial vocabs in {n_processes} processes")
+            reduced_groups = pool.map(_reduce_partial_vocabs,
+                                      [(group, spill_dir, max_words_in_memory, max_words_returned) for group in groups])
+            level = [vocab for reduced_group in reduced_groups for vocab in reduced_group]
+            while len(level) > 1:
+                logger.info(f"Merging {len(level)} partial vocabs")
+                pairs = [level[i:i+2] for i in range(0, len(level) - 1, 2)]
+                # the last vocab of an odd level is carried to the next one as it is
+                not_paired = level[-1:] if len(level) % 2 else []
+                reduced_pairs = pool.map(_reduce_partial_vocabs,
+                                         [(pair, spill_dir, max_words_in_memory, max_words_returned) for pair in pairs])
+                level = [vocab for reduced_pair in reduced_pairs for vocab in reduced_pair] + not_paired
+    result = level[0]
+    return load_partial_vocab(result) if isinstance(result, str) else result
 
 
 def get_vocab(file_paths: List[str], represented_as_literal_str: bool = True) -> Counter:
@@ -213,20 +518,36 @@ def get_vocab(file_paths: List[str], represented_as_literal_str: bool = True) ->
     return vocab
 
 
-def create_and_dump_partial_vocab(param: Tuple[List[str], str, int]) -> PartialVocab:
-    path_to_file, path_to_dump, chunk = param
-    vocab = get_vocab(path_to_file)
-    partial_vocab = PartialVocab(vocab, chunk)
-    path = os.path.join(path_to_dump, f'{partial_vocab.id}.{PARTVOCAB_EXT}')
-    logger.debug(f"Dumping part vocab to {path}")
-    pickle.dump(partial_vocab, open(path, 'wb'))
-    return partial_vocab
+def dump_word_counts(word_counts: Counter, path_to_dump: str, n_partitions: int = 0) -> Optional[str]:
+    """
+    Saves the word counts of a group of files as a partial vocab and returns its path or,
+    if `n_partitions` > 0, saves the words of each partition to the partition's dir.
+    A vocab is saved to every partition even if it is empty, so that all the partitions are merged
+    from the same number of vocabs in the same order, and their stats can be added up.
+    """
+    if not n_partitions:
+        partial_vocab = PartialVocab(word_counts)
+        path = os.path.join(path_to_dump, f'{partial_vocab.id}.{PARTVOCAB_EXT}')
+        logger.debug(f"Dumping part vocab to {path}")
+        dump_partial_vocab(partial_vocab, path)
+        return path
+
+    partitions = [Counter() for _ in range(n_partitions)]
+    for word, count in word_counts.items():
+        partitions[word_partition(word, n_partitions)][word] = count
+    file_name = f'{PartialVocab(Counter()).id}.{PARTVOCAB_EXT}'
+    for partition, partition_word_counts in enumerate(partitions):
+        dump_partial_vocab(PartialVocab(partition_word_counts), os.path.join(path_to_dump, str(partition), file_name))
+    return None
+
+
+def create_and_dump_partial_vocab(param: Tuple[List[str], str]) -> str:
+    path_to_file, path_to_dump = param
+    return dump_word_counts(get_vocab(path_to_file), path_to_dump)
 
 
 def finish_file_dumping(path_to_new_file: str) -> None:
-    try:
-        pickle.load(open(path_to_new_file, 'rb'))
-    except EOFError:
+    if not is_partial_vocab_file_complete(path_to_new_file):
         # file has not been written properly
         os.remove(path_to_new_file)
         return
@@ -249,77 +570,160 @@ def finish_file_dumping(path_to_new_file: str) -> None:
     os.rename(path_to_new_file, new_file)
 
 
-def list_to_queue(lst: List) -> Queue:
-    queue = Queue()
-    for elm in lst:
-        queue.put_nowait(elm)
-    return queue
-
-
-def create_initial_partial_vocabs(all_files: List[bytes], path_to_dump: str) -> List[PartialVocab]:
-    partial_vocabs_queue = []
+def create_initial_partial_vocabs(all_files: List[bytes], path_to_dump: str) -> List[str]:
+    partial_vocab_paths = []
     file_groups = groupify(all_files, MAX_INIT_PARTIAL_VOCABS)
-    file_groups_total = len(file_groups)
-    chunk_generator = create_chunk_generator(len(file_groups), N_CHUNKS)
-    params = [(file_group, path_to_dump, chunk) for file_group, chunk in zip(file_groups, chunk_generator)]
-    pool = Pool()
-    partial_vocab_it = pool.imap_unordered(create_and_dump_partial_vocab, params)
-    for partial_vocab in tqdm(partial_vocab_it, total=file_groups_total):
-        partial_vocabs_queue.append(partial_vocab)
-    return partial_vocabs_queue
+    params = [(file_group, path_to_dump) for file_group in file_groups]
+    with Pool() as pool:
+        partial_vocab_it = pool.imap_unordered(create_and_dump_partial_vocab, params)
+        for partial_vocab_path in tqdm(partial_vocab_it, total=len(file_groups)):
+            partial_vocab_paths.append(partial_vocab_path)
+    return partial_vocab_paths
 
 
-def create_chunk_queue(chunk_sizes: Dict[int, int], num_mergers: int) -> Tuple[Queue, int]:
-    chunk_queue_list = [chunk for chunk, chunk_size in chunk_sizes.items() for _ in range(chunk_size - 1)]
-    return list_to_queue(chunk_queue_list + [-1 for _ in range(num_mergers)]), len(chunk_queue_list)
+def word_partition(word: str, n_partitions: int) -> int:
+    """
+    `hash()` of a string differs from process to process, crc32 sends a word to the same partition in all readers.
 
+    >>> word_partition('foo', 4), word_partition('foo', 4), word_partition('bar', 4)
+    (1, 1, 2)
+    """
+    return zlib.crc32(word.encode('utf-8', 'surrogatepass')) % n_partitions
 
-def mapify_tasks(tasks: List[PartialVocab]) -> Tuple[Dict[int, Queue], Dict[int, int]]:
-    task_lists_in_chunks = defaultdict(list)
-    for task in tasks:
-        task_lists_in_chunks[task.chunk].append(task)
-    return {chunk: list_to_queue(task_list_in_chunk) for chunk, task_list_in_chunk in
-            task_lists_in_chunks.items()}, {k: len(v) for k, v in task_lists_in_chunks.items()}
 
+def create_and_dump_partitioned_vocab(param: Tuple[List[str], str, int]) -> None:
+    path_to_file, path_to_dump, n_partitions = param
+    dump_word_counts(get_vocab(path_to_file), path_to_dump, n_partitions)
 
-def load_partial_vocabs(path: str) -> List[PartialVocab]:
+
+def create_initial_partitioned_vocabs(all_files: List[bytes], path_to_dump: str, n_partitions: int) -> List[str]:
+    partition_dirs = [os.path.join(path_to_dump, str(partition)) for partition in range(n_partitions)]
+    file_groups = groupify(all_files, MAX_INIT_PARTIAL_VOCABS)
+    params = [(file_group, path_to_dump, n_partitions) for file_group in file_groups]
+    with Pool() as pool:
+        for _ in tqdm(pool.imap_unordered(create_and_dump_partitioned_vocab, params), total=len(file_groups)):
+            pass
+    return partition_dirs
+
+
+def load_partitions(path: str) -> List[str]:
+    logger.info(f"Loading partitioned vocabs from {path} ...")
+    partitions = sorted((file for file in os.listdir(path) if file.isdigit()), key=int)
+    return [os.path.join(path, partition) for partition in partitions]
+
+
+def count_partition(param: Tuple[str, str]) -> Tuple[VocabStats, int, int, int]:
+    """
+    Merges the vocabs of the partition and writes them to `path_to_vocab_file` sorted by frequency.
+    The vocabs are merged in the order of the file names, which is the same for all the partitions.
+    """
+    partition_dir, path_to_vocab_file = param
+    paths = [os.path.join(partition_dir, file) for file in sorted(os.listdir(partition_dir))
+             if file.endswith(f'.{PARTVOCAB_EXT}')]
+    vocab, = reduce_partial_vocabs(paths, partition_dir, max_words_in_memory=sys.maxsize)
+    vocab.write_vocab(path_to_vocab_file)
+    return vocab.stats, vocab.n_files, len(vocab.merged_word_counts), vocab.merged_word_counts[placeholders['non_eng']]
+
+
+def merge_sorted_vocab_files(paths: List[str], path_to_vocab_file: str) -> None:
+    files = [open(path, 'r') for path in paths]
+    try:
+        with open(path_to_vocab_file, 'w') as f:
+            for line in heapq.merge(*files, key=lambda l: -int(l.rsplit(VOCAB_DICT_DELIM, 1)[1])):
+                f.write(line)
+    finally:
+        for file in files:
+            file.close()
+
+
+def merge_partitions(partition_dirs: List[str], n_processes: int, vocab_file_path: str,
+                     vocab_size_file_path: str) -> None:
+    """
+    Each partition is counted by a separate process, so that a process holds only the words of its partition.
+    The vocab files of the partitions, which are written next to the partition directories, are then merged
+    by frequency, the stats of the partitions are added up.
+
+    >>> import tempfile
+    >>> d = tempfile.mkdtemp()
+    >>> for i, word_counts in enumerate([Counter({'a': 2, 'b': 1}), Counter({'c': 5})]):
+    ...     os.makedirs(os.path.join(d, str(i)))
+    ...     dump_partial_vocab(PartialVocab(word_counts), os.path.join(d, str(i), f'1.{PARTVOCAB_EXT}'))
+    ...     dump_partial_vocab(PartialVocab(Counter({'a': 1}) if i == 0 else Counter()),
+    ...                        os.path.join(d, str(i), f'2.{PARTVOCAB_EXT}'))
+    >>> vocab_file, vocab_size_file = os.path.join(d, 'vocab'), os.path.join(d, 'vocabsize')
+    >>> merge_partitions([os.path.join(d, '0'), os.path.join(d, '1')], 1, vocab_file, vocab_size_file)
+    >>> open(vocab_file).read().splitlines()
+    ['c\\t5', 'a\\t3', 'b\\t1']
+    >>> print(open(vocab_size_file).read(), end='')
+    3
+    0.5000 2 0
+    1.0000 3 0
+    """
+    params = [(partition_dir, f'{partition_dir}.{VOCAB_FILENAME}') for partition_dir in partition_dirs]
+    if n_processes <= 1:
+        partition_stats = [count_partition(param) for param in params]
+    else:
+        with Pool(min(n_processes, len(params))) as pool:
+            partition_stats = pool.map(count_partition, params)
+    stats, n_files, _, _ = partition_stats[0]
+    for other_stats, _, _, _ in partition_stats[1:]:
+        stats.add_partition(other_stats)
+    vocab_size = sum(partition_vocab_size for _, _, partition_vocab_size, _ in partition_stats)
+    non_eng_count = sum(partition_non_eng_count for _, _, _, partition_non_eng_count in partition_stats)
+    write_vocab_stats(stats, n_files, vocab_size, non_eng_count, vocab_size_file_path)
+    merge_sorted_vocab_files([vocab_file for _, vocab_file in params], vocab_file_path)
+
+
+def load_partial_vocabs(path: str) -> List[str]:
     logger.info(f"Loading partially calculated vocabs from {path} ...")
     for file in os.listdir(path):
         if fnmatch(file, f'[0-9]*_[0-9]*_[0-9]*.{PARTVOCAB_EXT}'):
-            # hasn't been terminated properly
+            # left by an older version which has not been terminated properly
             finish_file_dumping(os.path.join(path, file))
 
-    task_list = []
-    for file in os.listdir(path):
-        if file.endswith(PARTVOCAB_EXT):
-            part_vocab = pickle.load(open(os.path.join(path, file), 'rb'))
-            if not isinstance(part_vocab, PartialVocab):
-                raise TypeError(f"Object {str(part_vocab)} must be VocabMerger version {part_vocab.VERSION}")
-            task_list.append(part_vocab)
-
-    return task_list
+    return [os.path.join(path, file) for file in sorted(os.listdir(path)) if file.endswith(PARTVOCAB_EXT)]
 
 
-def create_partial_vocabs(file_iterator: Iterator[bytes], path_to_dump: str) -> List[PartialVocab]:
+def create_partial_vocabs(file_iterator: Iterator[bytes], path_to_dump: str, n_partitions: int = 0) -> List[str]:
+    """
+    Returns the paths to the partial vocabs or, if `n_partitions` > 0, the paths to the partition dirs.
+    """
     logger.info(f"Calculating vocabulary from scratch")
-    if os.path.exists(path_to_dump):
-        shutil.rmtree(path_to_dump)
-    os.makedirs(path_to_dump)
+    init_partial_vocabs_dir(path_to_dump, n_partitions)
 
     all_files = [file for file in file_iterator]
     if not all_files:
         logger.warning("No preprocessed files found.")
         exit(4)
-    task_list = create_initial_partial_vocabs(all_files, path_to_dump)
-    open(os.path.join(path_to_dump, PARTIAL_VOCABS_READY_FILENAME), 'a').close()
+    if n_partitions:
+        task_list = create_initial_partitioned_vocabs(all_files, path_to_dump, n_partitions)
+    else:
+        task_list = create_initial_partial_vocabs(all_files, path_to_dump)
+    set_partial_vocabs_ready(path_to_dump)
     return task_list
 
 
+def get_partial_vocabs_dir(output_dir: str, n_partitions: int = 0) -> str:
+    return os.path.join(output_dir, 'partitioned_vocab' if n_partitions else 'part_vocab')
+
+
+def init_partial_vocabs_dir(path_to_dump: str, n_partitions: int = 0) -> None:
+    if os.path.exists(path_to_dump):
+        shutil.rmtree(path_to_dump)
+    os.makedirs(path_to_dump)
+    for partition in range(n_partitions):
+        os.makedirs(os.path.join(path_to_dump, str(partition)))
+
+
+def set_partial_vocabs_ready(path_to_dump: str) -> None:
+    open(os.path.join(path_to_dump, PARTIAL_VOCABS_READY_FILENAME), 'a').close()
+
+
 def partial_vocabs_ready(path_to_dump: str) -> bool:
     return os.path.exists(os.path.join(path_to_dump, PARTIAL_VOCABS_READY_FILENAME))
 
 
-def _dump_vocab_dict(lst: List[Tuple[str, int]], file: str, to_literal=True) -> None:
+def _dump_vocab_dict(lst: Iterable[Tuple[str, int]], file: str, to_literal=True) -> None:
     with open(file, 'w') as f:
         for word, freq in lst:
             if to_literal:
@@ -348,45 +752,41 @@ def _load_vocab_set(file: str) -> Set[str]:
     return non_bpe_tokens
 
 
-def calc_vocab(path: str, file_iterator: Iterator[bytes], output_dir: str):
-    if platform.system() == 'Darwin':
-        logger.info("Parallel calculation of vocabulary is not supported on OSX. Using single core")
-        n_processes = 1
-        counter_class = NonAtomicCounter
-    else:
-        n_processes = multiprocessing.cpu_count()
-        counter_class = AtomicInteger
+def calc_vocab(path: str, file_iterator: Iterator[bytes], output_dir: str, n_partitions: int = VOCAB_N_PARTITIONS):
+    """
+    If `n_partitions` > 0, words are split into `n_partitions` partitions by hash and each partition is counted
+    in a separate process. Otherwise partial vocabs of the whole key space are merged with `merge_partial_vocabs`.
+    If the partial vocabs have already been saved to `output_dir`, e.g. counted by `to_repr.run`
+    while the files were preprocessed, the files are not read.
+    """
+    n_processes = multiprocessing.cpu_count()
     vocab_file_path = os.path.join(output_dir, VOCAB_FILENAME)
     vocab_size_file_path = os.path.join(output_dir, VOCABSIZE_FILENAME)
     if os.path.exists(vocab_size_file_path) and os.path.exists(vocab_file_path):
         logger.info(f"Vocab files already exist at: {os.path.dirname(vocab_size_file_path)}/ . Doing nothing.")
         return
 
-    path_to_dump = os.path.join(output_dir, 'part_vocab')
+    path_to_dump = get_partial_vocabs_dir(output_dir, n_partitions)
 
     if partial_vocabs_ready(path_to_dump):
-        task_list = load_partial_vocabs(path_to_dump)
+        task_list = load_partitions(path_to_dump) if n_partitions else load_partial_vocabs(path_to_dump)
     else:
         logger.debug(f"Reading files from: {path}")
-        task_list = create_partial_vocabs(file_iterator, path_to_dump)
+        task_list = create_partial_vocabs(file_iterator, path_to_dump, n_partitions)
 
-    logger.debug(f"Using {n_processes} mergers, number of partial vocabs: {len(task_list)}")
-    tasks_queues, chunk_sizes = mapify_tasks(task_list)
-    chunk_queue, merges_to_be_done = create_chunk_queue(chunk_sizes, n_processes)
     logger.debug(f'==================    Starting merging    =================')
-    logger.debug(f'Merges need to be done: {merges_to_be_done}')
-    process_counter = counter_class(n_processes)
-    merges_left_counter = counter_class(merges_to_be_done)
-    mergers = [VocabMerger(i + 1, tasks_queues, path_to_dump, process_counter, chunk_queue,
-                           merges_left_counter,
-                           vocab_file_path=vocab_file_path,
-                           vocab_size_file_path=vocab_size_file_path)
-               for i in range(n_processes)]
-    for merger in mergers:
-        merger.start()
-
-    for merger in mergers:
-        merger.join()
+    if n_partitions:
+        merge_partitions(task_list, n_processes, vocab_file_path, vocab_size_file_path)
+    else:
+        spill_dir = os.path.join(path_to_dump, SPILLED_VOCABS_DIR)
+        if os.path.exists(spill_dir):
+            # vocabs spilled by an interrupted run are merged from the initial partial vocabs again
+            shutil.rmtree(spill_dir)
+        vocab = merge_partial_vocabs(task_list, spill_dir, n_processes)
+
+        vocab.write_stats(vocab_size_file_path)
+        vocab.write_vocab(vocab_file_path)
+    shutil.rmtree(path_to_dump)
 
     logger.info(f"Vocab is available at {vocab_file_path}")
-    logger.info(f"Vocab stats is available at {vocab_size_file_path}")
\ No newline at end of file
+    logger.info(f"Vocab stats is available at {vocab_size_file_path}")
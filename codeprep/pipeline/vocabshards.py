@@ -0,0 +1,176 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Maintains the vocabulary of a growing dataset incrementally.
+
+The word counts of each shard, i.e. each top-level directory of the dataset (usually a repository),
+are stored together with a fingerprint of the shard's original files, as well as the total word counts.
+When the vocabulary is updated, only the shards that have been added or whose files have changed are counted,
+their new counts are added to the totals, and the old counts of the changed and the removed shards are subtracted.
+"""
+import hashlib
+import logging
+import os
+import pickle
+from collections import Counter, defaultdict
+from multiprocessing.pool import Pool
+from typing import Dict, Iterable, List, Tuple
+
+from tqdm import tqdm
+
+from codeprep.pipeline.dataset import Dataset
+from codeprep.pipeline.vocab import PartialVocab, VocabStats, PARTVOCAB_EXT, VOCAB_FILENAME, VOCABSIZE_FILENAME, \
+    dump_partial_vocab, load_partial_vocab, get_vocab, write_vocab_stats
+from codeprep.preprocess.placeholders import placeholders
+
+logger = logging.getLogger(__name__)
+
+SHARD_INDEX_FILENAME = 'shards.pickle'
+
+
+class ShardInfo(object):
+    def __init__(self, fingerprint: str, n_files: int, vocab_size: int, non_eng_count: int):
+        self.fingerprint = fingerprint
+        self.n_files = n_files
+        self.vocab_size = vocab_size
+        self.non_eng_count = non_eng_count
+
+
+class ShardIndex(object):
+    """
+    Index of the stored shards. The totals are saved under the name of their generation,
+    so that the index, which is replaced last, always refers to complete files.
+    """
+    def __init__(self):
+        self.shards: Dict[bytes, ShardInfo] = {}
+        self.generation = 0
+
+
+def get_shard(rel_path: bytes) -> bytes:
+    """
+    >>> get_shard(b'./repo/src/Main.java'), get_shard(b'repo/Main.java'), get_shard(b'./Main.java')
+    (b'repo', b'repo', b'')
+    """
+    parts = os.path.normpath(rel_path).split(os.sep.encode(), 1)
+    return parts[0] if len(parts) > 1 else b''
+
+
+def _shard_file_name(shard: bytes, fingerprint: str) -> str:
+    return f'{hashlib.sha1(shard).hexdigest()}_{fingerprint}.{PARTVOCAB_EXT}'
+
+
+def _totals_file_name(generation: int) -> str:
+    return f'total_{generation}.{PARTVOCAB_EXT}'
+
+
+def fingerprint_files(original_files: List[bytes]) -> str:
+    """
+    Changes if a file is added, removed or modified. Files are not read, only their size and modification time are.
+    """
+    h = hashlib.sha1()
+    for file in sorted(original_files):
+        stat = os.stat(file)
+        h.update(b'%s\0%d\0%d\0' % (file, stat.st_size, stat.st_mtime_ns))
+    return h.hexdigest()
+
+
+def _count_shard(params: Tuple[bytes, List[bytes]]) -> Tuple[bytes, Counter]:
+    shard, prep_files = params
+    return shard, get_vocab(prep_files)
+
+
+def _load_index(path_to_store: str) -> ShardIndex:
+    path_to_index = os.path.join(path_to_store, SHARD_INDEX_FILENAME)
+    if not os.path.exists(path_to_index):
+        return ShardIndex()
+    with open(path_to_index, 'rb') as f:
+        return pickle.load(f)
+
+
+def _save_index(index: ShardIndex, path_to_store: str) -> None:
+    path_to_index = os.path.join(path_to_store, SHARD_INDEX_FILENAME)
+    with open(f'{path_to_index}.part', 'wb') as f:
+        pickle.dump(index, f)
+    os.replace(f'{path_to_index}.part', path_to_index)
+
+
+def _remove_unreferenced_files(index: ShardIndex, path_to_store: str) -> None:
+    referenced = {_shard_file_name(shard, info.fingerprint) for shard, info in index.shards.items()}
+    referenced.add(_totals_file_name(index.generation))
+    for file in os.listdir(path_to_store):
+        if file.endswith(PARTVOCAB_EXT) and file not in referenced:
+            os.remove(os.path.join(path_to_store, file))
+
+
+def update_vocab_shards(files: Iterable[Tuple[bytes, bytes, bytes]], path_to_store: str, output_dir: str) -> int:
+    """
+    Updates the word counts stored at `path_to_store` and writes the vocab and its stats to `output_dir`.
+    `files` are the relative path, the path to the original file and the path to the preprocessed file
+    of each file of the dataset. Returns the number of shards that had to be counted.
+    """
+    os.makedirs(path_to_store, exist_ok=True)
+    index = _load_index(path_to_store)
+
+    original_files_by_shard = defaultdict(list)
+    prep_files_by_shard = defaultdict(list)
+    for rel_path, original_file, prep_file in files:
+        shard = get_shard(rel_path)
+        original_files_by_shard[shard].append(original_file)
+        prep_files_by_shard[shard].append(prep_file)
+    fingerprints = {shard: fingerprint_files(original_files)
+                    for shard, original_files in original_files_by_shard.items()}
+    outdated_shards = [shard for shard, info in index.shards.items() if fingerprints.get(shard) != info.fingerprint]
+    shards_to_count = [shard for shard, fingerprint in fingerprints.items()
+                       if shard not in index.shards or index.shards[shard].fingerprint != fingerprint]
+    logger.info(f"Shards: {len(fingerprints)}, to be counted: {len(shards_to_count)}, "
+                f"to be subtracted: {len(outdated_shards)}")
+
+    if index.generation:
+        path_to_totals = os.path.join(path_to_store, _totals_file_name(index.generation))
+        totals = load_partial_vocab(path_to_totals).merged_word_counts
+    else:
+        totals = Counter()
+    for shard in outdated_shards:
+        info = index.shards.pop(shard)
+        old_counts = load_partial_vocab(os.path.join(path_to_store, _shard_file_name(shard, info.fingerprint)))
+        totals.subtract(old_counts.merged_word_counts)
+    for word in [word for word, count in totals.items() if count <= 0]:
+        del totals[word]
+
+    params = [(shard, prep_files_by_shard[shard]) for shard in shards_to_count]
+    with Pool() as pool:
+        for shard, word_counts in tqdm(pool.imap_unordered(_count_shard, params), total=len(params)):
+            fingerprint = fingerprints[shard]
+            path_to_shard = os.path.join(path_to_store, _shard_file_name(shard, fingerprint))
+            dump_partial_vocab(PartialVocab(word_counts), path_to_shard)
+            index.shards[shard] = ShardInfo(fingerprint, len(prep_files_by_shard[shard]), len(word_counts),
+                                            word_counts[placeholders['non_eng']])
+            totals.update(word_counts)
+
+    index.generation += 1
+    total_vocab = PartialVocab(totals)
+    dump_partial_vocab(total_vocab, os.path.join(path_to_store, _totals_file_name(index.generation)))
+    _save_index(index, path_to_store)
+    _remove_unreferenced_files(index, path_to_store)
+
+    n_files = sum(info.n_files for info in index.shards.values())
+    stats = VocabStats.from_entries((info.n_files, info.vocab_size, info.non_eng_count)
+                                    for info in index.shards.values())
+    stats.add(n_files, len(totals), totals[placeholders['non_eng']])
+    os.makedirs(output_dir, exist_ok=True)
+    write_vocab_stats(stats, n_files, len(totals), totals[placeholders['non_eng']],
+                      os.path.join(output_dir, VOCABSIZE_FILENAME))
+    total_vocab.write_vocab(os.path.join(output_dir, VOCAB_FILENAME))
+    return len(shards_to_count)
+
+
+def calc_vocab_incrementally(dataset: Dataset, output_dir: str) -> None:
+    """
+    The shards are stored at `dataset.vocab_shards_path`, which is shared by all the versions of the dataset.
+    """
+    files = ((file, dataset.original.get_file_path(file), dataset.preprocessed.get_file_path(file))
+             for file in dataset.get_all_files())
+    update_vocab_shards(files, dataset.vocab_shards_path, output_dir)
+    logger.info(f"Vocab is available at {os.path.join(output_dir, VOCAB_FILENAME)}")
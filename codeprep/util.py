@@ -6,7 +6,7 @@ import multiprocessing
 from heapq import heappush, heappop, heapify
 
 import itertools
-from typing import Dict, Tuple, List, Optional, Generator
+from typing import Dict, Tuple, List, Optional, Generator, Iterable
 
 
 def merge_dicts_(dict1, dict2) -> Tuple[Dict, List]:
@@ -79,55 +79,96 @@ class NonAtomicCounter(object):
 
 
 class AtomicInteger(object):
-    def __init__(self, v=0):
-        self._lock = multiprocessing.Lock()
-        self._queue = multiprocessing.Queue()
-        for i in range(v):
-            self._queue.put(1)
-
-    def inc(self):
-        with self._lock:
-            self._queue.put(1)
-            return self._queue.qsize()
-
-    def dec(self):
-        with self._lock:
-            self._queue.get()
-            return self._queue.qsize()
-
-    def compare_and_dec(self, val):
-        with self._lock:
-            result = self._queue.qsize() == val
-            self._queue.get()
+    """
+    Integer in shared memory which can be updated atomically by several processes.
+
+    >>> counter = AtomicInteger(10)
+    >>> counter.inc()
+    11
+    >>> counter.dec()
+    10
+    >>> counter.compare_and_dec(10)
+    True
+    >>> counter.value
+    9
+    >>> counter.value = 20
+    >>> counter.get_and_dec()
+    20
+    >>> counter.value
+    19
+    """
+    def __init__(self, v: int=0):
+        self._value = multiprocessing.Value('q', v)
+
+    def inc(self) -> int:
+        with self._value.get_lock():
+            self._value.value += 1
+            return self._value.value
+
+    def dec(self) -> int:
+        with self._value.get_lock():
+            self._value.value -= 1
+            return self._value.value
+
+    def compare_and_dec(self, val: int) -> bool:
+        with self._value.get_lock():
+            result = self._value.value == val
+            self._value.value -= 1
             return result
 
-    def get_and_dec(self):
-        with self._lock:
-            result = self._queue.qsize()
-            self._queue.get()
+    def get_and_dec(self) -> int:
+        with self._value.get_lock():
+            result = self._value.value
+            self._value.value -= 1
             return result
 
     @property
-    def value(self):
-        with self._lock:
-            return self._queue.qsize()
+    def value(self) -> int:
+        with self._value.get_lock():
+            return self._value.value
 
     @value.setter
-    def value(self, v):
-        with self._lock:
-            self._queue = multiprocessing.Queue()
-            for i in range(v):
-                self._queue.put(1)
+    def value(self, v: int) -> None:
+        with self._value.get_lock():
+            self._value.value = v
 
 
 class PriorityCounter(object):
+    """
+    Updating the count of a key marks its heap entry as removed and pushes a new one.
+    Once there are more removed entries than live ones (and at least `MIN_REMOVED_TO_COMPACT`),
+    the heap is rebuilt from the live entries only. Entry keys are unique, so this does not change the order
+    in which the keys are popped.
+
+    >>> counter = PriorityCounter({'a': 3, 'b': 2})
+    >>> counter.MIN_REMOVED_TO_COMPACT = 2
+    >>> counter.add('a', -1)
+    >>> counter.n_live_entries, counter.n_removed_entries
+    (2, 1)
+    >>> counter.add('b', 1)
+    >>> counter.add('b', 1)
+    >>> counter.n_live_entries, counter.n_removed_entries, len(counter.pq)
+    (2, 0, 2)
+    >>> counter.pop_pair(), counter.pop_pair()
+    (('b', 4), ('a', 2))
+    """
     REMOVED = '<removed-task>'  # placeholder for a removed task
+    MIN_REMOVED_TO_COMPACT = 1 << 16
 
     def __init__(self, d: Dict, automatic_count: bool=True):
         self.counter = itertools.count() if automatic_count else None
         self.pq = [[(-value, next(self.counter)) if self.counter else (-value[0], value[1]), key] for key, value in d.items()]  # list of entries arranged in a heap
         heapify(self.pq)
         self.entry_finder = {entry[1]: entry for entry in self.pq}  # mapping of tasks to entries
+        self.n_removed = 0
+
+    @property
+    def n_live_entries(self) -> int:
+        return len(self.entry_finder)
+
+    @property
+    def n_removed_entries(self) -> int:
+        return self.n_removed
 
     def add(self, pair, to_add: int, c: Optional[int]=None):
         'Add a new task or update the priority of an existing task'
@@ -143,11 +184,20 @@ class PriorityCounter(object):
             entry = [(to_add, count), pair]
             self.entry_finder[pair] = entry
             heappush(self.pq, entry)
+        if self.n_removed >= self.MIN_REMOVED_TO_COMPACT and self.n_removed > len(self.entry_finder):
+            self.compact()
 
     def remove_task(self, task):
         'Mark an existing task as REMOVED.  Raise KeyError if not found.'
         entry = self.entry_finder.pop(task)
         entry[-1] = PriorityCounter.REMOVED
+        self.n_removed += 1
+
+    def compact(self) -> None:
+        'Drop the entries marked as REMOVED from the heap.'
+        self.pq = [entry for entry in self.pq if entry[-1] is not PriorityCounter.REMOVED]
+        heapify(self.pq)
+        self.n_removed = 0
 
     def pop_pair(self):
         'Remove and return the lowest priority task. Raise KeyError if empty.'
@@ -156,8 +206,27 @@ class PriorityCounter(object):
             if pair is not PriorityCounter.REMOVED:
                 del self.entry_finder[pair]
                 return pair, -priority
+            self.n_removed -= 1
         raise KeyError('pop from an empty priority queue')
 
+    def __getstate__(self):
+        # removed entries are recognized by the identity of the placeholder, which is not preserved by pickling
+        state = self.__dict__.copy()
+        state['pq'] = [entry for entry in self.pq if entry[-1] is not PriorityCounter.REMOVED]
+        state['n_removed'] = 0
+        # pickling itertools.count is not supported by newer Python versions, the next value is saved instead
+        if self.counter is not None:
+            next_count = next(self.counter)
+            self.counter = itertools.count(next_count)
+            state['counter'] = next_count
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # counters pickled by older versions are restored as they are
+        if isinstance(self.counter, int):
+            self.counter = itertools.count(self.counter)
+        heapify(self.pq)
 
 import sys
 from numbers import Number
@@ -235,6 +304,22 @@ def groupify(all: List, n_chunks: int) -> List[List]:
     return groups
 
 
+def chunks(iterable: Iterable, chunk_size: int) -> Generator[List, None, None]:
+    """
+    >>> list(chunks(range(7), 3))
+    [[0, 1, 2], [3, 4, 5], [6]]
+
+    >>> list(chunks([], 3))
+    []
+    """
+    it = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(it, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
 def to_non_literal_str(word:str) -> str:
     return word.encode().decode("unicode-escape")
         
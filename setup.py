@@ -46,7 +46,6 @@ setup(name='codeprep',
       keywords='big large data source code corpus machine learning pre-processing nlp',
       install_requires=[
         'appdirs>=1.4, <2',
-        'dill>=0.3.1.1, <0.4',
         'docopt>=0.6.2, <0.7',
         'docopt-subcommands>=3.0.0, <4',
         'jsons>=1.0, <2',
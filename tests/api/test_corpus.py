@@ -56,6 +56,21 @@ def test_calc_vocab(os_mock, stages_mock, dataset_mock):
     stages_mock.run_until_vocab.assert_called_with(dataset_mock, None)
 
 
+@mock.patch('codeprep.api.corpus.Dataset', autospec=True)
+@mock.patch('codeprep.api.corpus.stages', autospec=True)
+@mock.patch('codeprep.cli.impl.os.getcwd', autospec=True, return_value=PATH_TO_CUR_DIR_STUB)
+def test_approx_vocab(os_mock, stages_mock, dataset_mock):
+    # given
+    dataset_mock.create = Mock(spec=dataset_mock, return_value=dataset_mock)
+
+    # when
+    prep_corpus = preprocess_corpus(PATH_TO_DATASET_STUB, DEFAULT_PREP_CONFIG, approx_vocab=True, suppress_caching=True)
+
+    # then
+    stages_mock.run_until_vocab.assert_called_with(dataset_mock, None, approximate=True)
+    assert dataset_mock.path_to_approx_vocab_file == prep_corpus.path_to_vocab
+
+
 @mock.patch('codeprep.api.corpus.Dataset', autospec=True)
 @mock.patch('codeprep.api.corpus.stages', autospec=True)
 def test_output(stages_mock, dataset_mock):
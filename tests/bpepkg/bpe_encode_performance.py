@@ -0,0 +1,75 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import random
+import sys
+
+import time
+from typing import List
+
+from codeprep.bpepkg.bpe_encode import merge_subwords, to_char_list
+from codeprep.bpepkg.merge import MergeList, read_merges
+from codeprep.config import DEFAULT_BPE_DIR
+
+
+def merge_subwords_by_rounds(subwords: List[str], merges: MergeList) -> List[str]:
+    """
+    The round-based algorithm `bpe_encode.encode` used before: all the adjacent pairs are rescanned on each merge round.
+    """
+    while True:
+        merge_indices = []
+        merge_candidate_priority = sys.maxsize
+        for i in range(len(subwords) - 1):
+            merge_candidate = (subwords[i], subwords[i + 1])
+            if merge_candidate in merges:
+                current_merge_candidate_priority = merges.get_priority(merge_candidate)
+                if current_merge_candidate_priority < merge_candidate_priority:
+                    merge_candidate_priority = current_merge_candidate_priority
+                    merge_indices = [i]
+                elif current_merge_candidate_priority == merge_candidate_priority:
+                    if not merge_indices or merge_indices[-1] != i - 1:
+                        merge_indices.append(i)
+
+        if not merge_indices:
+            return subwords
+
+        subwords_after_this_merge_round = []
+        start_idx = 0
+        for merge_index in merge_indices:
+            subwords_after_this_merge_round.extend(subwords[start_idx:merge_index])
+            subwords_after_this_merge_round.append(subwords[merge_index] + subwords[merge_index + 1])
+            start_idx = merge_index + 2
+        subwords_after_this_merge_round.extend(subwords[start_idx:])
+        subwords = subwords_after_this_merge_round
+
+
+def gen_performance_test_cases():
+    random.seed(42)
+    for length in [100, 1000, 5000, 20000]:
+        yield f'random text * {length}', ''.join(random.choice('abcdefghijklmnopqrstuvwxyz_') for _ in range(length)) + '@'
+        yield f'a * {length}', 'a' * length + '@'
+        yield f'base64-like * {length}', ('QmFzZTY0IGJsb2I/' * (length // 16 + 1))[:length] + '@'
+        yield f'minified js * {length}', ('function(a,b){return a+b};var x=' * (length // 32 + 1))[:length] + '@'
+
+
+def measure(func, subwords: List[str], merges: MergeList):
+    start = time.perf_counter()
+    result = func(subwords, merges)
+    return result, time.perf_counter() - start
+
+
+def test_performance():
+    merges = read_merges(os.path.join(DEFAULT_BPE_DIR, '10k', 'merges.txt'))
+    print(f'{"input":<28}{"rounds (s)":>12}{"heap (s)":>12}{"speedup":>10}')
+    for name, word in gen_performance_test_cases():
+        subwords = to_char_list(word)
+        expected, time_by_rounds = measure(merge_subwords_by_rounds, subwords, merges)
+        actual, time_heap = measure(merge_subwords, subwords, merges)
+        assert expected == actual
+        print(f'{name:<28}{time_by_rounds:>12.4f}{time_heap:>12.4f}{time_by_rounds / time_heap:>9.1f}x')
+
+
+if __name__ == '__main__':
+    test_performance()
@@ -0,0 +1,65 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import pickle
+import random
+from typing import Dict
+
+from codeprep.bpepkg.bpe_learn import do_merges, do_merges_indexed, SplitVocab, do_merges_parallel, \
+    continue_merges, Checkpoint
+from codeprep.bpepkg.merge import MergeList
+
+
+def generate_vocab(rnd: random.Random) -> Dict[str, int]:
+    alphabet = rnd.choice(['ab', 'abc', 'ab@', 'abcdef'])
+    vocab = {}
+    for _ in range(rnd.randint(1, 30)):
+        word = ''.join(rnd.choice(alphabet) for _ in range(rnd.randint(1, 12)))
+        vocab[' '.join(word) + ' @'] = rnd.randint(1, 5)
+    return vocab
+
+
+def test_do_merges_indexed_same_as_do_merges():
+    rnd = random.Random(17)
+    for _ in range(50):
+        vocab = generate_vocab(rnd)
+        n_merges = rnd.randint(1, 40)
+
+        expected_vocab, expected_merges = do_merges(dict(vocab), n_merges)
+        actual_vocab, actual_merges = do_merges_indexed(SplitVocab.from_dict(vocab), n_merges)
+
+        assert list(expected_vocab.items()) == list(actual_vocab.to_dict().items())
+        assert expected_merges == actual_merges
+
+
+def test_do_merges_parallel_same_as_do_merges_indexed():
+    rnd = random.Random(29)
+    for _ in range(10):
+        vocab = generate_vocab(rnd)
+        n_merges = rnd.randint(1, 40)
+
+        expected_vocab, expected_merges = do_merges_indexed(SplitVocab.from_dict(vocab), n_merges)
+        actual_vocab, actual_merges = do_merges_parallel(SplitVocab.from_dict(vocab), n_merges, rnd.randint(2, 4))
+
+        assert list(expected_vocab.to_dict().items()) == list(actual_vocab.to_dict().items())
+        assert expected_merges == actual_merges
+
+
+def test_continue_merges_from_pickled_checkpoint():
+    rnd = random.Random(41)
+    for _ in range(20):
+        vocab = generate_vocab(rnd)
+        n_merges = rnd.randint(1, 40)
+        n_workers = rnd.randint(1, 3)
+
+        expected_vocab, expected_merges = do_merges_indexed(SplitVocab.from_dict(vocab), n_merges)
+
+        checkpoints = []
+        continue_merges(Checkpoint(SplitVocab.from_dict(vocab), MergeList()), n_merges, n_workers,
+                        save_checkpoint=lambda c: checkpoints.append(pickle.dumps(c)), checkpoint_every_seconds=0)
+        for checkpoint in checkpoints:
+            actual_vocab, actual_merges = continue_merges(pickle.loads(checkpoint), n_merges, n_workers)
+
+            assert list(expected_vocab.to_dict().items()) == list(actual_vocab.to_dict().items())
+            assert expected_merges == actual_merges
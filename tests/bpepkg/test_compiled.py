@@ -0,0 +1,54 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+
+from codeprep.bpepkg.cache import dump_bpe_cache
+from codeprep.bpepkg.compiled import load_merges, load_bpe_cache, get_compiled_path, CompiledBpeCache
+from codeprep.bpepkg.merge import MergeList, Merge, dump_merges
+
+
+def test_load_merges_compiles_once(tmp_path):
+    merges_file = str(tmp_path / 'merges.txt')
+    merges = MergeList().append(Merge(('a', 'b'), 67)).append(Merge(('ab', 'c'), 34)).append(Merge(('x', 'y'), 3))
+    dump_merges(merges, merges_file)
+
+    assert merges == load_merges(merges_file)
+    assert os.path.exists(get_compiled_path(merges_file))
+    assert merges[:2] == load_merges(merges_file, 2)[:]
+
+
+def test_load_merges_recompiles_outdated(tmp_path):
+    merges_file = str(tmp_path / 'merges.txt')
+    dump_merges(MergeList().append(Merge(('a', 'b'), 67)), merges_file)
+    load_merges(merges_file)
+
+    new_merges = MergeList().append(Merge(('c', 'd'), 5))
+    dump_merges(new_merges, merges_file)
+    compiled_file = get_compiled_path(merges_file)
+    os.utime(compiled_file, (0, 0))
+
+    assert new_merges == load_merges(merges_file)
+
+
+def test_load_bpe_cache_falls_back_to_text_when_compiled_file_cannot_be_written(tmp_path):
+    cache_file = str(tmp_path / 'merges_cache.txt')
+    cache = {'ab': ['a', 'b'], 'abc': ['ab', 'c']}
+    dump_bpe_cache(cache, cache_file)
+
+    # a regular file cannot be a parent directory of the compiled file
+    actual = load_bpe_cache(cache_file, compiled_file=os.path.join(cache_file, 'merges_cache.txt.bin'))
+
+    assert not isinstance(actual, CompiledBpeCache)
+    assert cache == actual
+
+
+def test_load_bpe_cache_recompiles_corrupted(tmp_path):
+    cache_file = str(tmp_path / 'merges_cache.txt')
+    cache = {'ab': ['a', 'b']}
+    dump_bpe_cache(cache, cache_file)
+    with open(get_compiled_path(cache_file), 'wb') as f:
+        f.write(b'corrupted')
+
+    assert cache == dict(load_bpe_cache(cache_file))
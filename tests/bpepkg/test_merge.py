@@ -45,4 +45,16 @@ def test_dump_merges(file_handle_mock):
     file_handle_mock.write.assert_has_calls([
         mock.call('a b 67\n'),
         mock.call('b c 34\n')
-    ])
\ No newline at end of file
+    ])
+
+
+def test_add_does_not_modify_operands():
+    first = MergeList().append(Merge(('a', 'b'), 67, 0)).append(Merge(('b', 'c'), 34, 1))
+    second = MergeList().append(Merge(('ab', 'c'), 20, 0))
+
+    actual = first + second
+
+    assert MergeList().append(Merge(('a', 'b'), 67, 0)).append(Merge(('b', 'c'), 34, 1)) == first
+    assert MergeList().append(Merge(('ab', 'c'), 20, 0)) == second
+    assert [Merge(('a', 'b'), 67, 0), Merge(('b', 'c'), 34, 1), Merge(('ab', 'c'), 20, 2)] == actual[:]
+    assert 2 == actual.get_priority(('ab', 'c'))
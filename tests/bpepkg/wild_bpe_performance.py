@@ -23,6 +23,8 @@ def plotting_function(data_size_mb: float, entropy: int, version: str,
                       final_show: bool = True):
     merges_done = list(map(lambda p: p.merges_done, performance_stats))
     n_pq_entries = list(map(lambda p: p.n_priority_queue_entries, performance_stats))
+    n_live_pq_entries = list(map(lambda p: p.n_live_priority_queue_entries, performance_stats))
+    n_removed_pq_entries = list(map(lambda p: p.n_removed_priority_queue_entries, performance_stats))
     n_index_entries = list(map(lambda p: p.n_index_entries, performance_stats))
     location_index_obj_size = list(map(lambda p: p.location_index_obj_size, performance_stats))
     neighbour_index_obj_size = list(map(lambda p: p.neighbour_index_obj_size, performance_stats))
@@ -34,6 +36,8 @@ def plotting_function(data_size_mb: float, entropy: int, version: str,
     import matplotlib.pyplot as plt
     fig, splots = plt.subplots(nrows=3)
     splots[0].plot(merges_done, n_pq_entries, label='priority counter')
+    splots[0].plot(merges_done, n_live_pq_entries, label='priority counter (live)')
+    splots[0].plot(merges_done, n_removed_pq_entries, label='priority counter (removed)')
     splots[0].plot(merges_done, n_index_entries, label='indices')
     splots[0].set(ylabel='entries',
                   title=f'Wild BPE version {version}, Data size: {data_size_mb} MB, entropy: {entropy} bit')
@@ -11,6 +11,7 @@ from docopt import DocoptExit
 
 from codeprep.bpepkg.bpe_config import BpeConfig, BpeParam
 from codeprep.cli.spec import parse_and_run
+from codeprep.config import BPE_CHECKPOINT_EVERY_SECONDS
 from codeprep.prepconfig import PrepParam, PrepConfig
 
 
@@ -448,7 +449,7 @@ def test_path(api_mock):
         PrepParam.CASE: 'u'
     })
     api_mock.corpus.preprocess_corpus.assert_called_with(PATH_TO_DATASET_STUB, prep_config, None, calc_vocab=False,
-                                                         extensions=None, output_path=None)
+                                                         approx_vocab=False, extensions=None, output_path=None)
 
 
 @mock.patch('codeprep.cli.impl.codeprep.api', autospec=True)
@@ -464,7 +465,7 @@ def test_path_short(api_mock):
         PrepParam.CASE: 'u'
     })
     api_mock.corpus.preprocess_corpus.assert_called_with(PATH_TO_DATASET_STUB, prep_config, None, calc_vocab=False,
-                                                         extensions=None, output_path=None)
+                                                         approx_vocab=False, extensions=None, output_path=None)
 
 
 @mock.patch('codeprep.cli.impl.codeprep.api', autospec=True)
@@ -480,7 +481,7 @@ def test_output_and_vocab(api_mock):
         PrepParam.CASE: 'u'
     })
     api_mock.corpus.preprocess_corpus.assert_called_with(PATH_TO_DATASET_STUB, prep_config, None,
-                                                         calc_vocab=True, extensions=None,
+                                                         calc_vocab=True, approx_vocab=False, extensions=None,
                                                          output_path=PATH_TO_OUTPUT_STUB)
 
 
@@ -497,10 +498,33 @@ def test_output_and_vocab_short(api_mock):
         PrepParam.CASE: 'u'
     })
     api_mock.corpus.preprocess_corpus.assert_called_with(PATH_TO_DATASET_STUB, prep_config, None,
-                                                         calc_vocab=True, extensions=None,
+                                                         calc_vocab=True, approx_vocab=False, extensions=None,
                                                          output_path=PATH_TO_OUTPUT_STUB)
 
 
+@mock.patch('codeprep.cli.impl.codeprep.api', autospec=True)
+def test_output_and_approx_vocab(api_mock):
+    argv = ['nosplit', '--path', PATH_TO_DATASET_STUB, '-o', PATH_TO_OUTPUT_STUB, '--no-spaces', '--approx-vocab']
+    parse_and_run(argv)
+    prep_config = PrepConfig({
+        PrepParam.EN_ONLY: 'u',
+        PrepParam.COM: 'c',
+        PrepParam.STR: '1',
+        PrepParam.SPLIT: '0',
+        PrepParam.TABS_NEWLINES: '0',
+        PrepParam.CASE: 'u'
+    })
+    api_mock.corpus.preprocess_corpus.assert_called_with(PATH_TO_DATASET_STUB, prep_config, None,
+                                                         calc_vocab=False, approx_vocab=True, extensions=None,
+                                                         output_path=PATH_TO_OUTPUT_STUB)
+
+
+def test_calc_vocab_and_approx_vocab():
+    argv = ['nosplit', '--path', PATH_TO_DATASET_STUB, '--calc-vocab', '--approx-vocab']
+    with pytest.raises(DocoptExit):
+        parse_and_run(argv)
+
+
 def test_output_with_text():
     argv = ['nosplit', 'str', '-o', PATH_TO_OUTPUT_STUB, '--no-spaces']
     with pytest.raises(DocoptExit) as context:
@@ -551,7 +575,8 @@ def test_yes_false_java_yes(abspath_mock, bpe_learner_mock, dataset_mock):
         BpeParam.UNICODE: 'yes',
     })
     dataset_mock.create.assert_called_with(PATH_TO_DATASET_STUB, prep_config, 'java', None, bpe_config)
-    bpe_learner_mock.run.assert_called_with(dataset_mock, 1000, bpe_config)
+    bpe_learner_mock.run.assert_called_with(dataset_mock, [1000], bpe_config, n_workers=1,
+                                            checkpoint_every_seconds=BPE_CHECKPOINT_EVERY_SECONDS)
 
 
 @mock.patch('codeprep.cli.impl.Dataset', autospec=True)
@@ -583,7 +608,8 @@ def test_no_true_code_no(abspath_mock, bpe_learner_mock, dataset_mock):
         BpeParam.UNICODE: 'no',
     })
     dataset_mock.create.assert_called_with(PATH_TO_DATASET_STUB, prep_config, None, None, bpe_config)
-    bpe_learner_mock.run.assert_called_with(dataset_mock, 1000, bpe_config)
+    bpe_learner_mock.run.assert_called_with(dataset_mock, [1000], bpe_config, n_workers=1,
+                                            checkpoint_every_seconds=BPE_CHECKPOINT_EVERY_SECONDS)
 
 
 @mock.patch('codeprep.cli.impl.Dataset', autospec=True)
@@ -615,4 +641,77 @@ def test_true_true_code_bytes(abspath_mock, bpe_learner_mock, dataset_mock):
         BpeParam.UNICODE: 'bytes',
     })
     dataset_mock.create.assert_called_with(PATH_TO_DATASET_STUB, prep_config, None, None, bpe_config)
-    bpe_learner_mock.run.assert_called_with(dataset_mock, 1000, bpe_config)
\ No newline at end of file
+    bpe_learner_mock.run.assert_called_with(dataset_mock, [1000], bpe_config, n_workers=1,
+                                            checkpoint_every_seconds=BPE_CHECKPOINT_EVERY_SECONDS)
+
+
+@mock.patch('codeprep.cli.impl.Dataset', autospec=True)
+@mock.patch('codeprep.cli.impl.bpelearner', autospec=True)
+@mock.patch('codeprep.pipeline.dataset.os.path.abspath', autospec=True)
+def test_learn_bpe_workers(abspath_mock, bpe_learner_mock, dataset_mock):
+
+    # given
+    abspath_mock.return_value = PATH_TO_DATASET_STUB
+    dataset_mock.create = Mock(spec=dataset_mock, return_value=dataset_mock)
+    argv = ['learn-bpe', '1000', '-p', PATH_TO_DATASET_STUB, '--workers', '8']
+
+    # when
+    parse_and_run(argv)
+
+    # then
+    bpe_config = BpeConfig({
+        BpeParam.CASE: 'yes',
+        BpeParam.WORD_END: False,
+        BpeParam.BASE: 'code',
+        BpeParam.UNICODE: 'yes',
+    })
+    bpe_learner_mock.run.assert_called_with(dataset_mock, [1000], bpe_config, n_workers=8,
+                                            checkpoint_every_seconds=BPE_CHECKPOINT_EVERY_SECONDS)
+
+
+@mock.patch('codeprep.cli.impl.Dataset', autospec=True)
+@mock.patch('codeprep.cli.impl.bpelearner', autospec=True)
+@mock.patch('codeprep.pipeline.dataset.os.path.abspath', autospec=True)
+def test_learn_bpe_checkpoint_every(abspath_mock, bpe_learner_mock, dataset_mock):
+
+    # given
+    abspath_mock.return_value = PATH_TO_DATASET_STUB
+    dataset_mock.create = Mock(spec=dataset_mock, return_value=dataset_mock)
+    argv = ['learn-bpe', '1000', '-p', PATH_TO_DATASET_STUB, '--checkpoint-every', '0']
+
+    # when
+    parse_and_run(argv)
+
+    # then
+    bpe_config = BpeConfig({
+        BpeParam.CASE: 'yes',
+        BpeParam.WORD_END: False,
+        BpeParam.BASE: 'code',
+        BpeParam.UNICODE: 'yes',
+    })
+    bpe_learner_mock.run.assert_called_with(dataset_mock, [1000], bpe_config, n_workers=1,
+                                            checkpoint_every_seconds=0)
+
+
+@mock.patch('codeprep.cli.impl.Dataset', autospec=True)
+@mock.patch('codeprep.cli.impl.bpelearner', autospec=True)
+@mock.patch('codeprep.pipeline.dataset.os.path.abspath', autospec=True)
+def test_learn_bpe_several_n_merges(abspath_mock, bpe_learner_mock, dataset_mock):
+
+    # given
+    abspath_mock.return_value = PATH_TO_DATASET_STUB
+    dataset_mock.create = Mock(spec=dataset_mock, return_value=dataset_mock)
+    argv = ['learn-bpe', '5000', '1000', '10000', '-p', PATH_TO_DATASET_STUB]
+
+    # when
+    parse_and_run(argv)
+
+    # then
+    bpe_config = BpeConfig({
+        BpeParam.CASE: 'yes',
+        BpeParam.WORD_END: False,
+        BpeParam.BASE: 'code',
+        BpeParam.UNICODE: 'yes',
+    })
+    bpe_learner_mock.run.assert_called_with(dataset_mock, [5000, 1000, 10000], bpe_config, n_workers=1,
+                                            checkpoint_every_seconds=BPE_CHECKPOINT_EVERY_SECONDS)
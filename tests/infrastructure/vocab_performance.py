@@ -0,0 +1,63 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+from collections import Counter
+from typing import Tuple
+from unittest import mock
+
+from codeprep.pipeline import vocab
+from codeprep.pipeline.vocab import PartialVocab, PARTVOCAB_EXT, dump_partial_vocab, calc_vocab, \
+    get_partial_vocabs_dir, init_partial_vocabs_dir, set_partial_vocabs_ready
+
+
+def dump_partial_vocabs(n_partial_vocabs: int, path_to_dump: str) -> None:
+    rnd = random.Random(11)
+    words = [''.join(rnd.choice('abcdefghij') for _ in range(rnd.randint(1, 7))) for _ in range(50000)]
+    init_partial_vocabs_dir(path_to_dump)
+    for i in range(n_partial_vocabs):
+        partial_vocab = PartialVocab(Counter(rnd.choice(words) for _ in range(rnd.randint(1, 300))))
+        dump_partial_vocab(partial_vocab, os.path.join(path_to_dump, f'{partial_vocab.id}.{PARTVOCAB_EXT}'))
+    set_partial_vocabs_ready(path_to_dump)
+
+
+def measure_calc_vocab(n_partial_vocabs: int) -> Tuple[float, float]:
+    """
+    Measures the startup of `calc_vocab` on the partial vocabs saved by a previous run, i.e. the time
+    until the merging starts, and the time the rest of `calc_vocab` takes.
+    """
+    output_dir = tempfile.mkdtemp()
+    try:
+        dump_partial_vocabs(n_partial_vocabs, get_partial_vocabs_dir(output_dir))
+
+        merging_start_times = []
+        merge_partial_vocabs = vocab.merge_partial_vocabs
+
+        def merge_partial_vocabs_timed(*args, **kwargs):
+            merging_start_times.append(time.perf_counter())
+            return merge_partial_vocabs(*args, **kwargs)
+
+        with mock.patch('codeprep.pipeline.vocab.merge_partial_vocabs', side_effect=merge_partial_vocabs_timed):
+            start = time.perf_counter()
+            calc_vocab(output_dir, iter([]), output_dir)
+            end = time.perf_counter()
+        return merging_start_times[0] - start, end - merging_start_times[0]
+    finally:
+        shutil.rmtree(output_dir)
+
+
+def test_performance():
+    print(f'{"partial vocabs":<16}{"processes":<16}{"startup (s)":>12}{"merging (s)":>12}')
+    for n_partial_vocabs in [500, 5000]:
+        startup_time, merging_time = measure_calc_vocab(n_partial_vocabs)
+        print(f'{n_partial_vocabs:<16}{multiprocessing.cpu_count():<16}{startup_time:>12.4f}{merging_time:>12.4f}')
+
+
+if __name__ == '__main__':
+    test_performance()
@@ -0,0 +1,118 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import time
+from typing import List, Tuple
+
+from pygments import lex
+from pygments.lexers.jvm import JavaLexer
+from pygments.lexers.python import PythonLexer
+
+from codeprep.fileutils import read_file_contents
+from codeprep.parse import core
+from codeprep.parse.core import matchers, get_lexer, DefaultMatcher
+from codeprep.parse.scanners import JavaScanner, PythonScanner
+from codeprep.tokens.rootclasses import ParsedToken
+
+PATH_TO_PROJECT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+PATH_TO_TEST_CORPUS = os.path.join(PATH_TO_PROJECT, 'test-data', 'test-corpus')
+PATH_TO_PYTHON_SOURCES = os.path.join(PATH_TO_PROJECT, 'codeprep')
+
+
+def find_matcher_by_walking_matchers(token, value: str):
+    """
+    The dispatch `core._convert` did before: the list of matchers is walked for every token.
+    """
+    for matcher in matchers:
+        if matcher.match(token, value):
+            return matcher
+
+    if DefaultMatcher().match(token, value):
+        return DefaultMatcher()
+
+    assert False
+
+
+def convert_by_walking_matchers(token, value: str) -> List[ParsedToken]:
+    return find_matcher_by_walking_matchers(token, value).transform(value)
+
+
+def read_test_corpus(path: str = PATH_TO_TEST_CORPUS, extension: str = '') -> List[Tuple[str, str]]:
+    texts = []
+    for root, dirs, files in os.walk(path):
+        for file in sorted(files):
+            if not file.endswith(extension):
+                continue
+            path = os.path.join(root, file).encode()
+            lines, _ = read_file_contents(path)
+            texts.append(("\n".join(lines), os.path.splitext(file)[1][1:]))
+    return texts
+
+
+def measure_dispatch(find_matcher, lexed_texts) -> float:
+    start = time.perf_counter()
+    for lexed_text in lexed_texts:
+        for token, value in lexed_text:
+            find_matcher(token, value)
+    return time.perf_counter() - start
+
+
+def measure(convert, lexed_texts) -> Tuple[List[ParsedToken], float]:
+    start = time.perf_counter()
+    parsed = [t for lexed_text in lexed_texts for token, value in lexed_text for t in convert(token, value)]
+    return parsed, time.perf_counter() - start
+
+
+def measure_lexing(lexer, texts: List[str]) -> Tuple[int, float]:
+    start = time.perf_counter()
+    n_tokens = sum(1 for text in texts for _ in lex(text, lexer))
+    return n_tokens, time.perf_counter() - start
+
+
+def test_lexing_performance():
+    n_repetitions = 5
+    print(f'{"files":<32}{"lexer":<16}{"tokens":>10}{"time (s)":>12}{"tokens/s":>12}')
+    for name, path, extension, lexer, scanner in [
+        ('test corpus (java)', PATH_TO_TEST_CORPUS, '.java', JavaLexer(), JavaScanner()),
+        ('codeprep sources (python)', PATH_TO_PYTHON_SOURCES, '.py', PythonLexer(), PythonScanner())
+    ]:
+        texts = [text for text, _ in read_test_corpus(path, extension)]
+        # the combined regexes of the scanner are compiled on the first use
+        measure_lexing(scanner, texts[:1])
+        for lexer_name, lex_with in [('pygments', lexer), ('scanner', scanner)]:
+            n_tokens, total_time = 0, 0.0
+            for _ in range(n_repetitions):
+                n_tokens, elapsed = measure_lexing(lex_with, texts)
+                total_time += elapsed
+            print(f'{name:<32}{lexer_name:<16}{n_tokens:>10}{total_time:>12.4f}'
+                  f'{n_tokens * n_repetitions / total_time:>12.0f}')
+
+
+def test_performance():
+    texts = read_test_corpus()
+    lexed_texts = [list(lex(text, get_lexer(text, extension))) for text, extension in texts]
+    n_tokens = sum(len(lexed_text) for lexed_text in lexed_texts)
+    n_repetitions = 5
+
+    print(f'Files: {len(texts)}, pygments tokens: {n_tokens}')
+    print(f'{"dispatch":<24}{"dispatch (s)":>14}{"parsing (s)":>14}{"tokens/s":>16}')
+    results = []
+    for name, find_matcher, convert in [
+        ('walking matchers', find_matcher_by_walking_matchers, convert_by_walking_matchers),
+        ('memoized', core.get_matcher, core._convert)
+    ]:
+        dispatch_time = sum(measure_dispatch(find_matcher, lexed_texts) for _ in range(n_repetitions))
+        parsed, total_time = None, 0.0
+        for _ in range(n_repetitions):
+            parsed, elapsed = measure(convert, lexed_texts)
+            total_time += elapsed
+        results.append(parsed)
+        print(f'{name:<24}{dispatch_time:>14.4f}{total_time:>14.4f}{n_tokens * n_repetitions / total_time:>16.0f}')
+    assert results[0] == results[1]
+
+
+if __name__ == '__main__':
+    test_lexing_performance()
+    test_performance()
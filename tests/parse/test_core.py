@@ -2,7 +2,12 @@
 #
 # SPDX-License-Identifier: Apache-2.0
 
-from codeprep.parse.core import convert_text
+from unittest import mock
+
+from pygments.lexers import guess_lexer
+from pygments.token import Token
+
+from codeprep.parse.core import convert_text, LexerCache, get_matcher, _find_matcher
 from codeprep.tokens.containers import SplitContainer, StringLiteral, OneLineComment, MultilineComment
 from codeprep.tokens.numeric import Number
 from codeprep.tokens.whitespace import Tab, NewLine, SpaceInString
@@ -423,4 +428,49 @@ def test_string_literal_double():
 
     actual = [t for t in convert_text(text, 'py')]
 
-    assert expected_result == actual
\ No newline at end of file
+    assert expected_result == actual
+
+
+@mock.patch('codeprep.parse.core.guess_lexer', autospec=True, side_effect=guess_lexer)
+def test_lexer_guessed_once_per_unknown_extension(guess_lexer_mock):
+    texts = ['#!/usr/bin/env python\nx = 1', 'y = 2', 'def f(): pass']
+    cache = LexerCache()
+
+    lexers = [cache.get_lexer('unknownext', text) for text in texts]
+
+    assert 1 == guess_lexer_mock.call_count
+    assert all(lexer is lexers[0] for lexer in lexers)
+    assert 2 == cache.stats().guesses_avoided
+
+    cache_with_table = LexerCache(cache.resolution_table)
+    guess_lexer_mock.reset_mock()
+
+    lexers = [cache_with_table.get_lexer('unknownext', text) for text in texts]
+
+    assert 0 == guess_lexer_mock.call_count
+    assert ['Python'] * 3 == [lexer.name for lexer in lexers]
+    assert 3 == cache_with_table.stats().guesses_avoided
+
+
+@mock.patch('codeprep.parse.core.guess_lexer', autospec=True, side_effect=guess_lexer)
+def test_lexer_guessed_if_resolved_lexer_not_found(guess_lexer_mock):
+    cache = LexerCache({'unknownext': 'NoSuchLexer'})
+
+    lexer = cache.get_lexer('unknownext', '#!/usr/bin/env python\nx = 1')
+
+    assert 1 == guess_lexer_mock.call_count
+    assert 'Python' == lexer.name
+    assert {'unknownext': 'Python'} == cache.resolution_table
+    assert 1 == cache.stats().guesses
+
+
+def test_memoized_matcher_same_as_first_matching():
+    token_types = [Token.Text, Token.Name, Token.Name.Class, Token.Literal.String, Token.Literal.Number.Hex,
+                   Token.Comment.Single, Token.Comment.Multiline, Token.Operator, Token.Punctuation, Token.Keyword,
+                   Token.Error]
+    values = ['\n', '\t', '    ', '', 'a', '\n\n', ' a', '0x1F', '//']
+
+    for _ in range(2):
+        for token in token_types:
+            for value in values:
+                assert _find_matcher(token, value) is get_matcher(token, value), (token, value)
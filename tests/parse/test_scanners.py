@@ -0,0 +1,88 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import re
+from unittest import mock
+
+import pytest
+from pygments import lex
+from pygments.lexers.jvm import JavaLexer
+from pygments.lexers.python import PythonLexer
+from pygments.token import Text
+
+from codeprep.fileutils import read_file_contents
+from codeprep.parse.core import _convert
+from codeprep.parse.scanners import JavaScanner, PythonScanner, combine_rules, get_scanner
+
+PATH_TO_PROJECT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+PATH_TO_TEST_CORPUS = os.path.join(PATH_TO_PROJECT, 'test-data', 'test-corpus')
+PATH_TO_PYTHON_SOURCES = os.path.join(PATH_TO_PROJECT, 'codeprep')
+
+JAVA_SNIPPETS = [
+    'public static <T> List<T> of(T... a) throws Exception {\n  return new ArrayList<>();\n}',
+    'String s = "unterminated;\nchar c = \'\\u00e9\';\n/* unterminated comment',
+    'import static java.util.Collections.*;\npackage\ncom.example;\nint x = Foo.class.hashCode();',
+    'label:\n  for (;;) { break label; }\n#define X \\ `\u00e9t\u00e9` \u0663\u00a0;',
+    'void\nfoo\n  (int a) {}\nint[] a = {0x1.8p1, 0b1010L, 017, 1_000_000, .5e-3f};',
+    'var\nx = 1; class\n{ }\r\nenum E { A, B }\r',
+]
+
+PYTHON_SNIPPETS = [
+    'def f(a, *args, **kwargs):\n    """Doc\n    string"""\n    return f\'{a!r:>10} {{x}} {args[0]}\'\n',
+    'from . import x as y, z\nfrom None import\nimport a.b as c\nraise E from None\n',
+    "s = rb'\\x00' + u'%(name)s %d {0.x[1]!s:^10}' + r'\\' + '''multi\nline''' + 'unterminated\n",
+    'class\\\n  A(object): pass\n@decorator\ndef __init__(self): return self.__dict__ @ m\n',
+    'x = 0o17 + 0b1_01 + 0xFF + 1_000.5e-3j + .5 + 1.\nif a is not b and c in d or not e: ...\n',
+    'print(f"{x:{width}}" f\'\'\'{y\n}\'\'\' Rf"{z}\\n")\n\u00e9l\u00e8ve = "\u00e9" # comment\n\t$ ? !',
+]
+
+
+def read_sources(path: str, extension: str):
+    for root, dirs, files in os.walk(path):
+        for file in sorted(files):
+            if file.endswith(extension):
+                lines, _ = read_file_contents(os.path.join(root, file).encode())
+                yield file, "\n".join(lines)
+
+
+def parse(text, lexer):
+    return [parsed_token for token, value in lex(text, lexer) for parsed_token in _convert(token, value)]
+
+
+def assert_same_as_pygments(texts, lexer, scanner):
+    n_texts = 0
+    for name, text in texts:
+        assert list(lex(text, lexer)) == list(lex(text, scanner)), name
+        assert parse(text, lexer) == parse(text, scanner), name
+        n_texts += 1
+    assert n_texts > 0
+
+
+def test_java_scanner_same_as_pygments_on_test_corpus():
+    assert_same_as_pygments(read_sources(PATH_TO_TEST_CORPUS, '.java'), JavaLexer(), JavaScanner())
+
+
+def test_python_scanner_same_as_pygments_on_project_sources():
+    assert_same_as_pygments(read_sources(PATH_TO_PYTHON_SOURCES, '.py'), PythonLexer(), PythonScanner())
+
+
+def test_scanners_same_as_pygments_on_edge_cases():
+    assert_same_as_pygments(enumerate(JAVA_SNIPPETS), JavaLexer(), JavaScanner())
+    assert_same_as_pygments(enumerate(PYTHON_SNIPPETS), PythonLexer(), PythonScanner())
+
+
+def test_rules_with_group_references_cannot_be_combined():
+    for pattern in [r'(a)|(b)\2', r'(?:(a)|b)(?(1)c)', r'(?P<q>a)(?P=q)']:
+        with pytest.raises(ValueError):
+            combine_rules([(re.compile(pattern).match, Text, None)], 0)
+
+
+@mock.patch.object(JavaScanner, '_scanner_states', None)
+@mock.patch('codeprep.parse.scanners.combine_rules', autospec=True, side_effect=ValueError)
+def test_lexer_returned_if_rules_cannot_be_combined(combine_rules_mock):
+    lexer = JavaLexer()
+
+    assert lexer is get_scanner(lexer)
+    assert combine_rules_mock.called
@@ -0,0 +1,64 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import random
+from collections import Counter
+
+from codeprep.pipeline.approxvocab import calc_approximate_vocab, ApproximateVocab
+from codeprep.pipeline.vocab import VOCAB_FILENAME, VOCABSIZE_FILENAME
+
+
+def generate_word_counts(rnd: random.Random, n_words: int) -> Counter:
+    # a few frequent words and a long tail
+    return Counter(f'w{int(rnd.paretovariate(1.0))}' for _ in range(n_words))
+
+
+def test_merged_approximate_vocabs_keep_heavy_hitters():
+    rnd = random.Random(3)
+    expected = Counter()
+    vocab = ApproximateVocab(max_words=20, epsilon=0.001, delta=0.01)
+    for _ in range(5):
+        partial_vocab = ApproximateVocab(max_words=20, epsilon=0.001, delta=0.01)
+        for _ in range(10):
+            word_counts = generate_word_counts(rnd, 200)
+            expected.update(word_counts)
+            partial_vocab.add_word_counts(word_counts, 1)
+        vocab.add_vocab(partial_vocab)
+
+    total = sum(expected.values())
+    assert total == vocab.n_words
+    assert 50 == vocab.n_files
+    estimates = dict(vocab.word_estimates())
+    for word, count in expected.items():
+        if count > total / 20:
+            assert expected[word] <= estimates[word] <= expected[word] + 0.001 * total
+
+
+def test_calc_approximate_vocab(tmpdir):
+    rnd = random.Random(11)
+    corpus_dir = os.path.join(str(tmpdir), 'corpus')
+    os.makedirs(corpus_dir)
+    expected = Counter()
+    for i in range(30):
+        word_counts = generate_word_counts(rnd, rnd.randint(1, 300))
+        expected.update(word_counts)
+        with open(os.path.join(corpus_dir, f'{i}.txt'), 'w') as f:
+            f.write(' '.join(word_counts.elements()) + '\n')
+    files = [os.path.join(corpus_dir, file).encode() for file in sorted(os.listdir(corpus_dir))]
+    output_dir = os.path.join(str(tmpdir), 'vocab')
+
+    calc_approximate_vocab(corpus_dir, iter(files), output_dir, max_words=10, epsilon=0.001, delta=0.01)
+
+    with open(os.path.join(output_dir, VOCAB_FILENAME)) as f:
+        vocab = [line.rstrip('\n').split('\t') for line in f]
+    with open(os.path.join(output_dir, VOCABSIZE_FILENAME)) as f:
+        vocab_size = int(f.readline())
+
+    assert len(vocab) == 10
+    freqs = [int(freq) for _, freq in vocab]
+    assert freqs == sorted(freqs, reverse=True)
+    for word, _ in expected.most_common(3):
+        assert word in dict(vocab)
+    assert abs(vocab_size - len(expected)) <= 0.05 * len(expected) + 2
@@ -0,0 +1,25 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+
+import pytest
+
+from codeprep.parse.core import convert_text
+from codeprep.pipeline.parse_projects import dump_parsed_file, load_parsed_file, PARSED_FILE_COMPRESS_LEVELS
+
+
+@pytest.mark.parametrize('codec', PARSED_FILE_COMPRESS_LEVELS.keys())
+def test_dump_and_load_parsed_file(tmpdir, codec):
+    parsed = list(convert_text('class A { /* comment */ String s = "getValue"; }', 'java'))
+    path = os.path.join(str(tmpdir), 'A.java.parsed').encode()
+
+    dump_parsed_file(parsed, path, codec)
+
+    assert parsed == load_parsed_file(path)
+
+
+def test_dump_parsed_file_unknown_codec(tmpdir):
+    with pytest.raises(ValueError):
+        dump_parsed_file([], os.path.join(str(tmpdir), 'A.java.parsed').encode(), 'lz4')
@@ -2,11 +2,14 @@
 #
 # SPDX-License-Identifier: Apache-2.0
 
+import gzip
+import pickle
 import time
 
 import pytest
 
 from codeprep.bpepkg.bpe_encode import BpeData
+from codeprep.bpepkg.cache import read_bpe_cache
 from codeprep.bpepkg.merge import MergeList, Merge
 from codeprep.tokens.containers import SplitContainer, OneLineComment, MultilineComment, StringLiteral
 from codeprep.preprocess.metadata import PreprocessingMetadata
@@ -16,7 +19,8 @@ from codeprep.preprocess.placeholders import placeholders
 from codeprep.tokens.whitespace import Tab, NewLine, SpaceInString
 from codeprep.tokens.word import Word, Underscore, NonCodeChar, Operator
 from codeprep.prepconfig import PrepParam, PrepConfig
-from codeprep.pipeline.to_repr import to_repr
+from codeprep.pipeline.to_repr import to_repr, preprocess_and_write, collect_bpe_words, preprocess_write_and_count
+from codeprep.pipeline.vocab import get_vocab, load_partial_vocab
 
 pl = placeholders
 cwe = placeholders['compound_word_end']
@@ -727,4 +731,72 @@ def test_bpe_string_literal_performance():
         merge_list.append(Merge(('a', 'a'), 10))
     start = time.perf_counter()
     to_repr(prep_config, tokens, BpeData(merges=merge_list, merges_cache={'Whi@@le@': ['Whi@@le@']}))
-    assert (time.perf_counter() - start) < 1
\ No newline at end of file
+    assert (time.perf_counter() - start) < 1
+
+
+def test_preprocess_and_write_saves_new_bpe_cache_entries(tmp_path):
+    prep_config = PrepConfig({
+        PrepParam.EN_ONLY: 'U',
+        PrepParam.COM: 'c',
+        PrepParam.STR: '1',
+        PrepParam.SPLIT: '4',
+        PrepParam.TABS_NEWLINES: 's',
+        PrepParam.CASE: 'u'
+    })
+    src_file, dest_file = tmp_path / 'file.parsed', tmp_path / 'prep' / 'file.prep'
+    with gzip.GzipFile(str(src_file), 'wb') as f:
+        pickle.dump([SplitContainer.from_single_token("While")], f)
+    part_bpe_cache_folder = tmp_path / 'merges_cache.txt_part'
+    part_bpe_cache_folder.mkdir()
+    bpe_data = BpeData(merges=MergeList().append(Merge(('W', 'h'), 10)), merges_cache={})
+    bpe_data.cache.keep_new_entries = True
+
+    preprocess_and_write((str(src_file).encode(), str(dest_file).encode(), prep_config, None,
+                          str(part_bpe_cache_folder)), bpe_data)
+
+    expected = {'While@': ['Wh', 'i', 'l', 'e', '@']}
+    assert [expected] == [read_bpe_cache(str(f)) for f in part_bpe_cache_folder.iterdir()]
+    assert {} == bpe_data.cache.pop_new_entries()
+
+
+def test_collect_bpe_words(tmp_path):
+    prep_config = PrepConfig({
+        PrepParam.EN_ONLY: 'U',
+        PrepParam.COM: 'c',
+        PrepParam.STR: '1',
+        PrepParam.SPLIT: '4',
+        PrepParam.TABS_NEWLINES: 's',
+        PrepParam.CASE: 'u'
+    })
+    src_file = tmp_path / 'file.parsed'
+    with gzip.GzipFile(str(src_file), 'wb') as f:
+        pickle.dump([SplitContainer.from_single_token("While"), Operator('+'), Number('12'),
+                     SplitContainer.from_single_token("while")], f)
+
+    assert {'While', 'while', '12'} == collect_bpe_words((str(src_file).encode(), prep_config))
+
+
+def test_preprocess_write_and_count_same_as_get_vocab(tmp_path):
+    prep_config = PrepConfig({
+        PrepParam.EN_ONLY: 'u',
+        PrepParam.COM: 'c',
+        PrepParam.STR: '1',
+        PrepParam.SPLIT: '1',
+        PrepParam.TABS_NEWLINES: 's',
+        PrepParam.CASE: 'u'
+    })
+    file_params = []
+    for i, token_list in enumerate([tokens, [SplitContainer.from_single_token("While"), Operator('+'), Tab()]]):
+        src_file, dest_file = tmp_path / f'{i}.parsed', tmp_path / 'prep' / f'{i}.prep'
+        with gzip.GzipFile(str(src_file), 'wb') as f:
+            pickle.dump(token_list, f)
+        file_params.append((str(src_file).encode(), str(dest_file).encode(), prep_config, None, None))
+    # preprocessed before, its words are read from the file
+    preprocess_and_write(file_params[1])
+    path_to_vocab_dump = tmp_path / 'part_vocab'
+    path_to_vocab_dump.mkdir()
+
+    assert 2 == preprocess_write_and_count((file_params, str(path_to_vocab_dump), 0))
+
+    partial_vocab, = [load_partial_vocab(str(f)) for f in path_to_vocab_dump.iterdir()]
+    assert get_vocab([dest for _, dest, _, _, _ in file_params]) == partial_vocab.merged_word_counts
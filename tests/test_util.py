@@ -0,0 +1,49 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import pickle
+import random
+
+from codeprep.util import PriorityCounter
+
+
+def test_priority_counter_compaction_does_not_change_order():
+    rnd = random.Random(7)
+    initial = {i: rnd.randint(1, 10) for i in range(50)}
+    compacting = PriorityCounter(initial)
+    compacting.MIN_REMOVED_TO_COMPACT = 0
+    non_compacting = PriorityCounter(initial)
+    non_compacting.MIN_REMOVED_TO_COMPACT = float('inf')
+
+    popped, expected_popped = [], []
+    for _ in range(2000):
+        if rnd.random() < 0.05:
+            popped.append(compacting.pop_pair())
+            expected_popped.append(non_compacting.pop_pair())
+        else:
+            key, to_add = rnd.randrange(60), rnd.randint(-3, 3)
+            compacting.add(key, to_add)
+            non_compacting.add(key, to_add)
+
+    assert len(compacting.pq) <= 2 * compacting.n_live_entries + 1
+    assert compacting.n_removed_entries == len(compacting.pq) - compacting.n_live_entries
+    assert non_compacting.n_removed_entries == len(non_compacting.pq) - non_compacting.n_live_entries
+    while non_compacting.n_live_entries:
+        popped.append(compacting.pop_pair())
+        expected_popped.append(non_compacting.pop_pair())
+    assert expected_popped == popped
+
+
+def test_pickled_priority_counter_breaks_ties_the_same_way():
+    counter = PriorityCounter({'a': 2, 'b': 1, 'c': 2})
+    counter.add('b', 1)
+
+    state = counter.__getstate__()
+    restored = pickle.loads(pickle.dumps(counter))
+    for c in [counter, restored]:
+        c.add('d', 2)
+        c.add('a', 0)
+
+    assert isinstance(state['counter'], int)
+    assert [counter.pop_pair() for _ in range(4)] == [restored.pop_pair() for _ in range(4)]
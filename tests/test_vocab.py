@@ -0,0 +1,104 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import random
+from collections import Counter
+
+from codeprep.pipeline.vocab import PartialVocab, merge_partial_vocabs, dump_partial_vocab, PARTVOCAB_EXT, \
+    calc_vocab, merge_partitions, VOCAB_FILENAME, VOCABSIZE_FILENAME
+
+
+def test_merge_partial_vocabs_in_several_processes_with_spilling(tmpdir):
+    rnd = random.Random(5)
+    expected = Counter()
+    partial_vocabs = []
+    for i in range(37):
+        word_counts = Counter(rnd.choice('abcdefghijklmnopqrstuvwxyz') * rnd.randint(1, 3)
+                              for _ in range(rnd.randint(1, 20)))
+        expected.update(word_counts)
+        partial_vocab = PartialVocab(word_counts)
+        if i % 2:
+            path = os.path.join(str(tmpdir), f'{partial_vocab.id}.{PARTVOCAB_EXT}')
+            dump_partial_vocab(partial_vocab, path)
+            partial_vocabs.append(path)
+        else:
+            partial_vocabs.append(partial_vocab)
+
+    vocab = merge_partial_vocabs(partial_vocabs, os.path.join(str(tmpdir), 'spilled'), n_processes=3,
+                                 max_words_in_memory=30)
+
+    assert expected == vocab.merged_word_counts
+    assert 37 == vocab.n_files
+    # 37 initial vocabs and 36 merged ones
+    assert 73 == vocab.stats.n_vocabs
+
+
+def test_calc_vocab_partitioned_same_as_not_partitioned(tmpdir):
+    rnd = random.Random(8)
+    corpus_dir = os.path.join(str(tmpdir), 'corpus')
+    os.makedirs(corpus_dir)
+    for i in range(25):
+        with open(os.path.join(corpus_dir, f'{i}.txt'), 'w') as f:
+            for _ in range(rnd.randint(1, 5)):
+                words = [rnd.choice('abcdefghij') * rnd.randint(1, 4) for _ in range(rnd.randint(1, 10))]
+                f.write(' '.join(words) + '\n')
+    files = [os.path.join(corpus_dir, file).encode() for file in sorted(os.listdir(corpus_dir))]
+
+    outputs = []
+    for n_partitions in [0, 3]:
+        output_dir = os.path.join(str(tmpdir), str(n_partitions))
+        os.makedirs(output_dir)
+        calc_vocab(corpus_dir, iter(files), output_dir, n_partitions=n_partitions)
+        with open(os.path.join(output_dir, VOCAB_FILENAME)) as f:
+            vocab = [line.rstrip('\n').split('\t') for line in f]
+        with open(os.path.join(output_dir, VOCABSIZE_FILENAME)) as f:
+            vocab_size = f.readline()
+        outputs.append((vocab, vocab_size))
+
+    (vocab, vocab_size), (partitioned_vocab, partitioned_vocab_size) = outputs
+    assert sorted(vocab) == sorted(partitioned_vocab)
+    assert [int(freq) for _, freq in partitioned_vocab] == sorted((int(freq) for _, freq in vocab), reverse=True)
+    assert vocab_size == partitioned_vocab_size
+
+
+def test_merge_partitions_twice(tmpdir):
+    partition_dirs = []
+    for i, word_counts in enumerate([Counter({'a': 2, 'b': 1}), Counter({'c': 5})]):
+        partition_dir = os.path.join(str(tmpdir), 'partitions', str(i))
+        os.makedirs(partition_dir)
+        dump_partial_vocab(PartialVocab(word_counts), os.path.join(partition_dir, f'1.{PARTVOCAB_EXT}'))
+        # left by an interrupted dump
+        open(os.path.join(partition_dir, f'2.{PARTVOCAB_EXT}.part'), 'w').close()
+        partition_dirs.append(partition_dir)
+
+    vocab_file = os.path.join(str(tmpdir), VOCAB_FILENAME)
+    vocab_size_file = os.path.join(str(tmpdir), VOCABSIZE_FILENAME)
+    outputs = []
+    for _ in range(2):
+        merge_partitions(partition_dirs, 1, vocab_file, vocab_size_file)
+        with open(vocab_file) as f, open(vocab_size_file) as g:
+            outputs.append((f.read(), g.read()))
+
+    assert outputs[0] == outputs[1]
+    assert ['c\t5', 'a\t2', 'b\t1'] == outputs[0][0].splitlines()
+
+
+def test_limit_max_vocab_same_as_with_full_sort():
+    rnd = random.Random(13)
+    for _ in range(100):
+        word_counts = Counter({f'w{i}': rnd.randint(1, 6) for i in range(rnd.randint(1, 30))})
+        threshold = rnd.randint(0, 32)
+
+        sorted_vocab = sorted(word_counts.items(), key=lambda x: x[1], reverse=True)
+        if threshold >= len(sorted_vocab):
+            expected = dict(word_counts)
+        else:
+            min_freq_excluded = sorted_vocab[threshold][1]
+            expected = {k: v for k, v in sorted_vocab if v > min_freq_excluded}
+
+        vocab = PartialVocab(word_counts)
+        vocab.limit_max_vocab(threshold)
+
+        assert list(expected.items()) == list(vocab.merged_word_counts.items())
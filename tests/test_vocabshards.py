@@ -0,0 +1,56 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import random
+import shutil
+
+from codeprep.pipeline.vocab import calc_vocab, VOCAB_FILENAME, VOCABSIZE_FILENAME
+from codeprep.pipeline.vocabshards import update_vocab_shards
+
+
+def write_file(rnd: random.Random, path: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(' '.join(rnd.choice('abcdefghij') * rnd.randint(1, 3) for _ in range(rnd.randint(1, 20))) + '\n')
+
+
+def list_files(dataset_dir: str):
+    # in this test, the original files are the preprocessed ones
+    for root, _, files in os.walk(dataset_dir.encode()):
+        for file in files:
+            rel_path = os.path.join(os.path.relpath(root, dataset_dir.encode()), file)
+            yield rel_path, os.path.join(root, file), os.path.join(root, file)
+
+
+def read_vocab(output_dir: str):
+    with open(os.path.join(output_dir, VOCAB_FILENAME)) as f:
+        vocab = sorted(f.read().splitlines())
+    with open(os.path.join(output_dir, VOCABSIZE_FILENAME)) as f:
+        vocab_size = f.readline()
+    return vocab, vocab_size
+
+
+def test_update_vocab_shards_same_as_calc_vocab(tmpdir):
+    rnd = random.Random(19)
+    dataset_dir, store_dir = os.path.join(str(tmpdir), 'dataset'), os.path.join(str(tmpdir), 'store')
+    for repo in ['repo1', 'repo2', 'repo3']:
+        for i in range(rnd.randint(1, 4)):
+            write_file(rnd, os.path.join(dataset_dir, repo, 'src', f'{i}.txt'))
+    write_file(rnd, os.path.join(dataset_dir, 'top.txt'))
+
+    for step in range(4):
+        if step == 1:
+            write_file(rnd, os.path.join(dataset_dir, 'repo4', '0.txt'))
+        elif step == 2:
+            write_file(rnd, os.path.join(dataset_dir, 'repo1', 'src', 'new.txt'))
+            shutil.rmtree(os.path.join(dataset_dir, 'repo2'))
+
+        output_dir = os.path.join(str(tmpdir), f'output_{step}')
+        n_counted_shards = update_vocab_shards(list_files(dataset_dir), store_dir, output_dir)
+        expected_output_dir = os.path.join(str(tmpdir), f'expected_{step}')
+        calc_vocab(dataset_dir, (path for _, _, path in list_files(dataset_dir)), expected_output_dir)
+
+        assert [4, 1, 1, 0][step] == n_counted_shards
+        assert read_vocab(expected_output_dir) == read_vocab(output_dir)